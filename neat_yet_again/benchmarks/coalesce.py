@@ -0,0 +1,54 @@
+# compares pushing small fragments of nodes straight into the way tile
+# network with coalescing them into bigger batches first.
+#
+# run from the neat_yet_again directory with:
+#
+#   python -m benchmarks.coalesce [num_nodes] [fragment_size] [max_rows]
+
+import sys
+import time
+
+from neat.external import Stream
+from neat.tiles import way_tiles
+
+
+def build(max_rows):
+    nodes = Stream(['id', 'version', 'lon', 'lat'])
+    ways = Stream(['id', 'version', 'nodes'])
+    if max_rows:
+        network_nodes = nodes.coalesce(max_rows)
+        network_ways = ways.coalesce(max_rows)
+    else:
+        network_nodes, network_ways = nodes, ways
+    out = way_tiles(network_nodes, network_ways).\
+        projection(['tile', 'id', 'version'])
+    return nodes, ways, out.collect_rows()
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    fragment = int(argv[2]) if len(argv) > 2 else 2
+    max_rows = int(argv[3]) if len(argv) > 3 else 1000
+
+    node_rows = [(i, 1, (i % 360) - 180.0, (i % 180) - 90.0)
+                 for i in range(n)]
+    way_rows = [(w, 1, tuple(range(w * 10, w * 10 + 10)))
+                for w in range(n // 10)]
+
+    for size in (0, max_rows):
+        nodes, ways, collector = build(size)
+        start = time.time()
+        for i in range(0, n, fragment):
+            nodes.push_rows(node_rows[i:i + fragment])
+            if i % 10 == 0:
+                ways.push_rows(way_rows[i // 10:i // 10 + 1])
+        nodes.flush()
+        ways.flush()
+        secs = time.time() - start
+        print("%-22s %8.3fs  %10.0f nodes/s  %d rows out"
+              % ('coalesced to %d' % size if size else 'fragments of %d'
+                 % fragment, secs, n / secs, len(collector.fetch())))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
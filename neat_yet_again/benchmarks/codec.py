@@ -0,0 +1,73 @@
+# compares the size and speed of the binary codecs in neat.codec against
+# pickle and marshal, for nodes and for the rows kept by deduplicators.
+#
+# run from the neat_yet_again directory with:
+#
+#   python -m benchmarks.codec [num_items]
+
+import marshal
+import sys
+import time
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from neat.codec import NodeCodec, RowCodec
+
+
+class PickleCodec(object):
+    def encode(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+class MarshalCodec(object):
+    def encode(self, value):
+        return marshal.dumps(value, 2)
+
+    def decode(self, data):
+        return marshal.loads(data)
+
+
+def measure(name, codec, items):
+    start = time.time()
+    encoded = [codec.encode(i) for i in items]
+    encode_secs = time.time() - start
+
+    start = time.time()
+    for e in encoded:
+        codec.decode(e)
+    decode_secs = time.time() - start
+
+    size = sum(len(e) for e in encoded) / float(len(items))
+    print("%-14s %6.1f bytes/item  encode %9.0f/s  decode %9.0f/s"
+          % (name, size, len(items) / encode_secs, len(items) / decode_secs))
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100000
+
+    nodes = [dict(lon=(i % 360) - 180.0 + 0.1234567,
+                  lat=(i % 180) - 90.0 + 0.7654321,
+                  timestamp=1500000000 + i, changeset=40000000 + i,
+                  uid=i % 1000 or None, deleted=False,
+                  tags={u'highway': u'bus_stop'} if i % 10 == 0 else {})
+             for i in range(n)]
+    print("nodes:")
+    measure('pickle', PickleCodec(), nodes)
+    measure('marshal', MarshalCodec(), nodes)
+    measure('NodeCodec', NodeCodec(), nodes)
+
+    rows = [(u'%d/%d' % (i % 360, i % 180), i, 1) for i in range(n)]
+    print("(tile, id, version) rows:")
+    measure('pickle', PickleCodec(), rows)
+    measure('marshal', MarshalCodec(), rows)
+    measure('RowCodec', RowCodec(['text', 'int64', 'int64']), rows)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,48 @@
+# measures how fast neat.pbf decodes a generated PBF file with different
+# numbers of worker processes, to see how decoding scales with cores.
+#
+# run from the neat_yet_again directory with:
+#
+#   python -m benchmarks.pbf [num_nodes] [max_processes]
+
+import multiprocessing
+import random
+import sys
+from io import BytesIO
+
+from neat.pbf import push_pbf
+from tests.pbf_tests import encode_pbf
+
+
+def generate(num_nodes, nodes_per_way=10, seed=0):
+    rng = random.Random(seed)
+    nodes = [dict(id=i, version=1, changeset=i // 100, uid=i % 1000,
+                  user='user%d' % (i % 1000), timestamp=1500000000 + i,
+                  lon=round(rng.uniform(-10, 10), 7),
+                  lat=round(rng.uniform(-10, 10), 7),
+                  tags={'highway': 'bus_stop'} if i % 10 == 0 else {})
+             for i in range(1, num_nodes + 1)]
+    ways = [dict(id=w, version=1, changeset=1,
+                 nodes=list(range((w - 1) * nodes_per_way + 1,
+                                  w * nodes_per_way + 1)),
+                 tags={'highway': 'residential'})
+            for w in range(1, num_nodes // nodes_per_way + 1)]
+    return encode_pbf(nodes, ways)
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 200000
+    max_processes = int(argv[2]) if len(argv) > 2 \
+        else multiprocessing.cpu_count()
+    data = generate(n)
+    print("%d bytes of PBF" % len(data))
+
+    processes = 1
+    while processes <= max_processes:
+        stats = push_pbf(BytesIO(data), processes=processes)
+        print("%2d processes: %r" % (processes, stats))
+        processes *= 2
+
+
+if __name__ == '__main__':
+    main(sys.argv)
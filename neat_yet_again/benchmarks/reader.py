@@ -0,0 +1,57 @@
+# measures how fast neat.reader reads OSM XML, on its own and while pushing
+# into the node and way tile networks from neat.tiles, on a generated file.
+#
+# run from the neat_yet_again directory with:
+#
+#   python -m benchmarks.reader [num_nodes] [batch_size]
+
+import random
+import sys
+from io import BytesIO
+
+from neat.external import Stream
+from neat.reader import push_osm
+from neat.tiles import node_tiles, way_tiles
+
+
+def generate(num_nodes, nodes_per_way=10, seed=0):
+    rng = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<osm version="0.6" generator="benchmark">']
+    for i in range(1, num_nodes + 1):
+        lines.append(
+            '<node id="%d" version="1" timestamp="2012-03-04T05:06:07Z" '
+            'changeset="%d" lat="%.7f" lon="%.7f">'
+            % (i, i // 100, rng.uniform(-10, 10), rng.uniform(-10, 10)))
+        if i % 10 == 0:
+            lines.append('<tag k="highway" v="bus_stop"/>')
+        lines.append('</node>')
+    for w in range(1, num_nodes // nodes_per_way + 1):
+        lines.append('<way id="%d" version="1" changeset="1">' % w)
+        for i in range(nodes_per_way):
+            lines.append('<nd ref="%d"/>' % ((w - 1) * nodes_per_way + i + 1))
+        lines.append('<tag k="highway" v="residential"/>')
+        lines.append('</way>')
+    lines.append('</osm>')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    batch_size = int(argv[2]) if len(argv) > 2 else 1000
+    data = generate(n)
+    print("%d bytes of XML" % len(data))
+
+    stats = push_osm(BytesIO(data), batch_size=batch_size)
+    print("read only:        %r" % stats)
+
+    nodes = Stream(['id', 'version', 'lon', 'lat'])
+    ways = Stream(['id', 'version', 'nodes'])
+    node_tiles(nodes).projection(['tile', 'id', 'version'])
+    way_tiles(nodes, ways).projection(['tile', 'id', 'version'])
+    stats = push_osm(BytesIO(data), nodes, ways, batch_size)
+    print("into tile Streams: %r" % stats)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,59 @@
+# compares the natural join engines in neat.relation on synthetic data shaped
+# like node versions joined against way-node memberships.
+#
+# run from the neat_yet_again directory with:
+#
+#   python -m benchmarks.relation_join [num_nodes]
+
+import random
+import sys
+import time
+
+from neat.relation import Relation
+
+
+def make_relations(num_nodes, versions=3, ways_per_node=2):
+    rng = random.Random(1)
+
+    nodes = Relation(['node_id', 'version', 'lon', 'lat'])
+    for node_id in range(num_nodes):
+        for version in range(1, versions + 1):
+            nodes.tuples.add((node_id, version, rng.uniform(-180, 180),
+                              rng.uniform(-90, 90)))
+
+    way_nodes = Relation(['id', 'node_id'])
+    for node_id in range(num_nodes):
+        for _ in range(ways_per_node):
+            way_nodes.tuples.add((rng.randrange(num_nodes // 10 + 1),
+                                  node_id))
+
+    return nodes, way_nodes
+
+
+def timed(func):
+    start = time.time()
+    result = func()
+    return time.time() - start, result
+
+
+def main(argv):
+    num_nodes = int(argv[1]) if len(argv) > 1 else 2000
+    nodes, way_nodes = make_relations(num_nodes)
+    print("nodes: %d tuples, way_nodes: %d tuples"
+          % (len(nodes.tuples), len(way_nodes.tuples)))
+
+    reference = None
+    for method in ('nested', 'hash', 'merge'):
+        secs, result = timed(
+            lambda: way_nodes.natural_join(nodes, method=method))
+        if reference is None:
+            reference = (secs, result)
+        assert result == reference[1], "%s join gave a different result" \
+            % method
+        print("%-6s %8.3fs  %6.1fx  (%d tuples)"
+              % (method, secs, reference[0] / max(secs, 1e-9),
+                 len(result.tuples)))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
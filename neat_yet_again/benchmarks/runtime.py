@@ -0,0 +1,64 @@
+# compares reading and tiling a generated OSM file into a slow sink, which
+# sleeps for each batch as a disk or remote store might, with and without
+# running the sink in a thread of its own.
+#
+# run from the neat_yet_again directory with:
+#
+#   python -m benchmarks.runtime [num_nodes] [sink_millis]
+
+import sys
+import time
+from io import BytesIO
+
+from benchmarks.reader import generate
+from neat.external import Stream
+from neat.reader import push_osm
+from neat.runtime import Runtime
+from neat.tiles import node_tiles, way_tiles
+
+
+class SlowSink(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.rows = 0
+
+    def push_rows(self, rows):
+        time.sleep(self.seconds)
+        self.rows += len(rows)
+
+
+def run(data, seconds, runtime):
+    nodes = Stream(['id', 'version', 'lon', 'lat'])
+    ways = Stream(['id', 'version', 'nodes'])
+    sinks = list()
+    for tiles in (node_tiles(nodes), way_tiles(nodes, ways)):
+        out = tiles.projection(['tile', 'id', 'version'])
+        if runtime is not None:
+            out = runtime.decouple(out)
+        # each decoupled edge needs a sink of its own, which only its
+        # thread pushes to.
+        sinks.append(SlowSink(seconds))
+        out.add_listener(sinks[-1])
+
+    start = time.time()
+    if runtime is None:
+        push_osm(BytesIO(data), nodes, ways)
+    else:
+        inlets = runtime.inlet(nodes, ways)
+        with runtime:
+            push_osm(BytesIO(data), *inlets)
+    return time.time() - start, sum(s.rows for s in sinks)
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 50000
+    seconds = float(argv[2]) / 1000 if len(argv) > 2 else 0.05
+    data = generate(n)
+
+    for name, runtime in (('synchronous', None), ('runtime', Runtime())):
+        secs, rows = run(data, seconds, runtime)
+        print("%-12s %8.3fs  %d rows out" % (name, secs, rows))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,71 @@
+# compares the single-process join of node tiles to ways with the sharded
+# join at different numbers of shards, and prints the load on each shard.
+#
+# run from the neat_yet_again directory with:
+#
+#   python -m benchmarks.sharded_join [num_nodes] [max_shards]
+
+import multiprocessing
+import random
+import sys
+import time
+
+from neat.external import Stream
+from neat.sharded import sharded_natural_join
+
+
+def batches(n, seed=0):
+    rng = random.Random(seed)
+    result = list()
+    for start in range(0, n, 1000):
+        result.append((0, [(u'%d/%d' % (rng.randrange(100),
+                                        rng.randrange(100)), i)
+                           for i in range(start, start + 1000)]))
+        # every tenth node is shared by lots of ways, as bus stops and
+        # junctions are.
+        result.append((1, [(rng.randrange(n) // 10 * 10
+                            if rng.random() < 0.2 else rng.randrange(n), w)
+                           for w in range(start, start + 1000)]))
+    return result
+
+
+def run(data, shards):
+    tiles = Stream(['tile', 'node_id'])
+    way_nodes = Stream(['node_id', 'id'])
+    if shards:
+        out, js = sharded_natural_join(tiles, way_nodes, shards)
+    else:
+        out, js = tiles.natural_join(way_nodes), None
+    collector = out.collect_rows()
+
+    start = time.time()
+    count = 0
+    for pos, rows in data:
+        (tiles, way_nodes)[pos].push_rows(rows)
+        count += len(collector.fetch())
+    secs = time.time() - start
+    if js is not None:
+        js.close()
+    return secs, count, js
+
+
+def main(argv):
+    n = int(argv[1]) if len(argv) > 1 else 200000
+    max_shards = int(argv[2]) if len(argv) > 2 \
+        else multiprocessing.cpu_count()
+    data = batches(n)
+
+    secs, count, _ = run(data, 0)
+    print("single process %8.3fs  %d rows out" % (secs, count))
+    shards = 1
+    while shards <= max_shards:
+        secs, count, js = run(data, shards)
+        print("%2d shards      %8.3fs  %d rows out  skew %.2f"
+              % (shards, secs, count, js.skew))
+        for stats in js.stats:
+            print("    %r" % stats)
+        shards *= 2
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,45 @@
+# compares pushing rows through a chain of stateless Stream operators with and
+# without fusing the chain into a single push function.
+#
+# run from the neat_yet_again directory with:
+#
+#   python -m benchmarks.stream_fusion [num_rows]
+
+import sys
+import time
+
+from neat.external import Stream
+from neat.fusion import compile_network
+from neat.tiles import tile
+
+
+def build(compiled):
+    nodes = Stream(['id', 'version', 'lon', 'lat'])
+    out = nodes.join_func(['lon', 'lat'], 'tile', tile).\
+        rename(['node_id', 'node_version', 'x', 'y', 'tile']).\
+        projection(['tile', 'node_id', 'node_version'], dedup=False).\
+        rename(['tile', 'id', 'version'])
+    collector = out.collect_rows()
+    if compiled:
+        compile_network(nodes)
+    return nodes, collector
+
+
+def main(argv):
+    num_rows = int(argv[1]) if len(argv) > 1 else 200000
+    rows = [(i, 1, (i % 360) - 180.0, (i % 180) - 90.0)
+            for i in range(num_rows)]
+
+    for compiled in (False, True):
+        nodes, collector = build(compiled)
+        start = time.time()
+        for i in range(0, num_rows, 1000):
+            nodes.push_rows(rows[i:i + 1000])
+        secs = time.time() - start
+        assert len(collector.fetch()) == num_rows
+        print("%-8s %8.3fs  %10.0f rows/s"
+              % ('fused' if compiled else 'unfused', secs, num_rows / secs))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,262 @@
+# columnar record batches, for pushing data through a network of Streams a
+# column at a time rather than a row at a time.
+
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class RecordBatch(object):
+    """
+    A batch of rows stored as one column per attribute in `attr_names`. Each
+    column is a sequence of the same length; either a `list` or, if NumPy is
+    available, a one-dimensional array.
+
+    Batches are treated as immutable. Operations which select, rename or add
+    columns share the existing columns rather than copying them.
+    """
+
+    def __init__(self, attr_names, columns):
+        assert len(columns) == len(attr_names), \
+            "Record batch has %d columns, but attributes %r." \
+            % (len(columns), attr_names)
+
+        self.attr_names = attr_names
+        self.columns = columns
+
+    @classmethod
+    def from_rows(cls, attr_names, rows):
+        if rows:
+            columns = [list(c) for c in zip(*rows)]
+        else:
+            columns = [list() for _ in attr_names]
+        return cls(attr_names, columns)
+
+    @classmethod
+    def concat(cls, attr_names, batches):
+        """
+        Builds a batch of all the rows in `batches`, in order.
+        """
+
+        columns = list()
+        for i in range(len(attr_names)):
+            parts = [b.columns[i] for b in batches]
+            if np is not None and parts and \
+                    all(isinstance(c, np.ndarray) for c in parts):
+                columns.append(np.concatenate(parts))
+            else:
+                column = list()
+                for c in parts:
+                    column.extend(_to_list(c))
+                columns.append(column)
+        return cls(attr_names, columns)
+
+    @classmethod
+    def from_mapping(cls, attr_names, mapping):
+        """
+        Builds a batch from a `mapping` of attribute name to column, taking
+        the columns in the order of `attr_names`.
+        """
+        return cls(attr_names, [mapping[n] for n in attr_names])
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def column(self, name):
+        return self.columns[self.attr_names.index(name)]
+
+    def rows(self):
+        """
+        Returns the batch as a list of row tuples of plain Python values.
+        """
+
+        columns = [_to_list(c) for c in self.columns]
+        if not columns:
+            return []
+        return list(zip(*columns))
+
+    def renamed(self, attr_names):
+        return RecordBatch(attr_names, self.columns)
+
+    def select(self, indices, attr_names):
+        return RecordBatch(attr_names, [self.columns[i] for i in indices])
+
+    def with_column(self, name, values):
+        return RecordBatch(self.attr_names + [name], self.columns + [values])
+
+    def take(self, indices):
+        """
+        Returns a new batch with only the rows at `indices`, in that order.
+        """
+
+        columns = list()
+        for c in self.columns:
+            if np is not None and isinstance(c, np.ndarray):
+                columns.append(c[np.asarray(indices, dtype=np.intp)])
+            else:
+                columns.append([c[i] for i in indices])
+        return RecordBatch(self.attr_names, columns)
+
+    def __repr__(self):
+        return "RecordBatch(%r, %r)" % (self.attr_names, self.columns)
+
+
+class BatchCollector(object):
+    """
+    Collects the record batches output by a Stream until `fetch()` is called,
+    which returns the list of batches and resets it. Rows pushed to it are
+    collected as batches too.
+    """
+
+    def __init__(self, attr_names):
+        self._attr_names = attr_names
+        self._batches = list()
+
+    def push_batch(self, batch):
+        self._batches.append(batch)
+
+    def push_rows(self, rows):
+        self._batches.append(RecordBatch.from_rows(self._attr_names, rows))
+
+    def fetch(self):
+        batches = self._batches
+        self._batches = list()
+        return batches
+
+
+class Coalescer(object):
+    """
+    Buffers the rows and batches pushed to it, and releases them to its
+    listeners all at once when there are at least `max_rows` rows, or when
+    the oldest has been waiting for `max_seconds` by `clock`, or when
+    `flush()` is called. Put in front of a network which is pushed lots of
+    small fragments, this costs one run of the network per release rather
+    than one per fragment.
+
+    Time is only checked when something is pushed, so a quiet producer
+    should call `flush()` when it's done, for example at the end of each
+    diff. Everything is released in the order it was pushed: as rows if
+    only rows were pushed, and otherwise as a single batch.
+    """
+
+    def __init__(self, attr_names, max_rows=1000, max_seconds=None,
+                 clock=time.time):
+        if max_rows < 1:
+            raise ValueError("Coalescer needs max_rows >= 1, not %r"
+                             % (max_rows,))
+
+        self.attr_names = attr_names
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self._clock = clock
+        # the rows and batches pushed, in order, as (is_batch, fragment).
+        self._fragments = list()
+        self._has_batches = False
+        self._count = 0
+        self._since = None
+        self._listeners = list()
+        # number of times the buffer has been released downstream.
+        self.releases = 0
+
+    def push_rows(self, rows):
+        if rows:
+            fragments = self._fragments
+            if fragments and not fragments[-1][0]:
+                fragments[-1][1].extend(rows)
+            else:
+                fragments.append((False, list(rows)))
+            self._buffered(len(rows))
+
+    def push_batch(self, batch):
+        if len(batch):
+            self._fragments.append((True, batch))
+            self._has_batches = True
+            self._buffered(len(batch))
+
+    def flush(self):
+        """
+        Releases anything buffered, then flushes the listeners.
+        """
+
+        self._release()
+        for listener in self._listeners:
+            flush_to(listener)
+
+    def _buffered(self, n):
+        if self._since is None:
+            self._since = self._clock()
+        self._count += n
+        if self._count >= self.max_rows or (
+                self.max_seconds is not None and
+                self._clock() - self._since >= self.max_seconds):
+            self._release()
+
+    def _release(self):
+        if not self._count:
+            return
+        fragments, self._fragments = self._fragments, list()
+        has_batches, self._has_batches = self._has_batches, False
+        self._count = 0
+        self._since = None
+        self.releases += 1
+
+        if not has_batches:
+            # consecutive rows are kept as a single fragment.
+            rows = fragments[0][1]
+            for listener in self._listeners:
+                listener.push_rows(rows)
+            return
+
+        batches = [f if is_batch else RecordBatch.from_rows(
+                       self.attr_names, f)
+                   for is_batch, f in fragments]
+        batch = batches[0] if len(batches) == 1 else \
+            RecordBatch.concat(self.attr_names, batches)
+        for listener in self._listeners:
+            push_batch_to(listener, batch)
+
+
+def flush_to(listener):
+    """
+    Flushes `listener`, if it's something which can buffer rows.
+    """
+
+    flush = getattr(listener, 'flush', None)
+    if flush is not None:
+        flush()
+
+
+def push_batch_to(listener, batch):
+    """
+    Pushes `batch` to `listener`, converting it to rows if the listener
+    doesn't understand batches.
+    """
+
+    push_batch = getattr(listener, 'push_batch', None)
+    if push_batch is not None:
+        push_batch(batch)
+    else:
+        listener.push_rows(batch.rows())
+
+
+def call_columns(func, columns, n):
+    """
+    Calls a vectorized `func` with whole `columns`, and returns its result
+    as a column of length `n`.
+    """
+
+    values = func(*columns)
+    assert len(values) == n, \
+        "Function result has %d rows, expected %d." % (len(values), n)
+    return values
+
+
+def _to_list(column):
+    if np is not None and isinstance(column, np.ndarray):
+        return column.tolist()
+    return column
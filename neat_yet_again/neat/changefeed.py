@@ -0,0 +1,212 @@
+# an append-only feed of the changes output by NEAT, for downstream layers to
+# follow.
+#
+# each batch of (element, tile) output is appended to a directory as a new,
+# numbered segment file, which is never changed afterwards. a segment starts
+# with an index of the tiles in it, giving the offset and size of each tile's
+# elements, so a consumer interested in one tile reads only that tile's part
+# of the segment. a log of which tiles are in which segment is appended to
+# as well, so that a consumer following one tile doesn't open the segments
+# which don't mention it at all.
+#
+# segments are numbered from 1, so a consumer which has seen nothing asks
+# for everything since 0. elements and tiles are stored with marshal, as in
+# neat.trie.
+
+import marshal
+import os
+import struct
+
+from neat.trie import TrieWriter
+
+_HEADER_SIZE = struct.Struct('<I')
+
+_SEGMENT = '%010d.seg'
+_TILES_LOG = 'tiles.log'
+
+
+class Changefeed(object):
+    """
+    A changefeed in the directory `path`, which is created if it doesn't
+    exist. Opening an existing feed carries on from its last segment.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        # tile -> list of the sequence numbers of segments containing it.
+        self._tiles = dict()
+        self.latest = 0
+        # number of segment files opened, for seeing how much work reading
+        # from the feed does.
+        self.reads = 0
+
+        logged = set()
+        log_path = os.path.join(path, _TILES_LOG)
+        if os.path.exists(log_path):
+            with open(log_path, 'r+b') as f:
+                records, end = _read_log(f.read())
+                # drop any partly written record at the end, so that new
+                # records follow on from the last whole one.
+                f.truncate(end)
+            for seq, tiles in records:
+                self._add_tiles(seq, tiles)
+                logged.add(seq)
+
+        for seq in self._sequences():
+            # a segment which was written, but not logged before a crash.
+            if seq not in logged:
+                with open(self._segment_path(seq), 'rb') as f:
+                    tiles = [t[0] for t in _read_header(f)[0]]
+                self._log(seq, tiles)
+            self.latest = max(self.latest, seq)
+
+    def append(self, pairs):
+        """
+        Appends a batch of `(element, tile)` pairs as a new segment, and
+        returns its sequence number. Empty batches aren't written, and
+        return None.
+        """
+
+        if not pairs:
+            return None
+
+        by_tile = dict()
+        for element, tile in pairs:
+            by_tile.setdefault(tile, set()).add(element)
+
+        seq = self.latest + 1
+        path = self._segment_path(seq)
+        with open(path + '.tmp', 'wb') as f:
+            _write_segment(f, by_tile)
+        os.rename(path + '.tmp', path)
+
+        self._log(seq, sorted(by_tile))
+        self.latest = seq
+        return seq
+
+    def since(self, seq):
+        """
+        Yields `(seq, element, tile)` for everything appended after the
+        segment `seq`, in order of segment and then tile.
+        """
+
+        for s in range(seq + 1, self.latest + 1):
+            with self._open(s) as f:
+                header, base = _read_header(f)
+                for entry in header:
+                    tile = entry[0]
+                    for element in _read_elements(f, base, entry):
+                        yield s, element, tile
+
+    def tile_since(self, tile, seq):
+        """
+        Yields `(seq, element)` for everything appended to `tile` after the
+        segment `seq`. Only segments containing the tile are read.
+        """
+
+        for s in self._tiles.get(tile, ()):
+            if s <= seq:
+                continue
+            with self._open(s) as f:
+                header, base = _read_header(f)
+                for entry in header:
+                    if entry[0] == tile:
+                        for element in _read_elements(f, base, entry):
+                            yield s, element
+
+    def tiles_since(self, seq):
+        """
+        Returns the set of tiles which have changed after the segment `seq`.
+        """
+
+        return set(t for t, seqs in self._tiles.items() if seqs[-1] > seq)
+
+    def _segment_path(self, seq):
+        return os.path.join(self.path, _SEGMENT % seq)
+
+    def _open(self, seq):
+        self.reads += 1
+        return open(self._segment_path(seq), 'rb')
+
+    def _sequences(self):
+        return sorted(int(n.split('.')[0]) for n in os.listdir(self.path)
+                      if n.endswith('.seg'))
+
+    def _add_tiles(self, seq, tiles):
+        for tile in tiles:
+            self._tiles.setdefault(tile, list()).append(seq)
+
+    def _log(self, seq, tiles):
+        data = marshal.dumps((seq, tiles), 2)
+        with open(os.path.join(self.path, _TILES_LOG), 'ab') as f:
+            f.write(_HEADER_SIZE.pack(len(data)))
+            f.write(data)
+        self._add_tiles(seq, tiles)
+
+
+class ChangefeedWriter(TrieWriter):
+    """
+    A Stream listener which appends each batch of rows it's pushed to the
+    changefeed `feed`, as one segment. Rows are turned into `(element,
+    tile)` pairs as by `TrieWriter`.
+    """
+
+    def push_rows(self, rows):
+        self._sink.append(self._pairs(rows))
+
+
+def _write_segment(f, by_tile):
+    header = list()
+    blobs = list()
+    for tile in sorted(by_tile):
+        data = marshal.dumps(sorted(by_tile[tile]), 2)
+        header.append((tile, len(data), len(by_tile[tile])))
+        blobs.append(data)
+
+    header = marshal.dumps(header, 2)
+    f.write(_HEADER_SIZE.pack(len(header)))
+    f.write(header)
+    for data in blobs:
+        f.write(data)
+
+
+def _read_header(f):
+    """
+    Returns the index at the start of a segment, as a list of `(tile, size,
+    count, offset)`, and the offset at which the elements start.
+    """
+
+    size = _HEADER_SIZE.unpack(f.read(_HEADER_SIZE.size))[0]
+    header = marshal.loads(f.read(size))
+    offset = 0
+    entries = list()
+    for tile, length, count in header:
+        entries.append((tile, length, count, offset))
+        offset += length
+    return entries, _HEADER_SIZE.size + size
+
+
+def _read_elements(f, base, entry):
+    f.seek(base + entry[3])
+    return marshal.loads(f.read(entry[1]))
+
+
+def _read_log(data):
+    """
+    Returns the list of `(seq, tiles)` records in the tiles log `data`, and
+    the offset of the end of the last whole record.
+    """
+
+    records = list()
+    pos = 0
+    while pos + _HEADER_SIZE.size <= len(data):
+        size = _HEADER_SIZE.unpack_from(data, pos)[0]
+        end = pos + _HEADER_SIZE.size + size
+        if end > len(data):
+            break
+        records.append(marshal.loads(data[pos + _HEADER_SIZE.size:end]))
+        pos = end
+    return records, pos
@@ -0,0 +1,307 @@
+# compact binary encodings for OSM elements and rows.
+#
+# nodes and ways follow the `Node`, `Common` and `Tag` structures in
+# neat4.capnp: a fixed-width little-endian header holding the coordinates,
+# timestamp, changeset, the uid union and the deleted flag, followed by the
+# tags. the element id and version aren't included, since they're in the
+# key (see neat.keys). coordinates are stored as 32-bit fixed point with
+# 7 decimal places, as osmium does.
+#
+# the tags are laid out as a table of (key length, value length) pairs and
+# then the concatenated UTF-8 strings, so that the fixed fields can be read
+# straight out of a buffer with `NodeView` and `WayView` without decoding,
+# or copying, any of the rest.
+#
+# every codec here has the same `encode(value)` and `decode(data)` interface,
+# so that they can be passed to the stores in neat.store.
+
+import marshal
+import struct
+
+COORDINATE_PRECISION = 10000000
+
+# lon, lat, then the common fields: timestamp, changeset, uid, flags and the
+# number of tags.
+_NODE = struct.Struct('<iiQQiBH')
+# the common fields, then the number of node references.
+_WAY = struct.Struct('<QQiBHI')
+
+_DELETED = 1
+_ANONYMOUS = 2
+
+
+def _flags(element):
+    flags = 0
+    if element.get('deleted'):
+        flags |= _DELETED
+    if element.get('uid') is None:
+        flags |= _ANONYMOUS
+    return flags
+
+
+def _encode_tags(tags):
+    """
+    Encodes a dict of `tags` as a table of lengths followed by the strings.
+    """
+
+    lengths = list()
+    data = list()
+    for k, v in sorted(tags.items()):
+        k = k.encode('utf-8')
+        v = v.encode('utf-8')
+        lengths.append(len(k))
+        lengths.append(len(v))
+        data.append(k)
+        data.append(v)
+    table = struct.pack('<%dH' % len(lengths), *lengths)
+    return table + b''.join(data)
+
+
+def _decode_tags(buf, offset, count):
+    lengths = struct.unpack_from('<%dH' % (2 * count), buf, offset)
+    pos = offset + 4 * count
+    tags = dict()
+    for i in range(count):
+        k_end = pos + lengths[2 * i]
+        v_end = k_end + lengths[2 * i + 1]
+        tags[buf[pos:k_end].tobytes().decode('utf-8')] = \
+            buf[k_end:v_end].tobytes().decode('utf-8')
+        pos = v_end
+    return tags
+
+
+def encode_node(node):
+    """
+    Encodes a `node` dict, with `lon` and `lat` in degrees and optionally
+    `timestamp`, `changeset`, `uid` (None for anonymous), `deleted` and
+    `tags`.
+    """
+
+    tags = node.get('tags') or {}
+    header = _NODE.pack(
+        int(round(node['lon'] * COORDINATE_PRECISION)),
+        int(round(node['lat'] * COORDINATE_PRECISION)),
+        node.get('timestamp', 0), node.get('changeset', 0),
+        node.get('uid') or 0, _flags(node), len(tags))
+    return header + _encode_tags(tags)
+
+
+def encode_way(way):
+    """
+    Encodes a `way` dict, with the list of node ids in `nodes` and the same
+    optional fields as `encode_node`.
+    """
+
+    tags = way.get('tags') or {}
+    nodes = way['nodes']
+    header = _WAY.pack(
+        way.get('timestamp', 0), way.get('changeset', 0),
+        way.get('uid') or 0, _flags(way), len(tags), len(nodes))
+    refs = struct.pack('<%dq' % len(nodes), *nodes)
+    return header + refs + _encode_tags(tags)
+
+
+class _ElementView(object):
+    """
+    Read-only access to the fields of an encoded element, without copying
+    it. The fixed-width header is unpacked when the view is made, and the
+    tags and node references only when they're read.
+    """
+
+    _fields = ()
+
+    def __init__(self, data):
+        self._buf = memoryview(data)
+
+    @property
+    def deleted(self):
+        return bool(self._flags & _DELETED)
+
+    @property
+    def uid(self):
+        if self._flags & _ANONYMOUS:
+            return None
+        return self._uid
+
+    @property
+    def tags(self):
+        return _decode_tags(self._buf, self._tags_offset, self._num_tags)
+
+    def to_dict(self):
+        d = dict((n, getattr(self, n)) for n in self._fields)
+        d.update(deleted=self.deleted, uid=self.uid, tags=self.tags)
+        return d
+
+
+class NodeView(_ElementView):
+    """
+    A view of a node encoded by `encode_node`.
+    """
+
+    _fields = ('lon', 'lat', 'timestamp', 'changeset')
+
+    def __init__(self, data):
+        super(NodeView, self).__init__(data)
+        (self._lon, self._lat, self.timestamp, self.changeset, self._uid,
+         self._flags, self._num_tags) = _NODE.unpack_from(self._buf, 0)
+        self._tags_offset = _NODE.size
+
+    @property
+    def lon(self):
+        return self._lon / float(COORDINATE_PRECISION)
+
+    @property
+    def lat(self):
+        return self._lat / float(COORDINATE_PRECISION)
+
+
+class WayView(_ElementView):
+    """
+    A view of a way encoded by `encode_way`.
+    """
+
+    _fields = ('timestamp', 'changeset', 'nodes')
+
+    def __init__(self, data):
+        super(WayView, self).__init__(data)
+        (self.timestamp, self.changeset, self._uid, self._flags,
+         self._num_tags, self._num_nodes) = _WAY.unpack_from(self._buf, 0)
+        self._tags_offset = _WAY.size + 8 * self._num_nodes
+
+    @property
+    def nodes(self):
+        return list(struct.unpack_from('<%dq' % self._num_nodes, self._buf,
+                                       _WAY.size))
+
+
+class NodeCodec(object):
+    def encode(self, node):
+        return encode_node(node)
+
+    def decode(self, data):
+        return NodeView(data)
+
+
+class WayCodec(object):
+    def encode(self, way):
+        return encode_way(way)
+
+    def decode(self, data):
+        return WayView(data)
+
+
+try:
+    _LONG = long
+    _UNICODE = unicode
+except NameError:
+    _LONG = _UNICODE = None
+
+
+def _canonical(value):
+    """
+    Converts the longs in `value` which fit in an int to ints, and the
+    unicode strings which are plain ASCII to strs, so that values which are
+    equal on Python 2 have the same types.
+    """
+
+    if isinstance(value, tuple):
+        return tuple(_canonical(v) for v in value)
+    if isinstance(value, list):
+        return [_canonical(v) for v in value]
+    if isinstance(value, _LONG):
+        return int(value)
+    if isinstance(value, _UNICODE):
+        try:
+            return value.encode('ascii')
+        except UnicodeEncodeError:
+            return value
+    return value
+
+
+class MarshalCodec(object):
+    """
+    Encodes any tuple of built-in values with `marshal`. Version 0 of the
+    format marks neither interned strings nor back-references, and on
+    Python 2 ints and longs, and ASCII strs and unicode strings, are given
+    the same type before encoding, so equal values of those types always
+    encode to the same bytes, and encoded values can be used as keys. They
+    may decode with the other type.
+    """
+
+    def encode(self, value):
+        if _LONG is not None:
+            value = _canonical(value)
+        return marshal.dumps(value, 0)
+
+    def decode(self, data):
+        return marshal.loads(_bytes(data))
+
+
+# struct format for each fixed-width column type, as in neat.colfile. strings
+# are stored as their length, with the data after all the fixed fields.
+_ROW_FORMATS = {
+    'int64': 'q',
+    'float64': 'd',
+    'bytes': 'I',
+    'text': 'I',
+}
+
+
+class RowCodec(object):
+    """
+    Encodes rows of a fixed schema, given as a list of column `types` from
+    'int64', 'float64', 'bytes' and 'text'. All the fixed-width values of a
+    row are packed with a single precompiled struct, so rows are smaller
+    than with a self-describing format, and the encoding of a row is always
+    the same.
+    """
+
+    def __init__(self, types):
+        for t in types:
+            if t not in _ROW_FORMATS:
+                raise ValueError("Unknown column type %r, expected one of %r"
+                                 % (t, sorted(_ROW_FORMATS)))
+
+        self.types = list(types)
+        self._struct = struct.Struct(
+            '<' + ''.join(_ROW_FORMATS[t] for t in types))
+        self._strings = [i for i, t in enumerate(types)
+                         if t in ('bytes', 'text')]
+        self._text = [t == 'text' for t in types]
+
+    def encode(self, row):
+        if not self._strings:
+            return self._struct.pack(*row)
+
+        values = list(row)
+        data = list()
+        for i in self._strings:
+            v = values[i]
+            if self._text[i]:
+                v = v.encode('utf-8')
+            data.append(v)
+            values[i] = len(v)
+        return self._struct.pack(*values) + b''.join(data)
+
+    def decode(self, data):
+        values = self._struct.unpack_from(data, 0)
+        if not self._strings:
+            return values
+
+        values = list(values)
+        pos = self._struct.size
+        for i in self._strings:
+            end = pos + values[i]
+            v = _bytes(data[pos:end])
+            if self._text[i]:
+                v = v.decode('utf-8')
+            values[i] = v
+            pos = end
+        return tuple(values)
+
+
+def _bytes(data):
+    # on Python 2, `bytes` of a memoryview is its repr rather than its data.
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return bytes(data)
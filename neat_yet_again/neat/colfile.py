@@ -0,0 +1,291 @@
+# an on-disk columnar file format for relations.
+#
+# a relation is saved as a directory with a `meta.json` file describing the
+# attributes and one file per column. numeric columns are stored as
+# fixed-width little-endian values. string columns are stored as fixed-width
+# codes into a sorted dictionary of the distinct values, which is kept in a
+# separate file. sorting the dictionary means that the codes sort in the same
+# order as the strings they stand for.
+#
+# columns are memory-mapped when loaded, so loading is cheap and reading one
+# column doesn't touch the others.
+
+import json
+import mmap
+import os
+import struct
+
+from neat.relation import Relation
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    text_type = unicode
+    long_type = long
+except NameError:
+    text_type = str
+    long_type = int
+
+
+FORMAT_VERSION = 1
+
+# struct format character and NumPy dtype for the fixed-width values of each
+# column type. string columns are stored as codes into their dictionary.
+_LAYOUT = {
+    'int64': ('q', '<i8'),
+    'float64': ('d', '<f8'),
+    'bytes': ('I', '<u4'),
+    'text': ('I', '<u4'),
+}
+
+# number of values unpacked at a time when iterating over a column.
+_CHUNK = 4096
+
+
+def save(relation, path):
+    """
+    Saves `relation` to the directory `path`, which is created if it doesn't
+    exist. Any `Relation` or `ColumnarRelation` can be saved, as long as all
+    the values of each attribute are integers, floats or strings. Raises
+    `ValueError` for any other column.
+    """
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    names = relation.attribute_names
+    if hasattr(relation, 'columns'):
+        columns = [c.tolist() for c in relation.columns]
+    else:
+        rows = list(relation.tuples)
+        columns = [[t[i] for t in rows] for i in range(len(names))]
+
+    meta_columns = list()
+    for i, (name, values) in enumerate(zip(names, columns)):
+        col_type = _column_type(name, values)
+        fmt = _LAYOUT[col_type][0]
+
+        if col_type in ('bytes', 'text'):
+            dictionary = sorted(set(values))
+            codes = dict((v, c) for c, v in enumerate(dictionary))
+            values = [codes[v] for v in values]
+            _write_dictionary(os.path.join(path, '%d.dict' % i), dictionary,
+                              col_type)
+
+        with open(os.path.join(path, '%d.col' % i), 'wb') as f:
+            for start in range(0, len(values), _CHUNK):
+                chunk = values[start:start + _CHUNK]
+                f.write(struct.pack('<%d%s' % (len(chunk), fmt), *chunk))
+
+        meta_columns.append(dict(name=name, type=col_type))
+
+    # the metadata is written last, so that a directory with a `meta.json`
+    # is always complete.
+    rows = len(columns[0]) if columns else 0
+    meta = dict(version=FORMAT_VERSION, rows=rows, columns=meta_columns)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+
+
+def load(path):
+    """
+    Opens the relation saved in the directory `path`, returning a
+    `ColumnFile`.
+    """
+
+    return ColumnFile(path)
+
+
+class ColumnFile(object):
+    """
+    A relation saved by `save`, with its columns memory-mapped. Individual
+    columns can be read with `column`, or as NumPy arrays with `array`, and
+    the whole relation converted with `relation` or `columnar`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+
+        assert meta['version'] == FORMAT_VERSION, \
+            "Unknown column file version %r in %r" % (meta['version'], path)
+
+        self.rows = meta['rows']
+        self.attribute_names = [str(c['name']) for c in meta['columns']]
+        self._types = [c['type'] for c in meta['columns']]
+        self._columns = dict()
+
+    def column(self, name):
+        """
+        Returns the `MappedColumn` for the attribute `name`.
+        """
+
+        i = self.attribute_names.index(name)
+        col = self._columns.get(i)
+        if col is None:
+            col = MappedColumn(self.path, i, self._types[i], self.rows)
+            self._columns[i] = col
+        return col
+
+    def array(self, name):
+        """
+        Returns the column for the attribute `name` as a NumPy array. Numeric
+        columns are read-only arrays mapped straight onto the file.
+        """
+
+        return self.column(name).array()
+
+    def relation(self):
+        return Relation.from_columns(
+            self.attribute_names,
+            [list(self.column(n)) for n in self.attribute_names])
+
+    def columnar(self):
+        from neat.columnar import ColumnarRelation
+        return ColumnarRelation(self.attribute_names,
+                                [self.array(n) for n in self.attribute_names],
+                                distinct=True)
+
+    def close(self):
+        for col in self._columns.values():
+            col.close()
+        self._columns = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class MappedColumn(object):
+    """
+    One memory-mapped column of a `ColumnFile`. It can be indexed and
+    iterated over like a list, and values are only unpacked from the
+    mapping as they're read.
+    """
+
+    def __init__(self, path, i, col_type, rows):
+        self.type = col_type
+        self._fmt, self._dtype = _LAYOUT[col_type]
+        self._size = struct.calcsize('<' + self._fmt)
+        self._rows = rows
+        self._path = os.path.join(path, '%d.col' % i)
+        self._file = open(self._path, 'rb')
+        self._map = None
+        if rows:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+
+        self._dictionary = None
+        if col_type in ('bytes', 'text'):
+            self._dictionary = _read_dictionary(
+                os.path.join(path, '%d.dict' % i), col_type)
+
+    def __len__(self):
+        return self._rows
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._rows
+        if not 0 <= i < self._rows:
+            raise IndexError("column index out of range")
+
+        value = struct.unpack_from('<' + self._fmt, self._map,
+                                   i * self._size)[0]
+        if self._dictionary is not None:
+            value = self._dictionary[value]
+        return value
+
+    def __iter__(self):
+        for start in range(0, self._rows, _CHUNK):
+            n = min(_CHUNK, self._rows - start)
+            values = struct.unpack_from('<%d%s' % (n, self._fmt), self._map,
+                                        start * self._size)
+            if self._dictionary is not None:
+                dictionary = self._dictionary
+                values = [dictionary[v] for v in values]
+            for v in values:
+                yield v
+
+    def array(self):
+        if np is None:
+            raise ImportError("MappedColumn.array requires numpy")
+
+        if self._rows:
+            # a separate mapping owned by the array, so that it stays valid
+            # after this column is closed.
+            values = np.memmap(self._path, dtype=self._dtype, mode='r',
+                               shape=(self._rows,))
+        else:
+            values = np.zeros(0, dtype=self._dtype)
+
+        if self._dictionary is not None:
+            dictionary = np.empty(len(self._dictionary), dtype=object)
+            dictionary[:] = self._dictionary
+            values = dictionary[values]
+        return values
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+def _column_type(name, values):
+    if all(isinstance(v, (int, long_type)) for v in values):
+        return 'int64'
+    elif all(isinstance(v, (int, long_type, float)) for v in values):
+        return 'float64'
+    elif all(isinstance(v, bytes) for v in values):
+        return 'bytes'
+    elif all(isinstance(v, text_type) for v in values):
+        return 'text'
+    raise ValueError("Can't store column %r, its values must all be numbers "
+                     "or all be strings." % (name,))
+
+
+def _write_dictionary(path, dictionary, col_type):
+    """
+    Writes a dictionary of strings as a count, a table of end offsets and
+    then the concatenated strings.
+    """
+
+    encoded = [v.encode('utf-8') if col_type == 'text' else v
+               for v in dictionary]
+
+    offsets = list()
+    end = 0
+    for v in encoded:
+        end += len(v)
+        offsets.append(end)
+
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(struct.pack('<%dQ' % len(offsets), *offsets))
+        for v in encoded:
+            f.write(v)
+
+
+def _read_dictionary(path, col_type):
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    count = struct.unpack_from('<Q', data, 0)[0]
+    offsets = struct.unpack_from('<%dQ' % count, data, 8)
+    base = 8 + 8 * count
+
+    dictionary = list()
+    start = 0
+    for end in offsets:
+        v = data[base + start:base + end]
+        if col_type == 'text':
+            v = v.decode('utf-8')
+        dictionary.append(v)
+        start = end
+    return dictionary
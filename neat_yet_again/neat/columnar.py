@@ -0,0 +1,305 @@
+# a columnar variant of the relation in the algebraic data model, keeping one
+# NumPy array per attribute so that operators run over whole columns at a
+# time rather than one Python tuple at a time.
+
+from neat.relation import Relation
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class ColumnarRelation(object):
+    """
+    A relation stored as one NumPy array per attribute, in the same order as
+    `attribute_names`. It has the same set semantics as `Relation`: rows are
+    always distinct, and every operator returns a new `ColumnarRelation`.
+
+    Predicates passed to `selection` and functions passed to `join_func` with
+    `vectorized=True` are called with whole columns, so they should use NumPy
+    operations rather than Python control flow. A predicate written against a
+    tuple, such as `lambda t: t[0] % 2 == 0`, usually works unchanged, since
+    it gets a tuple of columns instead.
+    """
+
+    def __init__(self, attribute_names, columns=None, distinct=False):
+        if np is None:
+            raise ImportError("ColumnarRelation requires numpy")
+
+        self.attribute_names = attribute_names
+        if columns is None:
+            columns = [_column([]) for _ in attribute_names]
+        else:
+            columns = [_column(c) for c in columns]
+
+        assert len(columns) == len(attribute_names), \
+            "Columnar relation has %d columns, but attributes %r." \
+            % (len(columns), attribute_names)
+        lengths = set(len(c) for c in columns)
+        assert len(lengths) <= 1, \
+            "Columnar relation columns have different lengths %r." \
+            % (sorted(lengths),)
+
+        if not distinct and columns:
+            keep = _unique_row_indices(columns)
+            if len(keep) != len(columns[0]):
+                columns = [c[keep] for c in columns]
+
+        self.columns = columns
+
+    @classmethod
+    def from_relation(cls, relation):
+        rows = list(relation.tuples)
+        if rows:
+            columns = [list(c) for c in zip(*rows)]
+        else:
+            columns = [[] for _ in relation.attribute_names]
+        return cls(relation.attribute_names, columns, distinct=True)
+
+    def to_relation(self):
+        return Relation.from_columns(self.attribute_names,
+                                     [c.tolist() for c in self.columns])
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def column(self, name):
+        return self.columns[self.attribute_names.index(name)]
+
+    def union(self, other):
+        self._assert_compatible(other, "union")
+        if len(other) == 0:
+            return self
+        if len(self) == 0:
+            return other
+        columns = [_concat(a, b)
+                   for a, b in zip(self.columns, other.columns)]
+        return ColumnarRelation(self.attribute_names, columns)
+
+    def intersection(self, other):
+        self._assert_compatible(other, "intersection")
+        mask = self._rows_in(other)
+        return self._take(self.attribute_names, mask)
+
+    def difference(self, other):
+        self._assert_compatible(other, "difference")
+        mask = ~self._rows_in(other)
+        return self._take(self.attribute_names, mask)
+
+    def projection(self, new_attribute_names):
+        for n in new_attribute_names:
+            assert n in self.attribute_names, \
+                "Can't project attribute %r, not in relation %r" \
+                % (n, self.attribute_names)
+
+        columns = [self.column(n) for n in new_attribute_names]
+        return ColumnarRelation(new_attribute_names, columns)
+
+    def selection(self, pred):
+        mask = np.asarray(pred(tuple(self.columns)), dtype=bool)
+        return self._take(self.attribute_names, mask)
+
+    def rename(self, new_attribute_names):
+        assert len(new_attribute_names) == len(self.attribute_names), \
+            "New attribute names wrong length: len(%r) != len(%r)" \
+            % (new_attribute_names, self.attribute_names)
+
+        return ColumnarRelation(new_attribute_names, self.columns,
+                                distinct=True)
+
+    def join_func(self, arg_names, result_name, func, vectorized=False):
+        """
+        Appends a column `result_name` computed by `func` from the columns
+        `arg_names`. If `vectorized` is set, `func` is called once with whole
+        columns and must return a column of the same length. Otherwise it's
+        called per row, as with `Relation.join_func`.
+        """
+
+        args = [self.column(n) for n in arg_names]
+        if vectorized:
+            result = func(*args)
+        else:
+            ufunc = np.frompyfunc(func, len(args), 1)
+            result = ufunc(*args) if len(self) else []
+
+        result = _column(result)
+        assert len(result) == len(self), \
+            "Function result has %d rows, expected %d." \
+            % (len(result), len(self))
+
+        # appending a column to distinct rows keeps them distinct.
+        return ColumnarRelation(self.attribute_names + [result_name],
+                                self.columns + [result], distinct=True)
+
+    def natural_join(self, other):
+        self_attr_set = set(self.attribute_names)
+        other_attr_set = set(other.attribute_names)
+
+        join_attrs = [n for n in self.attribute_names if n in other_attr_set]
+        additional_attrs = [n for n in other.attribute_names
+                            if n not in self_attr_set]
+
+        assert len(join_attrs) > 0, \
+            "Natural join needs at least one shared attribute " \
+            "between %r and %r" \
+            % (self.attribute_names, other.attribute_names)
+
+        n_self = len(self)
+        codes = _factorize_rows([
+            _concat(self.column(n), other.column(n))
+            for n in join_attrs])
+        self_codes = codes[:n_self]
+        other_codes = codes[n_self:]
+
+        # sort the other side by key, then find the run of matching rows for
+        # each row on this side and expand the runs into index pairs.
+        order = np.argsort(other_codes, kind='mergesort')
+        sorted_codes = other_codes[order]
+        start = np.searchsorted(sorted_codes, self_codes, side='left')
+        end = np.searchsorted(sorted_codes, self_codes, side='right')
+        counts = end - start
+
+        self_idx = np.repeat(np.arange(n_self), counts)
+        offsets = np.arange(len(self_idx)) - \
+            np.repeat(np.cumsum(counts) - counts, counts)
+        other_idx = order[np.repeat(start, counts) + offsets]
+
+        columns = [c[self_idx] for c in self.columns] + \
+            [other.column(n)[other_idx] for n in additional_attrs]
+
+        # distinct inputs joined on their shared attributes give distinct
+        # output rows.
+        return ColumnarRelation(self.attribute_names + additional_attrs,
+                                columns, distinct=True)
+
+    def __eq__(self, other):
+        if isinstance(other, self.__class__):
+            return self.to_relation() == other.to_relation()
+        else:
+            return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return "ColumnarRelation(%r, %r)" \
+            % (self.attribute_names, self.columns)
+
+    def _take(self, attribute_names, mask):
+        return ColumnarRelation(attribute_names,
+                                [c[mask] for c in self.columns],
+                                distinct=True)
+
+    def _rows_in(self, other):
+        """
+        Returns a boolean mask of the rows of this relation which are also
+        rows of `other`.
+        """
+
+        n_self = len(self)
+        codes = _factorize_rows([_concat(a, b)
+                                 for a, b in zip(self.columns, other.columns)])
+        return np.in1d(codes[:n_self], codes[n_self:])
+
+    def _assert_compatible(self, other, op_name):
+        assert self.attribute_names == other.attribute_names, \
+            "Relation attributes incompatible in %s: %r != %r" \
+            % (op_name, self.attribute_names, other.attribute_names)
+
+
+try:
+    _NATIVE_TYPES = (bool, int, long, float, str, unicode)
+except NameError:
+    _NATIVE_TYPES = (bool, int, float, str, bytes)
+
+
+def _column(values):
+    """
+    Converts `values` to a one-dimensional array. Only columns where every
+    value has the same numeric or string type get a native NumPy dtype, so
+    that converting back with `tolist()` gives the same values. Anything
+    else, such as mixed types, None or the node lists of ways, is kept as
+    Python objects.
+    """
+
+    if isinstance(values, np.ndarray) and values.ndim == 1:
+        return values
+
+    values = list(values)
+    types = set(type(v) for v in values)
+    if len(types) == 1 and types.pop() in _NATIVE_TYPES:
+        arr = np.array(values)
+        if arr.ndim == 1:
+            return arr
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+def _concat(a, b):
+    """
+    Concatenates two columns. Columns of different kinds are concatenated as
+    Python objects, since NumPy would otherwise convert the values of one to
+    the type of the other, such as numbers to strings.
+    """
+
+    if a.dtype.kind == b.dtype.kind and a.dtype.kind != 'O':
+        return np.concatenate((a, b))
+    arr = np.empty(len(a) + len(b), dtype=object)
+    arr[:len(a)] = a.tolist()
+    arr[len(a):] = b.tolist()
+    return arr
+
+
+def _factorize(column):
+    """
+    Returns the number of distinct values in `column`, and an array with a
+    dense integer code for each value.
+    """
+
+    if column.dtype == object:
+        # objects of different types can't always be sorted against each
+        # other, so these are coded by hashing instead.
+        index = dict()
+        codes = np.empty(len(column), dtype=np.int64)
+        for i, value in enumerate(column):
+            codes[i] = index.setdefault(value, len(index))
+        return len(index), codes
+
+    uniques, inverse = np.unique(column, return_inverse=True)
+    return len(uniques), inverse
+
+
+def _factorize_rows(columns):
+    """
+    Returns an array with a dense integer code for each row of `columns`, such
+    that two rows have the same code exactly when all their values are equal.
+    """
+
+    codes = None
+    for c in columns:
+        n_uniques, inverse = _factorize(c)
+        if codes is None:
+            codes = inverse.astype(np.int64)
+        else:
+            # combine and re-densify, so that the codes never grow beyond the
+            # number of rows.
+            combined = codes * n_uniques + inverse
+            codes = np.unique(combined, return_inverse=True)[1]
+    return codes
+
+
+def _unique_row_indices(columns):
+    """
+    Returns the sorted indices of the first occurrence of each distinct row.
+    """
+
+    if len(columns[0]) == 0:
+        return np.arange(0)
+    codes = _factorize_rows(columns)
+    first = np.unique(codes, return_index=True)[1]
+    first.sort()
+    return first
@@ -1,42 +1,80 @@
+from operator import itemgetter
+
+from neat.batch import RecordBatch, BatchCollector, Coalescer, \
+    push_batch_to, flush_to, call_columns
+
+
 class Collector(object):
     """
     Collects the output of a Stream and saves it in a `list` until `fetch()` is
     called, which returns the list and resets it. This is useful for testing,
     or to "tap" into Streams to see what they're doing.
+
+    If it's given the `attr_names` of the rows it collects, then `fetch()`
+    returns each row as a dict, otherwise rows are returned as tuples.
     """
 
-    def __init__(self):
+    def __init__(self, attr_names=None):
+        self._attr_names = attr_names
         self._items = list()
 
+    def push_rows(self, rows):
+        self._items.extend(rows)
+
     def push(self, items):
         self._items.extend(items)
 
     def fetch(self):
         items = self._items
         self._items = list()
+        if self._attr_names is not None:
+            names = self._attr_names
+            items = [dict(zip(names, row)) for row in items]
         return items
 
 
+class DictAdapter(object):
+    """
+    Adapts a listener with a dict-based `push(items)` method to receive rows
+    from a Stream, converting each row to a dict using `attr_names`.
+    """
+
+    def __init__(self, attr_names, listener):
+        self._attr_names = attr_names
+        self._listener = listener
+
+    def push_rows(self, rows):
+        names = self._attr_names
+        self._listener.push([dict(zip(names, row)) for row in rows])
+
+
 class HalfJoinStream(object):
     """
-    Half of a JoiningStream, which has the `push()` method needed for an
-    upstream Stream to insert data into it, which is combined with information
-    about whether it's the left or right half of a join, then pushed down to
-    the JoiningStream.
+    Half of a JoiningStream, which has the `push_rows()` method needed for
+    an upstream Stream to insert data into it, which is combined with
+    information about whether it's the left or right half of a join, then
+    pushed down to the JoiningStream.
     """
 
     def __init__(self, pos, parent):
         self._pos = pos
         self._parent = parent
 
-    def push(self, items):
-        return self._parent.push(self._pos, items)
+    def push_rows(self, rows):
+        return self._parent.push_rows(self._pos, rows)
+
+    def flush(self):
+        self._parent.flush()
 
 
 class Dictionary(object):
     """
     A data structure to handle binary joins on some set of hashable columns
     shared between two "left" and "right" relations.
+
+    This keeps everything in memory. Other implementations of the same
+    interface, such as `neat.store.StoredDictionary`, can keep it elsewhere
+    and use `flush()` to write out any changes.
     """
 
     def __init__(self):
@@ -65,28 +103,45 @@ class Dictionary(object):
         iterable = r if pos == 0 else l
         return not_exists, iterable
 
+    def flush(self):
+        """
+        Called after each batch of rows. Nothing to do when in memory.
+        """
+        pass
+
 
 class Deduplicator(object):
+    """
+    Remembers which rows have already been emitted, so that each distinct row
+    is only emitted once. Rows must be hashable, which positional tuples
+    always are.
+    """
 
     def __init__(self):
         self._obj = set()
 
-    def should_emit(self, val):
-        val_hashable = tuple(sorted(val.items()))
-        exists = val_hashable in self._obj
+    def should_emit(self, row):
+        exists = row in self._obj
         if not exists:
-            self._obj.add(val_hashable)
+            self._obj.add(row)
         return not exists
 
+    def flush(self):
+        pass
+
 
 class JoiningStream(object):
     """
     A Stream interface object which implements a natural join between two
     Streams.
+
+    Output rows are laid out as the left-only attributes, then the join
+    attributes, then the right-only attributes. The positions of each in the
+    input rows are worked out once, when the join is built.
     """
 
-    def __init__(self, left, right):
-        self._join = Dictionary()
+    def __init__(self, left, right, dict_factory=Dictionary):
+        self._join = dict_factory()
 
         self.left = HalfJoinStream(0, self)
         self.right = HalfJoinStream(1, self)
@@ -103,39 +158,52 @@ class JoiningStream(object):
             "between %r and %r" \
             % (left.attr_names, right.attr_names)
 
+        # getters for the join key and the rest of the row, for each side.
+        self._join_getters = (
+            _row_getter(left._indices_for(self._join_attrs)),
+            _row_getter(right._indices_for(self._join_attrs)))
+        self._key_getters = (
+            _row_getter(left._indices_for(self._left_attrs)),
+            _row_getter(right._indices_for(self._right_attrs)))
+
         self._listeners = list()
 
     def attrs(self):
         return self._left_attrs + self._join_attrs + self._right_attrs
 
-    def push(self, pos, items):
-        output_items = list()
+    def push_rows(self, pos, rows):
+        if not rows:
+            return
+        output_rows = list()
 
-        for item in items:
-            idx = tuple([item[k] for k in self._join_attrs])
+        join_getter = self._join_getters[pos]
+        key_getter = self._key_getters[pos]
 
-            attrs = self._left_attrs if pos == 0 else self._right_attrs
-            other_attrs = self._right_attrs if pos == 0 else self._left_attrs
-            key = tuple([item[k] for k in attrs])
+        for row in rows:
+            idx = join_getter(row)
+            key = key_getter(row)
             not_exists, iterable = self._join.get_and_add(idx, pos, key)
 
             if not_exists:
-                out = self._push(item, iterable, other_attrs)
-                output_items.extend(out)
-
+                if pos == 0:
+                    base = key + idx
+                    for o in iterable:
+                        output_rows.append(base + o)
+                else:
+                    tail = idx + key
+                    for o in iterable:
+                        output_rows.append(o + tail)
+
+        # any changes to the join state are written out once per batch.
+        self._join.flush()
+
+        if output_rows:
+            for listener in self._listeners:
+                listener.push_rows(output_rows)
+
+    def flush(self):
         for listener in self._listeners:
-            listener.push(output_items)
-
-    def _push(self, base_val, iterable, other_attrs):
-        out = list()
-
-        for o in iterable:
-            val = base_val.copy()
-            for k, v in zip(other_attrs, o):
-                val[k] = v
-            out.append(val)
-
-        return out
+            flush_to(listener)
 
 
 class Stream(object):
@@ -143,26 +211,105 @@ class Stream(object):
     Streaming relational operations. Each instance of Stream may transform the
     tuples and `push()` them down to listeners. In this way, a network of
     Streams can perform operations with limited local state.
+
+    Inside the network, rows are tuples with one value for each of the
+    Stream's `attr_names`, in order, and each operator works out which
+    positions it needs when it's built. The dict-based `push()` and
+    `collect()` convert to and from rows at the edges of the network.
+
+    Data can also be pushed a column at a time, as `RecordBatch`es, with
+    `push_batch()`. Operators which have a `batch_func` work on whole
+    columns, and the others fall back to converting the batch to rows.
+
+    Operators which emit each distinct row once keep their state in an
+    object made by `dedup_factory`, such as a `Deduplicator` or a
+    `neat.fingerprint.FingerprintDeduplicator`, and joins keep theirs in an
+    object made by `dict_factory`, such as a `Dictionary`. Streams derived
+    from this one use the same factories.
     """
 
-    def __init__(self, attr_names, push_func=None):
+    def __init__(self, attr_names, push_func=None, batch_func=None,
+                 dedup_factory=None, dict_factory=None):
         self.attr_names = attr_names
         self._push_func = push_func
+        self._batch_func = batch_func
+        self._dedup_factory = dedup_factory or Deduplicator
+        self._dict_factory = dict_factory or Dictionary
         self._listeners = list()
+        self._row_from_dict = _row_getter(attr_names)
+        # description of a stateless operator, which lets neat.fusion fuse
+        # it with its neighbours. None for anything with state.
+        self._op = None
 
     def push(self, items):
+        row_from_dict = self._row_from_dict
+        self.push_rows([row_from_dict(item) for item in items])
+
+    def push_rows(self, rows):
+        # empty batches, including those emptied by an operator, don't go
+        # any further down the network.
+        if not rows:
+            return
         if self._push_func is not None:
-            items = self._push_func(self, items)
+            rows = self._push_func(self, rows)
+            if not rows:
+                return
+
+        for listener in self._listeners:
+            listener.push_rows(rows)
+
+    def push_batch(self, batch):
+        if not len(batch):
+            return
+        if self._batch_func is not None:
+            batch = self._batch_func(self, batch)
+        elif self._push_func is not None:
+            batch = RecordBatch.from_rows(
+                self.attr_names, self._push_func(self, batch.rows()))
+        else:
+            batch = batch.renamed(self.attr_names)
+        if not len(batch):
+            return
 
-        #import sys; print>>sys.stderr,"PUSH: %r" % items
         for listener in self._listeners:
-            listener.push(items)
+            push_batch_to(listener, batch)
+
+    def flush(self):
+        """
+        Releases anything buffered by `coalesce()` stages downstream of this
+        Stream, for example at the end of each diff.
+        """
+
+        for listener in self._listeners:
+            flush_to(listener)
 
     def collect(self):
+        collector = Collector(self.attr_names)
+        self._listeners.append(collector)
+        return collector
+
+    def collect_rows(self):
         collector = Collector()
         self._listeners.append(collector)
         return collector
 
+    def collect_batches(self):
+        collector = BatchCollector(self.attr_names)
+        self._listeners.append(collector)
+        return collector
+
+    def add_listener(self, listener):
+        """
+        Adds a listener which has a `push_rows(rows)` method.
+        """
+        self._listeners.append(listener)
+
+    def add_dict_listener(self, listener):
+        """
+        Adds a listener which has a dict-based `push(items)` method.
+        """
+        self._listeners.append(DictAdapter(self.attr_names, listener))
+
     def union(self, other):
         self._assert_compatible(other, "union")
         # TODO
@@ -178,85 +325,174 @@ class Stream(object):
         # TODO
         raise StandardError("Stream.difference not implemented")
 
-    def projection(self, new_attr_names):
-        emitted = Deduplicator()
+    def projection(self, new_attr_names, dedup=True):
+        """
+        Projects rows onto `new_attr_names`, emitting each distinct row once.
+        If the rows are already known to be distinct after projection, for
+        example because they're only being reordered, then `dedup` can be
+        turned off to avoid keeping any state.
+        """
 
-        def push_func(stream, items):
-            new_items = list()
-            for item in items:
-                new_item = dict([[k, item[k]] for k in new_attr_names])
-                if emitted.should_emit(new_item):
-                    new_items.append(new_item)
-            return new_items
+        if not dedup:
+            return self._select(new_attr_names)
+
+        emitted = self._dedup_factory()
+        indices = self._indices_for(new_attr_names)
+        getter = _row_getter(indices)
+
+        def push_func(stream, rows):
+            new_rows = list()
+            for row in rows:
+                new_row = getter(row)
+                if emitted.should_emit(new_row):
+                    new_rows.append(new_row)
+            emitted.flush()
+            return new_rows
+
+        def batch_func(stream, batch):
+            batch = batch.select(indices, new_attr_names)
+            keep = [i for i, row in enumerate(batch.rows())
+                    if emitted.should_emit(row)]
+            emitted.flush()
+            if len(keep) == len(batch):
+                return batch
+            return batch.take(keep)
+
+        s = self._derive(new_attr_names, push_func, batch_func)
+        self._listeners.append(s)
+        return s
 
-        s = Stream(new_attr_names, push_func)
+    def _select(self, new_attr_names):
+        indices = self._indices_for(new_attr_names)
+        getter = _row_getter(indices)
+
+        def push_func(stream, rows):
+            return [getter(row) for row in rows]
+
+        def batch_func(stream, batch):
+            return batch.select(indices, new_attr_names)
+
+        s = self._derive(new_attr_names, push_func, batch_func)
+        s._op = ('project', indices)
         self._listeners.append(s)
         return s
 
+    def coalesce(self, max_rows=1000, max_seconds=None):
+        """
+        Buffers rows until there are at least `max_rows` of them, or the
+        oldest has waited `max_seconds`, and then pushes them on as one
+        batch. Anything left over is pushed on by `flush()`. See
+        `neat.batch.Coalescer`.
+        """
+
+        c = Coalescer(self.attr_names, max_rows, max_seconds)
+        self._listeners.append(c)
+        s = self._derive(self.attr_names)
+        c._listeners.append(s)
+        return s
+
     def selection(self, pred):
         # TODO
         raise StandardError("Stream.selection not implemented")
 
     def rename(self, new_attr_names):
-        names = zip(new_attr_names, self.attr_names)
-
-        def push_func(stream, items):
-            new_items = list()
-            for item in items:
-                new_item = dict([(new, item[old]) for (new, old) in names])
-                new_items.append(new_item)
-            return new_items
+        assert len(new_attr_names) == len(self.attr_names), \
+            "New attribute names wrong length: len(%r) != len(%r)" \
+            % (new_attr_names, self.attr_names)
 
-        s = Stream(new_attr_names, push_func)
+        # renaming is positional, so the rows don't change at all.
+        s = self._derive(new_attr_names)
+        s._op = ('rename',)
         self._listeners.append(s)
         return s
 
-    def unnest(self, attr, unnested_attr):
-        seen = Deduplicator()
-
-        def push_func(stream, items):
-            new_items = list()
-            for item in items:
-                for val in item[attr]:
-                    new_item = item.copy()
-                    new_item.pop(attr)
-                    new_item[unnested_attr] = val
-                    if seen.should_emit(new_item):
-                        new_items.append(new_item)
-            return new_items
+    def unnest(self, attr, unnested_attr, dedup=True):
+        """
+        Replaces the collection in `attr` with a row for each of its values,
+        in `unnested_attr`, emitting each distinct row once. If the rows are
+        already known to be distinct, for example because the input rows are
+        and the values in each collection are, then `dedup` can be turned off
+        to avoid keeping any state.
+        """
 
+        seen = self._dedup_factory() if dedup else None
         replace_idx = self.attr_names.index(attr)
+
+        def push_func(stream, rows):
+            new_rows = list()
+            for row in rows:
+                head = row[:replace_idx]
+                tail = row[replace_idx + 1:]
+                for val in row[replace_idx]:
+                    new_row = head + (val,) + tail
+                    if seen is None or seen.should_emit(new_row):
+                        new_rows.append(new_row)
+            if seen is not None:
+                seen.flush()
+            return new_rows
+
         attrs = list(self.attr_names)
         attrs[replace_idx] = unnested_attr
-        s = Stream(attrs, push_func)
+        s = self._derive(attrs, push_func)
         self._listeners.append(s)
         return s
 
-    def join_func(self, arg_names, result_name, func):
-        def push_func(stream, items):
-            new_items = list()
-            for item in items:
-                assert isinstance(item, dict), "Item %r should be dict" % item
-                new_item = item.copy()
-                args = [item[arg] for arg in arg_names]
-                new_item[result_name] = func(*args)
-                new_items.append(new_item)
-            return new_items
-
-        s = Stream(self.attr_names + [result_name], push_func)
+    def join_func(self, arg_names, result_name, func, vectorized=False):
+        """
+        Adds the attribute `result_name` to each row, computed by calling
+        `func` with the values of `arg_names`. If `vectorized` is set, `func`
+        is instead called once per batch with a whole column for each
+        argument, and must return a column of results.
+        """
+
+        indices = self._indices_for(arg_names)
+        args_getter = _row_getter(indices)
+        new_attr_names = self.attr_names + [result_name]
+
+        def batch_func(stream, batch):
+            columns = [batch.columns[i] for i in indices]
+            if vectorized:
+                values = call_columns(func, columns, len(batch))
+            else:
+                values = [func(*args) for args in zip(*columns)]
+            return batch.with_column(result_name, values).renamed(
+                new_attr_names)
+
+        if vectorized:
+            def push_func(stream, rows):
+                if not rows:
+                    return []
+                batch = RecordBatch.from_rows(self.attr_names, rows)
+                return batch_func(stream, batch).rows()
+
+        else:
+            def push_func(stream, rows):
+                new_rows = list()
+                for row in rows:
+                    new_rows.append(row + (func(*args_getter(row)),))
+                return new_rows
+
+        s = self._derive(new_attr_names, push_func, batch_func)
+        if not vectorized:
+            s._op = ('join_func', indices, func)
         self._listeners.append(s)
         return s
 
     def natural_join(self, other):
-        js = JoiningStream(self, other)
+        js = JoiningStream(self, other, self._dict_factory)
 
         self._listeners.append(js.left)
         other._listeners.append(js.right)
 
-        s = Stream(js.attrs())
+        s = self._derive(js.attrs())
         js._listeners.append(s)
         return s
 
+    def _derive(self, attr_names, push_func=None, batch_func=None):
+        return Stream(attr_names, push_func, batch_func,
+                      dedup_factory=self._dedup_factory,
+                      dict_factory=self._dict_factory)
+
     def _indices_for(self, attrs):
         indices = list()
         for n in attrs:
@@ -267,3 +503,17 @@ class Stream(object):
         assert self.attr_names == other.attr_names, \
             "Stream attributes incompatible in %s: %r != %r" \
             % (op_name, self.attr_names, other.attr_names)
+
+
+def _row_getter(keys):
+    """
+    Returns a function which picks out the values at `keys` from a row (or
+    dict) as a tuple, even when there's only one or none of them.
+    """
+
+    if len(keys) == 0:
+        return lambda row: ()
+    elif len(keys) == 1:
+        k = keys[0]
+        return lambda row: (row[k],)
+    return itemgetter(*keys)
@@ -0,0 +1,248 @@
+# compact deduplication state for Streams.
+#
+# `neat.external.Deduplicator` keeps every row it has emitted, which over a
+# full history of OSM data is far too much to hold in memory. the
+# deduplicator here keeps only a fixed-size fingerprint of each row, in a flat
+# open-addressing hash table of machine integers, which costs a few bytes per
+# row rather than a Python tuple and all the objects inside it.
+#
+# the price is that two different rows with the same fingerprint look like
+# the same row, and the second one is dropped. with `n` distinct rows and
+# `b`-bit fingerprints, the chance of any such collision at all is about
+#
+#     n * n / 2 ** (b + 1)
+#
+# which for 64-bit fingerprints is about 3 in 10,000 for a hundred million
+# rows, but becomes likely at around four billion rows. 128-bit fingerprints
+# keep it below 10**-18 even for ten billion rows, so they should be used
+# for anything on the scale of the full history.
+
+import hashlib
+from array import array
+
+# a typecode for unsigned 64-bit array items. 'Q' isn't available on
+# Python 2, but 'L' is 64 bits wide on the platforms which matter.
+if array('L').itemsize == 8:
+    _TYPECODE = 'L'
+else:
+    _TYPECODE = 'Q'
+
+
+try:
+    _INT_TYPES = (int, long)
+    _TEXT_TYPE = unicode
+except NameError:
+    _INT_TYPES = (int,)
+    _TEXT_TYPE = str
+
+
+def _encode(value, out):
+    """
+    Appends a canonical encoding of `value` to the list of byte strings
+    `out`. Values which are equal encode the same even when their types
+    differ, such as `1`, `1L`, `1.0` and `True`, or `'a'` and `u'a'` on
+    Python 2.
+    """
+
+    if isinstance(value, tuple):
+        out.append(('t%d:' % len(value)).encode('ascii'))
+        for v in value:
+            _encode(v, out)
+        return
+
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+
+    if isinstance(value, _INT_TYPES):
+        data = b'i' + str(int(value)).encode('ascii')
+    elif isinstance(value, float):
+        data = b'f' + repr(value).encode('ascii')
+    elif isinstance(value, _TEXT_TYPE):
+        data = b's' + value.encode('utf-8')
+    elif isinstance(value, bytes):
+        data = b'b' + value
+        # on Python 2, an ASCII str is equal to the same unicode string.
+        if _TEXT_TYPE is not bytes:
+            try:
+                data = b's' + value.decode('ascii').encode('utf-8')
+            except UnicodeDecodeError:
+                pass
+    elif value is None:
+        data = b'N'
+    else:
+        data = b'r' + repr(value).encode('utf-8')
+    out.append(('%d:' % len(data)).encode('ascii'))
+    out.append(data)
+
+
+def fingerprint(row, bits=64):
+    """
+    Returns a `bits`-bit fingerprint of `row`, as a tuple of one or two
+    non-zero 64-bit integers. Rows which are equal have the same
+    fingerprint, so that a deduplicator using them makes the same decisions
+    as one using a set of the rows themselves.
+    """
+
+    out = list()
+    _encode(row, out)
+    digest = hashlib.md5(b''.join(out)).hexdigest()
+    hi = int(digest[:16], 16) or 1
+    if bits == 64:
+        return (hi,)
+    lo = int(digest[16:], 16) or 1
+    return (hi, lo)
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter of `bits` bits, using `hashes` probes derived from a row's
+    fingerprint. A row which has never been added is rejected without
+    touching the much larger fingerprint table, except for a small fraction
+    of false positives.
+    """
+
+    def __init__(self, bits, hashes=4):
+        if bits <= 0:
+            raise ValueError("Bloom filter needs a positive number of bits, "
+                             "not %r" % (bits,))
+        self.bits = bits
+        self.hashes = hashes
+        self._data = bytearray((bits + 7) // 8)
+
+    def _probes(self, fp):
+        # double hashing on the two halves of the first 64 bits.
+        h1 = fp & 0xffffffff
+        h2 = (fp >> 32) | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, fp):
+        data = self._data
+        for p in self._probes(fp):
+            data[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, fp):
+        data = self._data
+        for p in self._probes(fp):
+            if not data[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+
+class FingerprintDeduplicator(object):
+    """
+    A drop-in replacement for `neat.external.Deduplicator` which remembers
+    only a 64- or 128-bit fingerprint of each emitted row. See the top of
+    this module for the chance of a collision.
+
+    Fingerprints are kept in an open-addressing table with linear probing,
+    which doubles in size whenever more than `load_factor` of its slots are
+    full. If `bloom_bits` is given, a Bloom filter of that many bits is
+    checked first, so that rows which are new, the common case, usually
+    don't have to probe the table.
+    """
+
+    def __init__(self, bits=64, load_factor=0.5, capacity=1024,
+                 bloom_bits=None):
+        if bits not in (64, 128):
+            raise ValueError("Fingerprints must be 64 or 128 bits, not %r"
+                             % (bits,))
+        if not 0 < load_factor < 1:
+            raise ValueError("Load factor must be between 0 and 1, not %r"
+                             % (load_factor,))
+
+        self.bits = bits
+        self.load_factor = load_factor
+        self._width = bits // 64
+        self._count = 0
+
+        size = 1
+        while size < capacity:
+            size *= 2
+        self._allocate(size)
+
+        self._bloom = None
+        if bloom_bits:
+            self._bloom = BloomFilter(bloom_bits)
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self):
+        """
+        The approximate memory used by the table and Bloom filter, in bytes.
+        """
+
+        n = len(self._table) * self._table.itemsize
+        if self._bloom is not None:
+            n += len(self._bloom._data)
+        return n
+
+    def should_emit(self, row):
+        fp = fingerprint(row, self.bits)
+        bloom = self._bloom
+
+        if bloom is not None:
+            if fp[0] not in bloom:
+                bloom.add(fp[0])
+                self._insert(fp)
+                return True
+
+        if self._find(fp):
+            return False
+
+        if bloom is not None:
+            bloom.add(fp[0])
+        self._insert(fp)
+        return True
+
+    def flush(self):
+        pass
+
+    def _allocate(self, size):
+        self._size = size
+        self._mask = size - 1
+        self._limit = int(size * self.load_factor)
+        self._table = array(_TYPECODE, [0]) * (size * self._width)
+
+    def _find(self, fp):
+        """
+        Returns True if `fp` is in the table.
+        """
+
+        table = self._table
+        width = self._width
+        mask = self._mask
+        slot = fp[0] & mask
+        while True:
+            base = slot * width
+            if table[base] == 0:
+                return False
+            if tuple(table[base:base + width]) == fp:
+                return True
+            slot = (slot + 1) & mask
+
+    def _insert(self, fp):
+        if self._count >= self._limit:
+            self._resize()
+
+        table = self._table
+        width = self._width
+        mask = self._mask
+        slot = fp[0] & mask
+        while table[slot * width] != 0:
+            slot = (slot + 1) & mask
+
+        base = slot * width
+        for i, v in enumerate(fp):
+            table[base + i] = v
+        self._count += 1
+
+    def _resize(self):
+        old = self._table
+        width = self._width
+        self._allocate(self._size * 2)
+        self._count = 0
+        for base in range(0, len(old), width):
+            if old[base] != 0:
+                self._insert(tuple(old[base:base + width]))
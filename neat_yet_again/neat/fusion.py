@@ -0,0 +1,186 @@
+# operator fusion for networks of Streams.
+#
+# each stateless operator (rename, join_func and projection without dedup)
+# is a Stream of its own, so every batch costs a Python call, a new list and
+# a new tuple per row at each of them. compiling the network finds linear
+# chains of stateless operators and replaces each chain with a single
+# generated push function, which does all the steps for a row in one go.
+# stateful operators, such as deduplicating projections and joins, are left
+# as they are and form the boundaries of the chains.
+#
+# a chain is usually fused into the Stream at its head, which then outputs
+# rows laid out like the end of the chain. the sources of the network are
+# pushed rows laid out as their `attr_names` from outside it, for example by
+# neat.reader, so they're left alone, and a chain following a source is
+# fused into its first operator instead.
+#
+# this works with the Streams from both neat.streaming and neat.external.
+
+from neat.batch import RecordBatch
+
+
+def compile_network(*sources):
+    """
+    Fuses the chains of stateless operators in the network of Streams
+    reachable from `sources`, in place. Returns the number of operators which
+    were fused away.
+
+    This should be called once the network is completely built, since the
+    intermediate Streams of a fused chain are disconnected from it. A Stream
+    which has more than one listener, such as one being collected from, ends
+    a chain and so is never disconnected.
+    """
+
+    source_ids = set(id(s) for s in sources)
+    seen = set()
+    stack = list(sources)
+    fused = 0
+
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+
+        if _is_stream(node):
+            fused += _fuse_chain(node, id(node) in source_ids)
+
+        for listener in getattr(node, '_listeners', ()):
+            # the halves of a join forward to the join itself.
+            stack.append(getattr(listener, '_parent', listener))
+
+    return fused
+
+
+def _is_stream(node):
+    return hasattr(node, '_push_func') and hasattr(node, '_op')
+
+
+def _fuse_chain(head, is_source=False):
+    """
+    Fuses the chain of stateless operators following `head` into it, or into
+    the first of them if `head` `is_source`, and returns the number of
+    operators fused away.
+    """
+
+    ops = list()
+    members = [head]
+    tail = head
+    while len(tail._listeners) == 1:
+        listener = tail._listeners[0]
+        if not _is_stream(listener) or listener._op is None:
+            break
+        ops.append(listener._op)
+        members.append(listener)
+        tail = listener
+
+    if is_source:
+        if len(ops) < 2:
+            return 0
+        target = members[1]
+        members = members[1:]
+        previous = None
+    else:
+        if not ops:
+            return 0
+        target = head
+        previous = head._push_func
+
+    # batches are still pushed through each step of the chain in turn, since
+    # the steps already work on whole columns.
+    batch_steps = [_batch_step(m) for m in members]
+
+    def batch_func(stream, batch):
+        for step in batch_steps:
+            batch = step(batch)
+        return batch
+
+    fused = _generate(len(head.attr_names), ops)
+    if previous is None:
+        target._push_func = fused
+    elif fused is not None:
+        def push_func(stream, rows):
+            return fused(stream, previous(stream, rows))
+        target._push_func = push_func
+
+    # the target now outputs rows laid out like the tail of the chain, and
+    # isn't a single operator any more.
+    target.attr_names = tail.attr_names
+    target._listeners = tail._listeners
+    target._batch_func = batch_func
+    target._op = None
+    return len(members) - 1
+
+
+def _batch_step(stream):
+    """
+    Returns a function which does what `stream.push_batch` does to a batch,
+    before it's forwarded to the listeners.
+    """
+
+    attr_names = stream.attr_names
+    push_func = stream._push_func
+    batch_func = stream._batch_func
+
+    if batch_func is not None:
+        return lambda batch: batch_func(stream, batch)
+    elif push_func is not None:
+        return lambda batch: RecordBatch.from_rows(
+            attr_names, push_func(stream, batch.rows()))
+    return lambda batch: batch.renamed(attr_names)
+
+
+def _generate(width, ops):
+    """
+    Generates a push function which applies `ops` to rows of `width` values.
+    Returns None if the ops don't change the rows at all.
+
+    The values of each output column are tracked as expressions in terms of
+    the input row, so that projections and renames cost nothing, and each
+    function result is computed once into a local variable.
+    """
+
+    identity = ['row[%d]' % i for i in range(width)]
+    exprs = list(identity)
+    lines = list()
+    env = dict()
+
+    for op in ops:
+        kind = op[0]
+        if kind == 'rename':
+            continue
+
+        elif kind == 'project':
+            exprs = [exprs[i] for i in op[1]]
+
+        elif kind == 'join_func':
+            n = len(env)
+            env['f%d' % n] = op[2]
+            lines.append('v%d = f%d(%s)'
+                         % (n, n, ', '.join([exprs[i] for i in op[1]])))
+            exprs.append('v%d' % n)
+
+        else:
+            raise ValueError("Unknown stream operator %r" % (kind,))
+
+    if exprs == identity and not lines:
+        return None
+
+    if exprs:
+        output = '(%s,)' % ', '.join(exprs)
+    else:
+        output = '()'
+
+    source = ['def fused(stream, rows):',
+              '    out = []',
+              '    append = out.append',
+              '    for row in rows:']
+    source.extend(['        ' + line for line in lines])
+    source.append('        append(%s)' % output)
+    source.append('    return out')
+    source = '\n'.join(source) + '\n'
+
+    exec(compile(source, '<fused>', 'exec'), env)
+    fused = env['fused']
+    fused.source = source
+    return fused
@@ -0,0 +1,121 @@
+# order-preserving binary keys for OSM element versions.
+#
+# this is the same layout as `mk_buffer` in neat4.cpp: a type byte ('n', 'w'
+# or 'r'), then the element id as a big-endian unsigned 64-bit integer, then
+# the version as a big-endian unsigned 32-bit integer. comparing the keys as
+# byte strings orders them by type, then id, then version, so all the
+# versions of an element, or all the elements in a range of ids, are next to
+# each other in any sorted store and can be read with one range scan.
+
+import struct
+from bisect import bisect_left, insort
+
+_KEY = struct.Struct('>cQI')
+
+KEY_SIZE = _KEY.size
+
+TYPES = ('n', 'w', 'r')
+
+_MAX_ID = (1 << 64) - 1
+_MAX_VERSION = (1 << 32) - 1
+
+
+def encode_key(element_type, element_id, version=0):
+    """
+    Encodes a key for `version` of the element of `element_type` and
+    `element_id`. Raises `ValueError` if any of them is out of range.
+    """
+
+    if element_type not in TYPES:
+        raise ValueError("Unknown element type %r, expected one of %r"
+                         % (element_type, TYPES))
+    if not 0 <= element_id <= _MAX_ID:
+        raise ValueError("Element id %r doesn't fit in 64 bits"
+                         % (element_id,))
+    if not 0 <= version <= _MAX_VERSION:
+        raise ValueError("Version %r doesn't fit in 32 bits" % (version,))
+
+    return _KEY.pack(element_type.encode('ascii'), element_id, version)
+
+
+def decode_key(key):
+    """
+    Decodes a key made by `encode_key` into a tuple of the element type,
+    id and version.
+    """
+
+    element_type, element_id, version = _KEY.unpack(key)
+    return str(element_type.decode('ascii')), element_id, version
+
+
+def id_range(element_type, start, end):
+    """
+    Returns the `(begin, end)` keys which bound all versions of the elements
+    of `element_type` with ids in `[start, end)`.
+    """
+
+    begin = encode_key(element_type, start)
+    if end > _MAX_ID:
+        # past the last id, which is the same as the start of the next
+        # type byte.
+        limit = chr(ord(element_type) + 1).encode('ascii')
+        return begin, limit + b'\0' * (KEY_SIZE - 1)
+    return begin, encode_key(element_type, end)
+
+
+class RangeScans(object):
+    """
+    Range scans over element versions, for any index which has a
+    `scan(begin, end)` method yielding `(key, value)` pairs in key order.
+    """
+
+    def versions(self, element_type, element_id):
+        """
+        Returns a list of `(version, value)` for all the versions of one
+        element, oldest first.
+        """
+
+        begin, end = id_range(element_type, element_id, element_id + 1)
+        return [(decode_key(k)[2], v) for k, v in self.scan(begin, end)]
+
+    def elements(self, element_type, start, end):
+        """
+        Yields `(id, version, value)` for all versions of the elements of
+        `element_type` with ids in `[start, end)`, in order.
+        """
+
+        begin, end = id_range(element_type, start, end)
+        for k, v in self.scan(begin, end):
+            _, element_id, version = decode_key(k)
+            yield element_id, version, v
+
+
+class KeyIndex(RangeScans):
+    """
+    An in-memory index from keys made by `encode_key` to values, kept
+    sorted so that it can be scanned in key order. Inserting is linear in
+    the size of the index, so this is mostly useful for testing, and
+    `neat.store.SqliteStore.index` should be used for anything large.
+    """
+
+    def __init__(self):
+        self._keys = list()
+        self._values = dict()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def put(self, key, value):
+        if key not in self._values:
+            insort(self._keys, key)
+        self._values[key] = value
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def scan(self, begin, end):
+        keys = self._keys
+        i = bisect_left(keys, begin)
+        while i < len(keys) and keys[i] < end:
+            yield keys[i], self._values[keys[i]]
+            i += 1
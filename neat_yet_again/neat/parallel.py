@@ -0,0 +1,175 @@
+# parallel execution of relational operators in a pool of worker processes.
+#
+# the inputs are hash-partitioned on the join or dedup key in the parent, so
+# that equal keys always end up in the same partition. each partition is then
+# processed independently by a worker, and because the partitions are
+# disjoint on the key, the results can simply be unioned back together.
+#
+# partitions travel between processes as marshalled columns rather than as
+# pickled sets of tuples, which is both smaller and much faster to encode and
+# decode. this means that values must be plain built-in types, such as
+# numbers, strings, None and tuples of those.
+
+import marshal
+import multiprocessing
+
+from neat.relation import Relation, _hash_join, _key_func
+
+
+def encode_batch(tuples, arity):
+    """
+    Encodes a collection of `tuples`, each of length `arity`, as a compact
+    batch of columns.
+    """
+
+    if tuples:
+        columns = tuple(zip(*tuples))
+    else:
+        columns = tuple(() for _ in range(arity))
+    return marshal.dumps(columns)
+
+
+def decode_batch(data):
+    """
+    Decodes a batch made by `encode_batch` back into a list of tuples.
+    """
+
+    columns = marshal.loads(data)
+    if not columns or not columns[0]:
+        return []
+    return list(zip(*columns))
+
+
+class ParallelExecutor(object):
+    """
+    Runs relational operators over a pool of `processes` worker processes,
+    by default one per CPU. Each input is split into `partitions` parts,
+    which defaults to a small multiple of the number of processes so that
+    uneven partitions balance out.
+
+    Results are always equal to running the same operator serially on
+    `Relation`. Call `close()`, or use the executor as a context manager, to
+    shut the pool down.
+    """
+
+    def __init__(self, processes=None, partitions=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.partitions = partitions or 4 * self.processes
+        self._pool = None
+
+    def natural_join(self, r1, r2):
+        r1_attr_set = set(r1.attribute_names)
+        r2_attr_set = set(r2.attribute_names)
+
+        join_attrs = [n for n in r1.attribute_names if n in r2_attr_set]
+        additional_attrs = [n for n in r2.attribute_names
+                            if n not in r1_attr_set]
+
+        assert len(join_attrs) > 0, \
+            "Natural join needs at least one shared attribute " \
+            "between %r and %r" \
+            % (r1.attribute_names, r2.attribute_names)
+
+        idx1 = r1._indices_for(join_attrs)
+        idx2 = r2._indices_for(join_attrs)
+        additional_idx = r2._indices_for(additional_attrs)
+
+        parts1 = self._partition(r1, _key_func(idx1))
+        parts2 = self._partition(r2, _key_func(idx2))
+        tasks = [(p1, idx1, p2, idx2, additional_idx)
+                 for p1, p2 in zip(parts1, parts2)]
+
+        return self._run(_join_partition, tasks,
+                         r1.attribute_names + additional_attrs)
+
+    def projection(self, r, new_attribute_names):
+        for n in new_attribute_names:
+            assert n in r.attribute_names, \
+                "Can't project attribute %r, not in relation %r" \
+                % (n, r.attribute_names)
+
+        indices = r._indices_for(new_attribute_names)
+        tasks = [(p, indices) for p in self._partition(r, _key_func(indices))]
+        return self._run(_project_partition, tasks, new_attribute_names)
+
+    def union(self, r1, r2):
+        return self._set_operation(r1, r2, 'union')
+
+    def intersection(self, r1, r2):
+        return self._set_operation(r1, r2, 'intersection')
+
+    def difference(self, r1, r2):
+        return self._set_operation(r1, r2, 'difference')
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _set_operation(self, r1, r2, op_name):
+        r1._assert_compatible(r2, op_name)
+
+        whole = lambda t: t
+        tasks = [(p1, p2, op_name) for p1, p2 in
+                 zip(self._partition(r1, whole), self._partition(r2, whole))]
+        return self._run(_set_operation_partition, tasks, r1.attribute_names)
+
+    def _partition(self, relation, key):
+        """
+        Splits the tuples of `relation` into encoded batches by a hash of
+        their `key`.
+        """
+
+        n = self.partitions
+        parts = [list() for _ in range(n)]
+        for t in relation.tuples:
+            parts[hash(key(t)) % n].append(t)
+
+        arity = len(relation.attribute_names)
+        return [encode_batch(p, arity) for p in parts]
+
+    def _run(self, func, tasks, attribute_names):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(self.processes)
+
+        new_tuples = set()
+        for data in self._pool.map(func, tasks):
+            new_tuples.update(decode_batch(data))
+
+        return Relation._trusted(attribute_names, new_tuples)
+
+
+# worker functions, which have to be at module level so that they can be
+# sent to the pool. each takes a tuple of arguments and returns an encoded
+# batch of result tuples.
+
+def _join_partition(args):
+    data1, idx1, data2, idx2, additional_idx = args
+    tuples1 = decode_batch(data1)
+    tuples2 = decode_batch(data2)
+    result = _hash_join(tuples1, idx1, tuples2, idx2, additional_idx)
+    return encode_batch(result, len(tuples1[0]) + len(additional_idx)
+                        if tuples1 else 0)
+
+
+def _project_partition(args):
+    data, indices = args
+    key = _key_func(indices)
+    result = set(key(t) for t in decode_batch(data))
+    return encode_batch(result, len(indices))
+
+
+def _set_operation_partition(args):
+    data1, data2, op_name = args
+    tuples1 = set(decode_batch(data1))
+    tuples2 = set(decode_batch(data2))
+    result = getattr(tuples1, op_name)(tuples2)
+    arity = len(next(iter(result))) if result else 0
+    return encode_batch(result, arity)
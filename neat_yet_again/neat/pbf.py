@@ -0,0 +1,522 @@
+# reading OSM PBF files, including full history files, into networks of
+# Streams or into Relations.
+#
+# a PBF file is a sequence of blobs, each a zlib compressed block of a few
+# thousand elements which can be decoded independently of the others. the
+# parent process only splits the file into blobs; decompressing and decoding
+# them is done by a pool of worker processes, and the results are put back
+# into file order as they come in. decoding is pure Python, so this is where
+# the time goes, and it scales with the number of processes.
+#
+# only the protobuf wire format, and the parts of the OSM schema which neat
+# uses, are decoded here, so there's no dependency on the protobuf package.
+# as in neat.parallel, decoded blocks go back to the parent as marshalled
+# columns, which means the rows are made of plain built-in types.
+
+import collections
+import marshal
+import multiprocessing
+import struct
+import time
+import zlib
+
+from neat.batch import RecordBatch
+from neat.reader import NODE_ATTRS, WAY_ATTRS, ReadStats, _open, \
+    _location_indices
+from neat.relation import Relation
+
+_BLOB_HEADER_SIZE = struct.Struct('>I')
+
+# a blob is at most 32MiB, according to the spec. anything bigger means the
+# file is corrupt or isn't PBF at all.
+MAX_BLOB_SIZE = 32 * 1024 * 1024
+
+_FEATURES = frozenset(['OsmSchema-V0.6', 'DenseNodes',
+                       'HistoricalInformation'])
+
+_ATTRS = frozenset(['id', 'version', 'lon', 'lat', 'timestamp', 'changeset',
+                    'uid', 'user', 'deleted', 'tags', 'nodes'])
+
+_WIRE_VARINT, _WIRE_64, _WIRE_BYTES, _WIRE_32 = 0, 1, 2, 5
+
+
+def _varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _fields(buf):
+    """
+    Yields `(field number, value)` for each field in the encoded message
+    `buf`, a bytearray. Varints are returned as unsigned ints and
+    length-delimited fields as bytearrays.
+    """
+
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _varint(buf, pos)
+        wire = key & 7
+        if wire == _WIRE_VARINT:
+            value, pos = _varint(buf, pos)
+        elif wire == _WIRE_BYTES:
+            length, pos = _varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire == _WIRE_64:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire == _WIRE_32:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError("Unsupported protobuf wire type %d" % wire)
+        yield key >> 3, value
+
+
+def _packed(buf):
+    values = list()
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        value, pos = _varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def _signed(n):
+    # int32 and int64 fields are encoded as 64-bit two's complement.
+    if n >= 1 << 63:
+        return n - (1 << 64)
+    return n
+
+
+def _zigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def _deltas(values):
+    total = 0
+    result = list()
+    for v in values:
+        total += _zigzag(v)
+        result.append(total)
+    return result
+
+
+def _text(buf):
+    return bytes(buf).decode('utf-8')
+
+
+def _check_attrs(attr_names):
+    for n in attr_names:
+        if n not in _ATTRS:
+            raise ValueError("Can't read attribute %r, expected one of %r"
+                             % (n, sorted(_ATTRS)))
+
+
+def blobs(f):
+    """
+    Yields `(type, data)` for each blob in the PBF file object `f`, where
+    `type` is 'OSMHeader' or 'OSMData' and `data` is the encoded, and still
+    compressed, Blob message.
+    """
+
+    while True:
+        size = f.read(_BLOB_HEADER_SIZE.size)
+        if not size:
+            return
+        if len(size) < _BLOB_HEADER_SIZE.size:
+            raise ValueError("Truncated PBF blob header")
+        size = _BLOB_HEADER_SIZE.unpack(size)[0]
+        if size > MAX_BLOB_SIZE:
+            raise ValueError("PBF blob header of %d bytes is too big" % size)
+
+        blob_type = None
+        data_size = 0
+        for field, value in _fields(bytearray(f.read(size))):
+            if field == 1:
+                blob_type = _text(value)
+            elif field == 3:
+                data_size = value
+        if data_size > MAX_BLOB_SIZE:
+            raise ValueError("PBF blob of %d bytes is too big" % data_size)
+
+        data = f.read(data_size)
+        if len(data) < data_size:
+            raise ValueError("Truncated PBF blob")
+        yield blob_type, data
+
+
+def _blob_data(data):
+    raw = None
+    for field, value in _fields(bytearray(data)):
+        if field == 1:
+            raw = value
+        elif field == 3:
+            raw = bytearray(zlib.decompress(bytes(value)))
+        elif field in (4, 5, 6, 7):
+            raise ValueError("Unsupported PBF blob compression, field %d"
+                             % field)
+    return raw if raw is not None else bytearray()
+
+
+def _check_header(data):
+    for field, value in _fields(_blob_data(data)):
+        # required_features.
+        if field == 4:
+            feature = _text(value)
+            if feature not in _FEATURES:
+                raise ValueError("Unsupported PBF feature %r" % feature)
+
+
+class _Block(object):
+    """
+    The block-wide settings of a PrimitiveBlock, needed to decode the
+    elements in it.
+    """
+
+    def __init__(self, strings, granularity, lat_offset, lon_offset,
+                 date_granularity):
+        self.strings = strings
+        self.granularity = granularity
+        self.lat_offset = lat_offset
+        self.lon_offset = lon_offset
+        self.date_granularity = date_granularity
+
+    def coord(self, value, offset):
+        # dividing, rather than multiplying by 1e-9, gives exactly the float
+        # that the same coordinate in an XML file would be parsed as.
+        return (offset + self.granularity * value) / 1e9
+
+    def timestamp(self, value):
+        return value * self.date_granularity // 1000
+
+    def tags(self, keys, vals):
+        s = self.strings
+        return tuple(sorted((s[k], s[v]) for k, v in zip(keys, vals)))
+
+
+def _info(block, buf):
+    """
+    Returns `(version, timestamp, changeset, uid, user, deleted)` from an
+    Info message.
+    """
+
+    version = timestamp = changeset = uid = user = None
+    deleted = False
+    for field, value in _fields(buf):
+        if field == 1:
+            version = _signed(value)
+        elif field == 2:
+            timestamp = block.timestamp(_signed(value))
+        elif field == 3:
+            changeset = _signed(value)
+        elif field == 4:
+            uid = _signed(value)
+        elif field == 5:
+            user = block.strings[value]
+        elif field == 6:
+            deleted = not value
+    return version, timestamp, changeset, uid, user, deleted
+
+
+_INFO_ATTRS = ('version', 'timestamp', 'changeset', 'uid', 'user',
+               'deleted')
+
+
+def _element(block, buf, kind):
+    """
+    Decodes a single Node or Way message into a dict of its attributes.
+    """
+
+    element = dict(zip(_INFO_ATTRS, (None,) * 5 + (False,)))
+    keys = vals = ()
+    lat = lon = 0
+    for field, value in _fields(buf):
+        if field == 1:
+            element['id'] = _zigzag(value) if kind == 'node' \
+                else _signed(value)
+        elif field == 2:
+            keys = _packed(value)
+        elif field == 3:
+            vals = _packed(value)
+        elif field == 4:
+            element.update(zip(_INFO_ATTRS, _info(block, value)))
+        elif field == 8:
+            if kind == 'node':
+                lat = _zigzag(value)
+            else:
+                element['nodes'] = tuple(_deltas(_packed(value)))
+        elif field == 9:
+            lon = _zigzag(value)
+
+    element['tags'] = block.tags(keys, vals)
+    element.setdefault('nodes', ())
+    if kind == 'node':
+        # deleted versions of nodes have no location, as in OSM XML.
+        located = not element['deleted']
+        element['lon'] = block.coord(lon, block.lon_offset) \
+            if located else None
+        element['lat'] = block.coord(lat, block.lat_offset) \
+            if located else None
+    return element
+
+
+def _dense_nodes(block, buf, attrs):
+    """
+    Decodes a DenseNodes message into a dict of attribute name to column,
+    with only the columns for `attrs`.
+    """
+
+    packed = dict()
+    info = dict()
+    for field, value in _fields(buf):
+        if field == 5:
+            for f, v in _fields(value):
+                info[f] = _packed(v)
+        else:
+            packed[field] = value
+
+    ids = _deltas(_packed(packed.get(1, b'')))
+    n = len(ids)
+    columns = dict(id=ids)
+    deleted = [not v for v in info[6]] if 6 in info else [False] * n
+    # deleted versions of nodes have no location, as in OSM XML.
+    if 'lon' in attrs:
+        columns['lon'] = [
+            None if d else block.coord(v, block.lon_offset)
+            for v, d in zip(_deltas(_packed(packed.get(9, b''))), deleted)]
+    if 'lat' in attrs:
+        columns['lat'] = [
+            None if d else block.coord(v, block.lat_offset)
+            for v, d in zip(_deltas(_packed(packed.get(8, b''))), deleted)]
+
+    if 'tags' in attrs:
+        tags = list()
+        s = block.strings
+        keys_vals = _packed(packed.get(10, b''))
+        i = 0
+        for _ in range(n):
+            node_tags = list()
+            # each node's keys and values are terminated by a 0, unless no
+            # node in the block has any tags, when there are none at all.
+            while i < len(keys_vals) and keys_vals[i] != 0:
+                node_tags.append((s[keys_vals[i]], s[keys_vals[i + 1]]))
+                i += 2
+            i += 1
+            tags.append(tuple(sorted(node_tags)))
+        columns['tags'] = tags
+
+    none = [None] * n
+    if 'version' in attrs:
+        columns['version'] = [_signed(v) for v in info[1]] \
+            if 1 in info else none
+    if 'timestamp' in attrs:
+        columns['timestamp'] = [block.timestamp(v)
+                                for v in _deltas(info[2])] \
+            if 2 in info else none
+    if 'changeset' in attrs:
+        columns['changeset'] = _deltas(info[3]) if 3 in info else none
+    if 'uid' in attrs:
+        columns['uid'] = _deltas(info[4]) if 4 in info else none
+    if 'user' in attrs:
+        columns['user'] = [block.strings[v] for v in _deltas(info[5])] \
+            if 5 in info else none
+    if 'deleted' in attrs:
+        columns['deleted'] = deleted
+    columns['nodes'] = [()] * n
+    return columns
+
+
+def _decode_block(data, node_attrs, way_attrs):
+    """
+    Decodes an OSMData blob into a list of `(kind, columns)`, one for each
+    group of nodes or ways in it in order, with the columns laid out as
+    `node_attrs` or `way_attrs`.
+    """
+
+    strings = list()
+    groups = list()
+    settings = dict(granularity=100, lat_offset=0, lon_offset=0,
+                    date_granularity=1000)
+    for field, value in _fields(_blob_data(data)):
+        if field == 1:
+            strings = [_text(s) for f, s in _fields(value) if f == 1]
+        elif field == 2:
+            groups.append(value)
+        elif field == 17:
+            settings['granularity'] = _signed(value)
+        elif field == 18:
+            settings['date_granularity'] = _signed(value)
+        elif field == 19:
+            settings['lat_offset'] = _signed(value)
+        elif field == 20:
+            settings['lon_offset'] = _signed(value)
+    block = _Block(strings, **settings)
+
+    result = list()
+    for group in groups:
+        elements = dict(node=list(), way=list())
+        for field, value in _fields(group):
+            if field == 2:
+                columns = _dense_nodes(block, value, node_attrs)
+                result.append(('node', tuple(tuple(columns[a])
+                                             for a in node_attrs)))
+            elif field == 1:
+                elements['node'].append(_element(block, value, 'node'))
+            elif field == 3:
+                elements['way'].append(_element(block, value, 'way'))
+
+        # a group only ever has one kind of element in it.
+        for kind, attrs in (('node', node_attrs), ('way', way_attrs)):
+            if elements[kind]:
+                result.append((kind, tuple(tuple(e[a] for e in elements[kind])
+                                           for a in attrs)))
+    return result
+
+
+def _decode_task(args):
+    data, node_attrs, way_attrs = args
+    return marshal.dumps(_decode_block(data, node_attrs, way_attrs))
+
+
+def read_pbf(source, batch_size=8000, node_attrs=NODE_ATTRS,
+             way_attrs=WAY_ATTRS, processes=None):
+    """
+    Reads the OSM PBF file `source`, which can be a path or a file object,
+    and yields `(kind, batch)` with `kind` either 'node' or 'way' and a
+    `RecordBatch` of up to `batch_size` rows laid out as `node_attrs` or
+    `way_attrs`, in file order. Rows can have the same attributes as those
+    read by `neat.reader.read_osm`.
+
+    Blocks are decoded by a pool of `processes` worker processes, by default
+    one per CPU, with a few blocks per process read ahead. With one process,
+    everything is decoded in this one.
+    """
+
+    _check_attrs(node_attrs)
+    _check_attrs(way_attrs)
+    node_attrs = list(node_attrs)
+    way_attrs = list(way_attrs)
+    attrs = dict(node=node_attrs, way=way_attrs)
+    processes = processes or multiprocessing.cpu_count()
+
+    f = _open(source)
+    pool = None
+    try:
+        tasks = _data_blobs(f, node_attrs, way_attrs)
+        if processes == 1:
+            results = (_decode_task(t) for t in tasks)
+        else:
+            pool = multiprocessing.Pool(processes)
+            results = _ordered(pool, tasks, 2 * processes)
+
+        for data in results:
+            for kind, columns in marshal.loads(data):
+                n = len(columns[0]) if columns else 0
+                for start in range(0, n, batch_size):
+                    yield kind, RecordBatch(
+                        attrs[kind],
+                        [list(c[start:start + batch_size]) for c in columns])
+
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if f is not source:
+            f.close()
+
+
+def _data_blobs(f, node_attrs, way_attrs):
+    for blob_type, data in blobs(f):
+        if blob_type == 'OSMHeader':
+            _check_header(data)
+        elif blob_type == 'OSMData':
+            yield data, node_attrs, way_attrs
+
+
+def _ordered(pool, tasks, ahead):
+    """
+    Runs `_decode_task` on each of `tasks` in `pool`, yielding the results in
+    the order of `tasks`. At most `ahead` tasks are in flight at once, so the
+    file isn't read any faster than it can be decoded.
+    """
+
+    pending = collections.deque()
+    for task in tasks:
+        pending.append(pool.apply_async(_decode_task, (task,)))
+        if len(pending) >= ahead:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def push_pbf(source, nodes=None, ways=None, batch_size=8000, processes=None):
+    """
+    Reads `source` as `read_pbf` does, and pushes each batch into the
+    `nodes` or `ways` Stream, laid out as their `attr_names`. Either Stream
+    can be None, in which case those elements are skipped. Both Streams are
+    flushed at the end, and node versions without a location are left out,
+    as by `neat.reader.push_osm`. Returns the `ReadStats`.
+    """
+
+    streams = dict(node=nodes, way=ways)
+    counts = dict(node=0, way=0)
+    located = _location_indices(nodes.attr_names) \
+        if nodes is not None else []
+    start = time.time()
+
+    for kind, batch in read_pbf(
+            source, batch_size,
+            nodes.attr_names if nodes is not None else NODE_ATTRS,
+            ways.attr_names if ways is not None else WAY_ATTRS,
+            processes):
+        counts[kind] += len(batch)
+        if kind == 'node' and located:
+            batch = _located_batch(batch, located)
+        if streams[kind] is not None and len(batch):
+            streams[kind].push_batch(batch)
+
+    for stream in (nodes, ways):
+        if stream is not None:
+            stream.flush()
+
+    return ReadStats(counts['node'], counts['way'], time.time() - start)
+
+
+def _located_batch(batch, indices):
+    """
+    Returns the rows of `batch` which have a value in each of the columns at
+    `indices`.
+    """
+
+    columns = [batch.columns[i] for i in indices]
+    keep = [i for i in range(len(batch))
+            if all(c[i] is not None for c in columns)]
+    if len(keep) == len(batch):
+        return batch
+    return batch.take(keep)
+
+
+def read_pbf_relations(source, node_attrs=NODE_ATTRS, way_attrs=WAY_ATTRS,
+                       processes=None):
+    """
+    Reads the whole of `source` as `read_pbf` does, and returns a pair of
+    Relations of the nodes and the ways in it.
+    """
+
+    tuples = dict(node=set(), way=set())
+    for kind, batch in read_pbf(source, node_attrs=node_attrs,
+                                way_attrs=way_attrs, processes=processes):
+        tuples[kind].update(zip(*batch.columns))
+
+    return (Relation._trusted(list(node_attrs), tuples['node']),
+            Relation._trusted(list(way_attrs), tuples['way']))
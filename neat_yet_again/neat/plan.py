@@ -0,0 +1,735 @@
+# lazy logical query plans over relations. operators on a LazyRelation are
+# recorded as a tree of plan nodes, which is only optimized and evaluated when
+# the result is asked for.
+
+from itertools import chain
+from operator import itemgetter
+
+from neat.relation import Relation, _hash_join
+
+
+# selectivity assumed for a predicate we know nothing about.
+DEFAULT_SELECTIVITY = 1.0 / 3
+
+
+class Estimate(object):
+    """
+    Estimated number of rows output by a plan node, and the estimated number
+    of distinct values of each of its attributes.
+    """
+
+    def __init__(self, rows, ndv):
+        self.rows = rows
+        self.ndv = ndv
+
+    def distinct(self, attr):
+        return max(1, min(self.ndv.get(attr, self.rows), self.rows))
+
+
+class Plan(object):
+    """
+    Base class of logical plan nodes. Each node knows its output
+    `attribute_names` and its `children`, can estimate its output size, and
+    can evaluate itself to an iterable of tuples.
+
+    Intermediate results are bags rather than sets: duplicates are only
+    removed where a node is marked to `dedup`, and when the final result is
+    materialized as a `Relation`.
+    """
+
+    children = ()
+
+    def rows(self):
+        raise NotImplementedError()
+
+    def estimate(self):
+        raise NotImplementedError()
+
+    def describe(self):
+        return self.__class__.__name__
+
+    def distinct(self):
+        """
+        Whether the rows output by this node are known to be distinct.
+        """
+        return False
+
+
+class Scan(Plan):
+
+    def __init__(self, relation):
+        self.relation = relation
+        self.attribute_names = relation.attribute_names
+        self._estimate = None
+
+    def rows(self):
+        return self.relation.tuples
+
+    def estimate(self):
+        if self._estimate is None:
+            tuples = self.relation.tuples
+            ndv = dict()
+            for i, n in enumerate(self.attribute_names):
+                ndv[n] = len(set([t[i] for t in tuples]))
+            self._estimate = Estimate(len(tuples), ndv)
+        return self._estimate
+
+    def describe(self):
+        return "Scan %r" % (self.attribute_names,)
+
+    def distinct(self):
+        return True
+
+
+class Projection(Plan):
+
+    def __init__(self, child, attribute_names, dedup=True):
+        for n in attribute_names:
+            assert n in child.attribute_names, \
+                "Can't project attribute %r, not in relation %r" \
+                % (n, child.attribute_names)
+
+        self.child = child
+        self.children = (child,)
+        self.attribute_names = attribute_names
+        self.dedup = dedup
+
+    def rows(self):
+        getter = _getter(_indices(self.child.attribute_names,
+                                  self.attribute_names))
+        projected = (getter(t) for t in self.child.rows())
+        if self.dedup:
+            return _unique(projected)
+        return projected
+
+    def estimate(self):
+        est = self.child.estimate()
+        rows = est.rows
+        if self.dedup:
+            product = 1
+            for n in self.attribute_names:
+                product *= est.distinct(n)
+            rows = min(rows, product)
+        return Estimate(rows, _subset(est.ndv, self.attribute_names))
+
+    def describe(self):
+        return "Projection %r%s" % (self.attribute_names,
+                                    " dedup" if self.dedup else "")
+
+    def distinct(self):
+        return self.dedup or (self.child.distinct() and
+                              _is_permutation(self.attribute_names,
+                                              self.child.attribute_names))
+
+
+class Selection(Plan):
+
+    def __init__(self, child, pred, attrs=None):
+        self.child = child
+        self.children = (child,)
+        self.attribute_names = child.attribute_names
+        self.pred = pred
+        self.attrs = attrs
+
+    def rows(self):
+        pred = self.pred
+        return (t for t in self.child.rows() if pred(t))
+
+    def estimate(self):
+        est = self.child.estimate()
+        rows = max(1, int(est.rows * DEFAULT_SELECTIVITY)) if est.rows else 0
+        return Estimate(rows, est.ndv)
+
+    def describe(self):
+        if self.attrs is None:
+            return "Selection"
+        return "Selection on %r" % (self.attrs,)
+
+    def distinct(self):
+        return self.child.distinct()
+
+
+class Rename(Plan):
+
+    def __init__(self, child, attribute_names):
+        assert len(attribute_names) == len(child.attribute_names), \
+            "New attribute names wrong length: len(%r) != len(%r)" \
+            % (attribute_names, child.attribute_names)
+
+        self.child = child
+        self.children = (child,)
+        self.attribute_names = attribute_names
+
+    def rows(self):
+        return self.child.rows()
+
+    def estimate(self):
+        est = self.child.estimate()
+        ndv = dict()
+        for new, old in zip(self.attribute_names, self.child.attribute_names):
+            if old in est.ndv:
+                ndv[new] = est.ndv[old]
+        return Estimate(est.rows, ndv)
+
+    def describe(self):
+        return "Rename %r <- %r" % (self.attribute_names,
+                                    self.child.attribute_names)
+
+    def distinct(self):
+        return self.child.distinct()
+
+
+class JoinFunc(Plan):
+
+    def __init__(self, child, arg_names, result_name, func):
+        self.child = child
+        self.children = (child,)
+        self.attribute_names = child.attribute_names + [result_name]
+        self.arg_names = arg_names
+        self.result_name = result_name
+        self.func = func
+
+    def rows(self):
+        func = self.func
+        getter = _getter(_indices(self.child.attribute_names, self.arg_names))
+        return (t + (func(*getter(t)),) for t in self.child.rows())
+
+    def estimate(self):
+        est = self.child.estimate()
+        ndv = dict(est.ndv)
+        ndv[self.result_name] = est.rows
+        return Estimate(est.rows, ndv)
+
+    def describe(self):
+        name = getattr(self.func, '__name__', 'func')
+        return "JoinFunc %s = %s(%s)" % (self.result_name, name,
+                                         ", ".join(self.arg_names))
+
+    def distinct(self):
+        return self.child.distinct()
+
+
+class NaturalJoin(Plan):
+
+    def __init__(self, left, right):
+        left_attr_set = set(left.attribute_names)
+        right_attr_set = set(right.attribute_names)
+
+        self.join_attrs = [n for n in left.attribute_names
+                           if n in right_attr_set]
+        self.additional_attrs = [n for n in right.attribute_names
+                                 if n not in left_attr_set]
+
+        assert len(self.join_attrs) > 0, \
+            "Natural join needs at least one shared attribute " \
+            "between %r and %r" \
+            % (left.attribute_names, right.attribute_names)
+
+        self.left = left
+        self.right = right
+        self.children = (left, right)
+        self.attribute_names = left.attribute_names + self.additional_attrs
+
+    def rows(self):
+        left_idx = _indices(self.left.attribute_names, self.join_attrs)
+        right_idx = _indices(self.right.attribute_names, self.join_attrs)
+        additional_idx = _indices(self.right.attribute_names,
+                                  self.additional_attrs)
+
+        return _hash_join(_collection(self.left.rows()), left_idx,
+                          _collection(self.right.rows()), right_idx,
+                          additional_idx,
+                          index1=_cached_index(self.left, self.join_attrs),
+                          index2=_cached_index(self.right, self.join_attrs))
+
+    def estimate(self):
+        left = self.left.estimate()
+        right = self.right.estimate()
+
+        rows = left.rows * right.rows
+        for n in self.join_attrs:
+            rows //= max(left.distinct(n), right.distinct(n))
+
+        ndv = dict(right.ndv)
+        ndv.update(left.ndv)
+        for n in self.join_attrs:
+            ndv[n] = min(left.distinct(n), right.distinct(n))
+        return Estimate(rows, ndv)
+
+    def describe(self):
+        return "NaturalJoin on %r" % (self.join_attrs,)
+
+    def distinct(self):
+        # the hash join builds its output as a set.
+        return True
+
+
+class _SetOperation(Plan):
+
+    def __init__(self, left, right):
+        assert left.attribute_names == right.attribute_names, \
+            "Relation attributes incompatible in %s: %r != %r" \
+            % (self.__class__.__name__.lower(), left.attribute_names,
+               right.attribute_names)
+
+        self.left = left
+        self.right = right
+        self.children = (left, right)
+        self.attribute_names = left.attribute_names
+
+
+class Union(_SetOperation):
+
+    def rows(self):
+        return chain(self.left.rows(), self.right.rows())
+
+    def estimate(self):
+        left = self.left.estimate()
+        right = self.right.estimate()
+        ndv = dict()
+        for n in self.attribute_names:
+            ndv[n] = left.distinct(n) + right.distinct(n)
+        return Estimate(left.rows + right.rows, ndv)
+
+
+class Intersection(_SetOperation):
+
+    def rows(self):
+        right = _collection(self.right.rows())
+        return (t for t in self.left.rows() if t in right)
+
+    def estimate(self):
+        left = self.left.estimate()
+        right = self.right.estimate()
+        return Estimate(min(left.rows, right.rows), left.ndv)
+
+    def distinct(self):
+        return self.left.distinct()
+
+
+class Difference(_SetOperation):
+
+    def rows(self):
+        right = _collection(self.right.rows())
+        return (t for t in self.left.rows() if t not in right)
+
+    def estimate(self):
+        return self.left.estimate()
+
+    def distinct(self):
+        return self.left.distinct()
+
+
+class LazyRelation(object):
+    """
+    A relation whose operators are recorded as a logical plan rather than
+    being evaluated immediately. It has the same operator methods as
+    `Relation`, so code such as `neat.tiles.node_tiles` can be written once
+    and run either way.
+
+    Calling `evaluate()` optimizes the plan and materializes the result as a
+    `Relation`, and `explain()` shows the optimized plan with estimated
+    cardinalities.
+
+    The optimizer assumes that functions passed to `join_func` are pure, so
+    that it can drop them if their result is projected away. Selections can
+    only be pushed down if the attributes that the predicate reads are given
+    as `attrs`.
+    """
+
+    def __init__(self, plan):
+        if isinstance(plan, Relation):
+            plan = Scan(plan)
+        self.plan = plan
+        self.attribute_names = plan.attribute_names
+
+    def union(self, other):
+        return LazyRelation(Union(self.plan, _plan_of(other)))
+
+    def intersection(self, other):
+        return LazyRelation(Intersection(self.plan, _plan_of(other)))
+
+    def difference(self, other):
+        return LazyRelation(Difference(self.plan, _plan_of(other)))
+
+    def projection(self, new_attribute_names):
+        return LazyRelation(Projection(self.plan, new_attribute_names))
+
+    def selection(self, pred, attrs=None):
+        """
+        Records a selection by `pred`, which is called with each tuple. If
+        given, `attrs` is the list of attributes that the predicate reads,
+        which allows the optimizer to move it closer to the inputs.
+        """
+        return LazyRelation(Selection(self.plan, pred, attrs))
+
+    def rename(self, new_attribute_names):
+        return LazyRelation(Rename(self.plan, new_attribute_names))
+
+    def join_func(self, arg_names, result_name, func):
+        return LazyRelation(JoinFunc(self.plan, arg_names, result_name, func))
+
+    def natural_join(self, other):
+        return LazyRelation(NaturalJoin(self.plan, _plan_of(other)))
+
+    def optimize(self):
+        return optimize(self.plan)
+
+    def evaluate(self, optimized=True):
+        plan = self.optimize() if optimized else self.plan
+        return Relation._trusted(plan.attribute_names, set(plan.rows()))
+
+    def explain(self, optimized=True):
+        plan = self.optimize() if optimized else self.plan
+        return explain(plan)
+
+    def __repr__(self):
+        return "LazyRelation(%r)" % (self.attribute_names,)
+
+
+def optimize(plan):
+    """
+    Returns an equivalent plan with selections pushed towards the inputs,
+    chains of three or more natural joins reordered, unused attributes
+    projected away as early as possible and redundant dedup steps removed.
+    """
+
+    attribute_names = plan.attribute_names
+
+    plan = _merge_projections(plan)
+    plan = _push_selections(plan)
+    plan = _reorder_joins(plan)
+    plan = _prune(plan, set(attribute_names))
+    if plan.attribute_names != attribute_names:
+        plan = Projection(plan, attribute_names, dedup=False)
+    plan = _merge_projections(plan)
+
+    # the root is always deduplicated when it's materialized.
+    return _mark_dedup(plan, True)
+
+
+def explain(plan):
+    """
+    Returns a string describing `plan` as an indented tree, with the
+    estimated number of rows output by each node.
+    """
+
+    lines = list()
+
+    def visit(node, depth):
+        lines.append("%s%s  (rows=%d)" % ("  " * depth, node.describe(),
+                                          node.estimate().rows))
+        for c in node.children:
+            visit(c, depth + 1)
+
+    visit(plan, 0)
+    return "\n".join(lines)
+
+
+def _plan_of(other):
+    if isinstance(other, LazyRelation):
+        return other.plan
+    return Scan(other)
+
+
+def _cached_index(node, attrs):
+    """
+    Returns a function giving the cached index on `attrs` of the relation
+    scanned by `node`, or None if `node` isn't a scan.
+    """
+
+    if isinstance(node, Scan):
+        return lambda: node.relation._index_for(attrs)
+    return None
+
+
+def _indices(attribute_names, names):
+    return [attribute_names.index(n) for n in names]
+
+
+def _getter(indices):
+    if len(indices) == 1:
+        i = indices[0]
+        return lambda t: (t[i],)
+    elif not indices:
+        return lambda t: ()
+    return itemgetter(*indices)
+
+
+def _subset(ndv, names):
+    return dict((n, ndv[n]) for n in names if n in ndv)
+
+
+def _is_permutation(names, other_names):
+    return len(names) == len(other_names) and set(names) == set(other_names)
+
+
+def _unique(rows):
+    seen = set()
+    for t in rows:
+        if t not in seen:
+            seen.add(t)
+            yield t
+
+
+def _collection(rows):
+    if isinstance(rows, (set, frozenset, list)):
+        return rows
+    return set(rows)
+
+
+def _with_children(node, children):
+    """
+    Returns a copy of `node` with new children, keeping all its other
+    parameters.
+    """
+
+    if isinstance(node, Projection):
+        return Projection(children[0], node.attribute_names, node.dedup)
+    elif isinstance(node, Selection):
+        return Selection(children[0], node.pred, node.attrs)
+    elif isinstance(node, Rename):
+        return Rename(children[0], node.attribute_names)
+    elif isinstance(node, JoinFunc):
+        return JoinFunc(children[0], node.arg_names, node.result_name,
+                        node.func)
+    elif isinstance(node, (NaturalJoin, _SetOperation)):
+        return node.__class__(children[0], children[1])
+    return node
+
+
+def _map_children(node, func):
+    if not node.children:
+        return node
+    return _with_children(node, [func(c) for c in node.children])
+
+
+def _remap_pred(pred, from_attrs, to_attrs):
+    """
+    Adapts `pred`, which expects tuples laid out as `from_attrs`, to take
+    tuples laid out as `to_attrs`. Attributes missing from `to_attrs` are
+    passed as None, so this is only safe for attributes the predicate doesn't
+    read.
+    """
+
+    if from_attrs == to_attrs:
+        return pred
+
+    positions = [to_attrs.index(n) if n in to_attrs else None
+                 for n in from_attrs]
+
+    def remapped(t):
+        return pred(tuple([t[i] if i is not None else None
+                           for i in positions]))
+
+    return remapped
+
+
+def _merge_projections(node):
+    node = _map_children(node, _merge_projections)
+
+    if isinstance(node, Projection):
+        child = node.child
+        if isinstance(child, Projection):
+            return Projection(child.child, node.attribute_names, node.dedup)
+        if node.attribute_names == child.attribute_names:
+            return child
+
+    return node
+
+
+def _push_selections(node):
+    node = _map_children(node, _push_selections)
+
+    if isinstance(node, Selection) and node.attrs is not None:
+        return _sink(node.pred, node.attrs, node.child)
+
+    return node
+
+
+def _sink(pred, attrs, node):
+    """
+    Returns a plan equivalent to selecting `pred` over `node`, with the
+    selection moved as far down the plan as it can go.
+    """
+
+    attr_set = set(attrs)
+
+    if isinstance(node, Selection):
+        return Selection(_sink(pred, attrs, node.child), node.pred,
+                         node.attrs)
+
+    elif isinstance(node, Rename):
+        mapping = dict(zip(node.attribute_names, node.child.attribute_names))
+        return Rename(_sink(pred, [mapping[n] for n in attrs], node.child),
+                      node.attribute_names)
+
+    elif isinstance(node, JoinFunc) and node.result_name not in attr_set:
+        child = node.child
+        new_pred = _remap_pred(pred, node.attribute_names,
+                               child.attribute_names)
+        return JoinFunc(_sink(new_pred, attrs, child), node.arg_names,
+                        node.result_name, node.func)
+
+    elif isinstance(node, Projection):
+        child = node.child
+        new_pred = _remap_pred(pred, node.attribute_names,
+                               child.attribute_names)
+        return Projection(_sink(new_pred, attrs, child),
+                          node.attribute_names, node.dedup)
+
+    elif isinstance(node, NaturalJoin):
+        left, right = node.left, node.right
+        in_left = attr_set <= set(left.attribute_names)
+        in_right = attr_set <= set(right.attribute_names)
+
+        if in_left:
+            left = _sink(_remap_pred(pred, node.attribute_names,
+                                     left.attribute_names), attrs, left)
+        if in_right:
+            right = _sink(_remap_pred(pred, node.attribute_names,
+                                      right.attribute_names), attrs, right)
+        if in_left or in_right:
+            return NaturalJoin(left, right)
+
+    elif isinstance(node, _SetOperation):
+        return node.__class__(_sink(pred, attrs, node.left),
+                              _sink(pred, attrs, node.right))
+
+    return Selection(node, pred, attrs)
+
+
+def _join_inputs(node):
+    if isinstance(node, NaturalJoin):
+        return _join_inputs(node.left) + _join_inputs(node.right)
+    return [node]
+
+
+def _reorder_joins(node):
+    if not isinstance(node, NaturalJoin):
+        return _map_children(node, _reorder_joins)
+
+    inputs = [_reorder_joins(n) for n in _join_inputs(node)]
+    if len(inputs) < 3:
+        return NaturalJoin(inputs[0], inputs[1])
+
+    # greedily start from the smallest input, and at each step join in the
+    # input which gives the smallest estimated result. inputs which share no
+    # attributes with what has been joined so far would be a cross product,
+    # so they're only considered once they do share something.
+    remaining = sorted(inputs, key=lambda n: n.estimate().rows)
+    current = remaining.pop(0)
+    while remaining:
+        best = None
+        for candidate in remaining:
+            if not set(candidate.attribute_names) & \
+               set(current.attribute_names):
+                continue
+            joined = NaturalJoin(current, candidate)
+            if best is None or joined.estimate().rows < best[0]:
+                best = (joined.estimate().rows, candidate, joined)
+
+        if best is None:
+            # can't find an order without a cross product, so leave it
+            # as it was written.
+            current = NaturalJoin(_reorder_joins(node.left),
+                                  _reorder_joins(node.right))
+            break
+
+        remaining.remove(best[1])
+        current = best[2]
+
+    if current.attribute_names != node.attribute_names:
+        current = Projection(current, node.attribute_names, dedup=False)
+    return current
+
+
+def _prune(node, required):
+    """
+    Returns a plan whose output includes at least the `required` attributes
+    of `node`, with unused attributes projected away as early as possible.
+    The attribute order of the result may differ from that of `node`.
+    """
+
+    if isinstance(node, Scan):
+        names = [n for n in node.attribute_names if n in required]
+        if len(names) < len(node.attribute_names):
+            return Projection(node, names, dedup=False)
+        return node
+
+    elif isinstance(node, Projection):
+        child = _prune(node.child, set(node.attribute_names))
+        return Projection(child, node.attribute_names, node.dedup)
+
+    elif isinstance(node, Selection):
+        if node.attrs is None:
+            # we don't know which attributes the predicate reads, so keep
+            # them all.
+            child = _prune(node.child, set(node.child.attribute_names))
+            return Selection(child, node.pred)
+        child = _prune(node.child, required | set(node.attrs))
+        pred = _remap_pred(node.pred, node.attribute_names,
+                           child.attribute_names)
+        return Selection(child, pred, node.attrs)
+
+    elif isinstance(node, Rename):
+        to_old = dict(zip(node.attribute_names, node.child.attribute_names))
+        to_new = dict(zip(node.child.attribute_names, node.attribute_names))
+        child = _prune(node.child, set(to_old[n] for n in required))
+        return Rename(child, [to_new[n] for n in child.attribute_names])
+
+    elif isinstance(node, JoinFunc):
+        if node.result_name not in required:
+            return _prune(node.child, required)
+        child_required = (required - set([node.result_name])) | \
+            set(node.arg_names)
+        child = _prune(node.child, child_required)
+        return JoinFunc(child, node.arg_names, node.result_name, node.func)
+
+    elif isinstance(node, NaturalJoin):
+        join_attrs = set(node.join_attrs)
+        left = _prune(node.left, (required & set(node.left.attribute_names)) |
+                      join_attrs)
+        right = _prune(node.right,
+                       (required & set(node.right.attribute_names)) |
+                       join_attrs)
+        return NaturalJoin(left, right)
+
+    elif isinstance(node, Union):
+        names = [n for n in node.attribute_names if n in required]
+        sides = list()
+        for side in (node.left, node.right):
+            side = _prune(side, set(names))
+            if side.attribute_names != names:
+                side = Projection(side, names, dedup=False)
+            sides.append(side)
+        return Union(sides[0], sides[1])
+
+    elif isinstance(node, _SetOperation):
+        # intersection and difference compare whole tuples, so they need
+        # every attribute.
+        return _map_children(
+            node, lambda c: _prune(c, set(c.attribute_names)))
+
+    return node
+
+
+def _mark_dedup(node, covered):
+    """
+    Decides which projections need to remove duplicates. A projection's
+    dedup is redundant when `covered` by a later one, i.e. when only
+    operators which don't care about duplicates lie between them. Inputs to
+    joins and set operations are always deduplicated, to keep them small.
+    """
+
+    if isinstance(node, Projection):
+        dedup = not covered and not (
+            node.child.distinct() and
+            _is_permutation(node.attribute_names, node.child.attribute_names))
+        child = _mark_dedup(node.child, covered or dedup)
+        return Projection(child, node.attribute_names, dedup)
+
+    elif isinstance(node, (Selection, Rename, JoinFunc)):
+        return _map_children(node, lambda c: _mark_dedup(c, covered))
+
+    return _map_children(node, lambda c: _mark_dedup(c, False))
@@ -0,0 +1,259 @@
+# reading OSM data into networks of Streams.
+#
+# OSM XML files, including full history files, and osmChange (.osc) files
+# such as the minutely diffs, are parsed incrementally with iterparse. each
+# element is cleared from the tree as soon as it's been read, so memory use
+# doesn't grow with the size of the file. nodes and ways come out as rows
+# laid out to match the `attr_names` of the Streams they're pushed into, in
+# batches, and in the same order as in the file.
+#
+# relations are skipped, as nothing in neat.tiles uses them yet.
+#
+# deleted versions of nodes have no location. `push_osm` leaves them out of a
+# nodes Stream which has `lon` or `lat`, since a network such as those in
+# neat.tiles can't place them, and would fail on them.
+
+import bz2
+import calendar
+import gzip
+import time
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+NODE_ATTRS = ['id', 'version', 'lon', 'lat']
+WAY_ATTRS = ['id', 'version', 'nodes']
+
+_ELEMENTS = ('node', 'way', 'relation')
+_ACTIONS = ('create', 'modify', 'delete')
+
+
+def _int_or_none(value):
+    if value is None:
+        return None
+    return int(value)
+
+
+def _float_or_none(value):
+    if value is None:
+        return None
+    return float(value)
+
+
+def parse_timestamp(value):
+    """
+    Parses an OSM timestamp, such as "2012-03-04T05:06:07Z", into seconds
+    since the epoch.
+    """
+
+    if value is None:
+        return None
+    return calendar.timegm((int(value[0:4]), int(value[5:7]),
+                            int(value[8:10]), int(value[11:13]),
+                            int(value[14:16]), int(value[17:19]), 0, 0, 0))
+
+
+# functions to get the value of each attribute a row can have, from an
+# element, its list of tags, its list of node references and whether it
+# has been deleted.
+_FIELDS = {
+    'id': lambda e, tags, nds, deleted: int(e.get('id')),
+    'version': lambda e, tags, nds, deleted: int(e.get('version')),
+    'lon': lambda e, tags, nds, deleted: _float_or_none(e.get('lon')),
+    'lat': lambda e, tags, nds, deleted: _float_or_none(e.get('lat')),
+    'timestamp': lambda e, tags, nds, deleted:
+        parse_timestamp(e.get('timestamp')),
+    'changeset': lambda e, tags, nds, deleted:
+        _int_or_none(e.get('changeset')),
+    'uid': lambda e, tags, nds, deleted: _int_or_none(e.get('uid')),
+    'user': lambda e, tags, nds, deleted: e.get('user'),
+    'deleted': lambda e, tags, nds, deleted: deleted,
+    'tags': lambda e, tags, nds, deleted: tuple(sorted(tags)),
+    'nodes': lambda e, tags, nds, deleted: tuple(nds),
+}
+
+
+def _row_builder(attr_names):
+    for n in attr_names:
+        if n not in _FIELDS:
+            raise ValueError("Can't read attribute %r, expected one of %r"
+                             % (n, sorted(_FIELDS)))
+    fields = [_FIELDS[n] for n in attr_names]
+
+    def build(elem, tags, nds, deleted):
+        return tuple(f(elem, tags, nds, deleted) for f in fields)
+    return build
+
+
+def _open(source):
+    if not isinstance(source, string_types):
+        return source
+    if source.endswith('.gz'):
+        return gzip.open(source, 'rb')
+    if source.endswith('.bz2'):
+        return bz2.BZ2File(source, 'rb')
+    return open(source, 'rb')
+
+
+def read_osm(source, batch_size=1000, node_attrs=NODE_ATTRS,
+             way_attrs=WAY_ATTRS):
+    """
+    Reads the OSM XML or osmChange file `source`, which can be a path or a
+    file object, and yields `(kind, rows)` with `kind` either 'node' or
+    'way' and a list of up to `batch_size` rows. A batch ends early when the
+    kind of element changes, so that batches are in file order.
+
+    Rows are laid out as `node_attrs` and `way_attrs`. Besides the XML
+    attributes, rows can have `deleted`, which is True for elements in the
+    delete section of a change file or with `visible="false"`, `tags` as a
+    sorted tuple of `(key, value)` and, for ways, `nodes` as a tuple of ids.
+    """
+
+    builders = dict(node=_row_builder(node_attrs),
+                    way=_row_builder(way_attrs))
+
+    f = _open(source)
+    try:
+        kind = None
+        rows = list()
+        action = None
+        parents = list()
+        tags = list()
+        nds = list()
+
+        for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+            tag = elem.tag
+            if event == 'start':
+                if tag in _ACTIONS:
+                    action = tag
+                parents.append(elem)
+                continue
+
+            parents.pop()
+            if tag == 'tag':
+                tags.append((elem.get('k'), elem.get('v')))
+            elif tag == 'nd':
+                nds.append(int(elem.get('ref')))
+
+            elif tag in _ELEMENTS:
+                if tag in builders:
+                    if tag != kind and rows:
+                        yield kind, rows
+                        rows = list()
+                    kind = tag
+                    deleted = action == 'delete' or \
+                        elem.get('visible') == 'false'
+                    rows.append(builders[tag](elem, tags, nds, deleted))
+                    if len(rows) >= batch_size:
+                        yield kind, rows
+                        rows = list()
+
+                tags = list()
+                nds = list()
+                # drop the element, and everything before it, from the tree.
+                elem.clear()
+                if parents:
+                    parents[-1].clear()
+
+            else:
+                # anything else, such as a changeset, mustn't leave its tags
+                # behind for the next element.
+                tags = list()
+                nds = list()
+                if tag in _ACTIONS:
+                    action = None
+
+        if rows:
+            yield kind, rows
+
+    finally:
+        if f is not source:
+            f.close()
+
+
+def _location_indices(attr_names):
+    """
+    Returns the indices of `lon` and `lat` in `attr_names`.
+    """
+
+    return [i for i, n in enumerate(attr_names) if n in ('lon', 'lat')]
+
+
+def _located(rows, indices):
+    """
+    Returns the `rows` which have a value at each of `indices`.
+    """
+
+    return [r for r in rows if all(r[i] is not None for i in indices)]
+
+
+class ReadStats(object):
+    """
+    The number of `nodes` and `ways` read, and the time it took in
+    `seconds`, including pushing them through the Streams.
+    """
+
+    def __init__(self, nodes, ways, seconds):
+        self.nodes = nodes
+        self.ways = ways
+        self.seconds = seconds
+
+    @property
+    def elements(self):
+        return self.nodes + self.ways
+
+    @property
+    def rate(self):
+        """
+        Elements read per second.
+        """
+
+        if self.seconds <= 0:
+            return 0.0
+        return self.elements / self.seconds
+
+    def __repr__(self):
+        return "ReadStats(nodes=%d, ways=%d, seconds=%.3f, rate=%.0f/s)" \
+            % (self.nodes, self.ways, self.seconds, self.rate)
+
+
+def push_osm(source, nodes=None, ways=None, batch_size=1000):
+    """
+    Reads `source` as `read_osm` does, and pushes each batch of rows into
+    the `nodes` or `ways` Stream, laid out as their `attr_names`. Either
+    Stream can be None, in which case those elements are skipped. Both
+    Streams are flushed at the end, so that nothing read is left buffered
+    in the network. Returns the `ReadStats`.
+
+    Node versions without a location, such as deleted ones, aren't pushed
+    into a `nodes` Stream with `lon` or `lat`, though they're still counted.
+    """
+
+    streams = dict(node=nodes, way=ways)
+    counts = dict(node=0, way=0)
+    located = _location_indices(nodes.attr_names) \
+        if nodes is not None else []
+    start = time.time()
+
+    for kind, rows in read_osm(
+            source, batch_size,
+            nodes.attr_names if nodes is not None else NODE_ATTRS,
+            ways.attr_names if ways is not None else WAY_ATTRS):
+        counts[kind] += len(rows)
+        if kind == 'node' and located:
+            rows = _located(rows, located)
+        if streams[kind] is not None and rows:
+            streams[kind].push_rows(rows)
+
+    for stream in (nodes, ways):
+        if stream is not None:
+            stream.flush()
+
+    return ReadStats(counts['node'], counts['way'], time.time() - start)
@@ -1,32 +1,135 @@
 # a relation in the algebraic data model
 
+import os
+from operator import itemgetter
+
+from neat import spill
+
+try:
+    from itertools import izip as _izip
+except ImportError:
+    _izip = zip
+
+
+# when set, relations built through the trusted fast paths (operator outputs,
+# `from_columns` and `from_sorted_iter`) are checked just like those passed
+# to the constructor. this is a debugging aid, and is off by default.
+VALIDATE = bool(os.environ.get('NEAT_VALIDATE'))
+
+# memory budget, in bytes, for the working state of a single natural join or
+# set operation. operations which would go over it partition their inputs to
+# temporary files on local disk and process one partition at a time. None
+# means no limit.
+MEMORY_BUDGET = int(os.environ['NEAT_MEMORY_BUDGET']) \
+    if os.environ.get('NEAT_MEMORY_BUDGET') else None
+
+
 class Relation(object):
+    """
+    A set of tuples, each with a value for every one of `attribute_names`.
+
+    Relations are treated as immutable once built: every operator returns a
+    new Relation. This lets hash indexes on the tuples be built the first
+    time they're needed and then reused, so `tuples` must not be changed
+    after any operator has been run on the relation.
+
+    The output of a natural join or set operation which went over the
+    `MEMORY_BUDGET` records how many bytes it spilled to disk in
+    `spilled_bytes`.
+    """
+
+    spilled_bytes = 0
 
     def __init__(self, attribute_names, tuples=None):
         self.attribute_names = attribute_names
+        self._indexes = dict()
+        self._sorted = dict()
         if tuples:
-            for t in tuples:
-                assert len(t) == len(self.attribute_names), \
-                    "Relation tuple %r incompatible with attributes %r." \
-                    % (t, self.attribute_names)
             if isinstance(tuples, set):
                 self.tuples = tuples
             else:
                 self.tuples = set(tuples)
+            self._validate()
         else:
             self.tuples = set()
 
+    @classmethod
+    def from_columns(cls, attribute_names, columns):
+        """
+        Builds a relation from a sequence of `columns`, one per attribute in
+        `attribute_names`, each holding the values of that attribute in row
+        order. The columns are trusted to all be the same length.
+        """
+
+        assert len(columns) == len(attribute_names), \
+            "Relation has %d columns, but attributes %r." \
+            % (len(columns), attribute_names)
+        if VALIDATE:
+            lengths = set(len(c) for c in columns)
+            assert len(lengths) <= 1, \
+                "Relation columns have different lengths %r." \
+                % (sorted(lengths),)
+
+        return cls._trusted(attribute_names, set(_izip(*columns)))
+
+    @classmethod
+    def from_sorted_iter(cls, attribute_names, iterable, key_attributes=None):
+        """
+        Builds a relation from an `iterable` of tuples which are trusted to
+        be sorted on `key_attributes`, or on all attributes in order if not
+        given. The sorted order is kept, so that merge joins on those
+        attributes don't need to sort again.
+        """
+
+        if key_attributes is None:
+            key_attributes = attribute_names
+
+        in_order = list()
+        last = None
+        for t in iterable:
+            if t != last:
+                in_order.append(t)
+                last = t
+
+        relation = cls._trusted(attribute_names, set(in_order))
+        key = _key_func(relation._indices_for(key_attributes))
+        if VALIDATE:
+            for a, b in _izip(in_order, in_order[1:]):
+                assert not (key(b) < key(a)), \
+                    "Relation tuples %r and %r out of order on %r." \
+                    % (a, b, key_attributes)
+        relation._sorted[tuple(key_attributes)] = in_order
+        return relation
+
+    @classmethod
+    def _trusted(cls, attribute_names, tuples):
+        """
+        Fast path for building a relation from a `set` of `tuples` which are
+        already known to fit `attribute_names`, such as the output of an
+        operator. The set is used as-is, without checking or copying it,
+        unless `VALIDATE` is on.
+        """
+
+        relation = cls.__new__(cls)
+        relation.attribute_names = attribute_names
+        relation.tuples = tuples
+        relation._indexes = dict()
+        relation._sorted = dict()
+        if VALIDATE:
+            relation._validate()
+        return relation
+
     def union(self, other):
         self._assert_compatible(other, "union")
-        return Relation(self.attribute_names, self.tuples.union(other.tuples))
+        return self._set_operation(other, set.union)
 
     def intersection(self, other):
         self._assert_compatible(other, "intersection")
-        return Relation(self.attribute_names, self.tuples.intersection(other.tuples))
+        return self._set_operation(other, set.intersection)
 
     def difference(self, other):
         self._assert_compatible(other, "difference")
-        return Relation(self.attribute_names, self.tuples.difference(other.tuples))
+        return self._set_operation(other, set.difference)
 
     def projection(self, new_attribute_names):
         indices = list()
@@ -41,7 +144,26 @@ class Relation(object):
             new_t = tuple([t[i] for i in indices])
             new_tuples.add(new_t)
 
-        return Relation(new_attribute_names, new_tuples)
+        return Relation._trusted(new_attribute_names, new_tuples)
+
+    def selection_eq(self, attribute_names, values):
+        """
+        Selects the tuples whose values for `attribute_names` equal `values`,
+        using a cached hash index on those attributes.
+        """
+
+        return Relation._trusted(self.attribute_names,
+                                 set(self.lookup(attribute_names, values)))
+
+    def lookup(self, attribute_names, values):
+        """
+        Returns a list of the tuples whose values for `attribute_names` equal
+        `values`. The first lookup on a set of attributes builds a hash index
+        on them, which later lookups, equality selections and natural joins
+        reuse.
+        """
+
+        return self._index_for(attribute_names).get(tuple(values), [])
 
     def selection(self, pred):
         new_tuples = set()
@@ -49,14 +171,23 @@ class Relation(object):
             if pred(t):
                 new_tuples.add(t)
 
-        return Relation(self.attribute_names, new_tuples)
+        return Relation._trusted(self.attribute_names, new_tuples)
 
     def rename(self, new_attribute_names):
         assert len(new_attribute_names) == len(self.attribute_names), \
             "New attribute names wrong length: len(%r) != len(%r)" \
             % (new_attribute_names, self.attribute_names)
 
-        return Relation(new_attribute_names, self.tuples)
+        renamed = Relation._trusted(new_attribute_names, self.tuples)
+
+        # the tuples are shared, so the indexes and sort orders can be too.
+        names = dict(zip(self.attribute_names, new_attribute_names))
+        for attrs, index in self._indexes.items():
+            renamed._indexes[tuple([names[n] for n in attrs])] = index
+        for attrs, in_order in self._sorted.items():
+            renamed._sorted[tuple([names[n] for n in attrs])] = in_order
+
+        return renamed
 
     def join_func(self, arg_names, result_name, func):
         idx = self._indices_for(arg_names)
@@ -67,39 +198,86 @@ class Relation(object):
             result = func(*args)
             new_tuples.add(tuple(list(t) + [result]))
 
-        return Relation(self.attribute_names + [result_name], new_tuples)
+        return Relation._trusted(self.attribute_names + [result_name],
+                                 new_tuples)
+
+    def natural_join(self, other, method='hash'):
+        """
+        Natural join of this relation with `other` on all the attributes they
+        share. The output has this relation's attributes followed by the
+        attributes only present in `other`.
+
+        The `method` selects the join engine:
+
+          * 'hash' (the default) builds a hash table on the join key of the
+            smaller input and probes it with the larger one.
+          * 'merge' sorts both inputs on the join key and merges matching
+            runs. Sorting already-ordered input is cheap, so this is useful
+            when the tuples arrive in key order.
+          * 'nested' compares every pair of tuples. It's only really useful
+            as a reference for testing and benchmarking the others.
+        """
 
-    def natural_join(self, other):
         self_attr_set = set(self.attribute_names)
         other_attr_set = set(other.attribute_names)
 
-        join_attrs = self_attr_set & other_attr_set
-        additional_attrs = list(other_attr_set - self_attr_set)
+        join_attrs = [n for n in self.attribute_names if n in other_attr_set]
+        additional_attrs = [n for n in other.attribute_names
+                            if n not in self_attr_set]
 
         assert len(join_attrs) > 0, \
             "Natural join needs at least one shared attribute " \
             "between %r and %r" \
             % (self.attribute_names, other.attribute_names)
 
-        join_idx = zip(self._indices_for(join_attrs),
-                       other._indices_for(join_attrs))
-
+        self_idx = self._indices_for(join_attrs)
+        other_idx = other._indices_for(join_attrs)
         additional_idx = other._indices_for(additional_attrs)
 
-        new_tuples = set()
-        for t1 in self.tuples:
-            for t2 in other.tuples:
-                match = True
-                for i1, i2 in join_idx:
-                    if t1[i1] != t2[i2]:
-                        match = False
-                        break
+        stats = None
+        if method == 'hash':
+            build = self if len(self.tuples) <= len(other.tuples) else other
+            if tuple(join_attrs) not in build._indexes and \
+               spill.over_budget(build.tuples, MEMORY_BUDGET):
+                stats = spill.SpillStats()
+                new_tuples = spill.grace_join(
+                    lambda part1, part2: _hash_join(
+                        part1, self_idx, part2, other_idx, additional_idx),
+                    self.tuples, _key_func(self_idx),
+                    other.tuples, _key_func(other_idx),
+                    MEMORY_BUDGET, stats)
+            else:
+                new_tuples = _hash_join(
+                    self.tuples, self_idx, other.tuples, other_idx,
+                    additional_idx,
+                    index1=lambda: self._index_for(join_attrs),
+                    index2=lambda: other._index_for(join_attrs))
+        elif method == 'merge':
+            new_tuples = _merge_join(
+                self._sorted.get(tuple(join_attrs), self.tuples), self_idx,
+                other._sorted.get(tuple(join_attrs), other.tuples), other_idx,
+                additional_idx)
+        elif method == 'nested':
+            new_tuples = _nested_loop_join(self.tuples, self_idx, other.tuples,
+                                           other_idx, additional_idx)
+        else:
+            raise ValueError("Unknown natural join method %r" % (method,))
+
+        result = Relation._trusted(self.attribute_names + additional_attrs,
+                                   new_tuples)
+        if stats is not None:
+            result.spilled_bytes = stats.bytes
+        return result
 
-                if match:
-                    new_t = tuple(list(t1) + [t2[i] for i in additional_idx])
-                    new_tuples.add(new_t)
+    def lazy(self):
+        """
+        Returns a `neat.plan.LazyRelation` over this relation, which records
+        further operators as a query plan instead of running them straight
+        away.
+        """
 
-        return Relation(self.attribute_names + additional_attrs, new_tuples)
+        from neat.plan import LazyRelation
+        return LazyRelation(self)
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -114,6 +292,43 @@ class Relation(object):
     def __repr__(self):
         return "Relation(%r, %r)" % (self.attribute_names, list(self.tuples))
 
+    def _set_operation(self, other, op):
+        stats = None
+        both = spill._Sized(len(self.tuples) + len(other.tuples),
+                            self.tuples or other.tuples)
+        if spill.over_budget(both, MEMORY_BUDGET):
+            stats = spill.SpillStats()
+            new_tuples = spill.grace_set_operation(
+                op, self.tuples, other.tuples, MEMORY_BUDGET, stats)
+        else:
+            new_tuples = op(self.tuples, other.tuples)
+
+        result = Relation._trusted(self.attribute_names, new_tuples)
+        if stats is not None:
+            result.spilled_bytes = stats.bytes
+        return result
+
+    def _validate(self):
+        for t in self.tuples:
+            assert len(t) == len(self.attribute_names), \
+                "Relation tuple %r incompatible with attributes %r." \
+                % (t, self.attribute_names)
+
+    def _index_for(self, attributes):
+        """
+        Returns a dict from the tuple of values for `attributes` to the list
+        of tuples having those values, building it the first time it's asked
+        for.
+        """
+
+        attributes = tuple(attributes)
+        index = self._indexes.get(attributes)
+        if index is None:
+            index = _build_index(self.tuples,
+                                 _key_func(self._indices_for(attributes)))
+            self._indexes[attributes] = index
+        return index
+
     def _indices_for(self, attributes):
         indices = list()
         for n in attributes:
@@ -124,3 +339,129 @@ class Relation(object):
         assert self.attribute_names == other.attribute_names, \
             "Relation attributes incompatible in %s: %r != %r" \
             % (op_name, self.attribute_names, other.attribute_names)
+
+
+def _key_func(indices):
+    """
+    Returns a function which extracts the values at `indices` from a tuple as
+    a tuple, suitable for use as a dict key or sort key.
+    """
+
+    if len(indices) == 1:
+        i = indices[0]
+        return lambda t: (t[i],)
+    return itemgetter(*indices)
+
+
+def _nested_loop_join(tuples1, idx1, tuples2, idx2, additional_idx):
+    join_idx = list(zip(idx1, idx2))
+
+    new_tuples = set()
+    for t1 in tuples1:
+        for t2 in tuples2:
+            match = True
+            for i1, i2 in join_idx:
+                if t1[i1] != t2[i2]:
+                    match = False
+                    break
+
+            if match:
+                new_t = tuple(list(t1) + [t2[i] for i in additional_idx])
+                new_tuples.add(new_t)
+
+    return new_tuples
+
+
+def _build_index(tuples, key):
+    index = dict()
+    for t in tuples:
+        index.setdefault(key(t), []).append(t)
+    return index
+
+
+def _hash_join(tuples1, idx1, tuples2, idx2, additional_idx,
+               index1=None, index2=None):
+    """
+    Hash join of `tuples1` and `tuples2`, matching the values at `idx1` with
+    those at `idx2`. If given, `index1` and `index2` are functions returning
+    an existing index of that side on the join key, to use instead of
+    building a new one.
+    """
+
+    key1 = _key_func(idx1)
+    key2 = _key_func(idx2)
+    extra = _key_func(additional_idx) if additional_idx else lambda t: ()
+
+    new_tuples = set()
+
+    # build on the smaller side, probe with the larger one. the output is
+    # always the left tuple followed by the additional right values, no
+    # matter which side was used to build.
+    if len(tuples1) <= len(tuples2):
+        table = index1() if index1 else _build_index(tuples1, key1)
+
+        for t2 in tuples2:
+            matches = table.get(key2(t2))
+            if matches:
+                e = extra(t2)
+                for t1 in matches:
+                    new_tuples.add(t1 + e)
+
+    else:
+        table = index2() if index2 else _build_index(tuples2, key2)
+
+        for t1 in tuples1:
+            matches = table.get(key1(t1))
+            if matches:
+                for t2 in matches:
+                    new_tuples.add(t1 + extra(t2))
+
+    return new_tuples
+
+
+def _merge_join(tuples1, idx1, tuples2, idx2, additional_idx):
+    key1 = _key_func(idx1)
+    key2 = _key_func(idx2)
+    extra = _key_func(additional_idx) if additional_idx else lambda t: ()
+
+    # inputs which are already sorted (lists from `from_sorted_iter`) are
+    # used as they are.
+    sorted1 = tuples1
+    if not isinstance(sorted1, list):
+        sorted1 = sorted(tuples1, key=key1)
+    sorted2 = tuples2
+    if not isinstance(sorted2, list):
+        sorted2 = sorted(tuples2, key=key2)
+    n1 = len(sorted1)
+    n2 = len(sorted2)
+
+    new_tuples = set()
+    i = j = 0
+    while i < n1 and j < n2:
+        k1 = key1(sorted1[i])
+        k2 = key2(sorted2[j])
+
+        if k1 < k2:
+            i += 1
+        elif k2 < k1:
+            j += 1
+
+        else:
+            # find the end of the run of equal keys on both sides, and emit
+            # their cross product.
+            i_end = i + 1
+            while i_end < n1 and key1(sorted1[i_end]) == k1:
+                i_end += 1
+            j_end = j + 1
+            while j_end < n2 and key2(sorted2[j_end]) == k2:
+                j_end += 1
+
+            extras = [extra(t2) for t2 in sorted2[j:j_end]]
+            for t1 in sorted1[i:i_end]:
+                for e in extras:
+                    new_tuples.add(t1 + e)
+
+            i = i_end
+            j = j_end
+
+    return new_tuples
@@ -0,0 +1,259 @@
+# running a network of Streams as a pipeline of threads.
+#
+# normally, one push runs to completion through every listener, so a slow
+# sink such as a disk writer holds up the reader feeding the network. a
+# Runtime cuts the network at chosen edges, and puts a bounded queue on each
+# one. everything between the cuts, its "region", is run by one thread, in
+# the order the calls were queued. when a queue is full, whatever is pushing
+# into it waits, so a slow sink slows down the network, which in turn slows
+# down the reader, rather than everything piling up in memory.
+#
+# output is deterministic because each region is fed by one queue, from a
+# single upstream thread, and so sees exactly the same calls in the same
+# order as it would without the runtime. for the same reason, no operator
+# may be in more than one region: a join whose inputs are cut apart would
+# see them interleaved differently from run to run, and isn't thread safe
+# anyway, so this is checked when the runtime starts.
+#
+# threads overlap I/O, and anything else which releases the GIL, such as
+# decompression or writing files, with the pure Python work of the network.
+
+import sys
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class Stage(object):
+    """
+    A thread which makes the calls put into its queue of at most `maxsize`
+    calls, one at a time and in order.
+
+    If a call raises an exception, the rest of the calls are dropped, so
+    that nothing upstream waits forever, and the exception is raised again
+    from `put()` and from `Runtime.close()`.
+    """
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.error = None
+        # number of calls made, which lets the runtime tell when it's idle.
+        self.processed = 0
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+
+    def put(self, func, args):
+        if self.error is not None:
+            raise self.error
+        self._queue.put((func, args))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def join(self):
+        """
+        Waits until everything queued so far has been processed.
+        """
+        self._queue.join()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    func, args = item
+                    func(*args)
+            except Exception:
+                self.error = sys.exc_info()[1]
+            finally:
+                self.processed += 1
+                self._queue.task_done()
+
+
+class Edge(object):
+    """
+    Stands in for `target`, a Stream or other listener, and queues each call
+    made to it on `stage`, to be made by the stage's thread.
+    """
+
+    def __init__(self, stage, target):
+        self._stage = stage
+        self._target = target
+        self.attr_names = getattr(target, 'attr_names', None)
+
+    def push(self, items):
+        self._stage.put(self._target.push, (list(items),))
+
+    def push_rows(self, rows):
+        self._stage.put(self._target.push_rows, (rows,))
+
+    def push_batch(self, batch):
+        self._stage.put(getattr(self._target, 'push_batch',
+                                self._push_batch_rows), (batch,))
+
+    def flush(self):
+        flush = getattr(self._target, 'flush', None)
+        if flush is not None:
+            self._stage.put(flush, ())
+
+    def _push_batch_rows(self, batch):
+        self._target.push_rows(batch.rows())
+
+
+class Runtime(object):
+    """
+    Runs parts of a network of Streams in their own threads, with a queue of
+    at most `maxsize` calls in front of each.
+
+    Data goes in through the `inlet()`s, and the network is cut into more
+    threads with `decouple()`. Once the network is built, `start()` the
+    runtime, push everything through the inlets, then `close()` it, which
+    waits for everything to be processed. The runtime can also be used as a
+    context manager, which starts and closes it.
+    """
+
+    def __init__(self, maxsize=16):
+        if maxsize < 1:
+            raise ValueError("Runtime needs maxsize >= 1, not %r"
+                             % (maxsize,))
+        self.maxsize = maxsize
+        # list of (stage, targets run by the stage's thread).
+        self._stages = list()
+        self._started = False
+
+    def inlet(self, *streams):
+        """
+        Returns a list of stand-ins for `streams`, which can be pushed to
+        and flushed just like them, but which queue the calls for a single
+        thread to run. Everything downstream of `streams` is run by that
+        thread, up to any decoupled edges.
+        """
+
+        stage = self._stage(streams)
+        return [Edge(stage, s) for s in streams]
+
+    def decouple(self, stream):
+        """
+        Returns a new Stream, with the same attributes as `stream`, which is
+        pushed everything pushed out of `stream`, but in a thread of its own.
+        Listeners should be added to the new Stream rather than `stream`.
+        """
+
+        s = _new_stream(stream)
+        stage = self._stage([s])
+        stream._listeners.append(Edge(stage, s))
+        return s
+
+    def start(self):
+        """
+        Checks that no part of the network would be run by more than one
+        thread, and starts the threads.
+        """
+
+        assert not self._started, "Runtime has already been started."
+
+        owners = dict()
+        for stage, targets in self._stages:
+            for node_id in _region(targets):
+                other = owners.setdefault(node_id, stage)
+                if other is not stage:
+                    raise ValueError(
+                        "Part of the network would be run by both %s and "
+                        "%s. Decoupled edges must not join back together."
+                        % (other.name, stage.name))
+
+        for stage, _ in self._stages:
+            stage.start()
+        self._started = True
+
+    def join(self):
+        """
+        Waits until everything pushed so far has gone all the way through
+        the network, and raises the first error from any thread.
+        """
+
+        stages = [s for s, _ in self._stages]
+        while True:
+            # a stage which has emptied its queue may be pushed more by one
+            # further upstream, so keep going until a whole pass finds
+            # nothing left to do.
+            before = sum(s.processed for s in stages)
+            for stage in stages:
+                stage.join()
+            if sum(s.processed for s in stages) == before:
+                break
+
+        for stage in stages:
+            if stage.error is not None:
+                raise stage.error
+
+    def close(self):
+        """
+        Waits for everything pushed to be processed, stops the threads, and
+        raises the first error from any of them.
+        """
+
+        try:
+            if self._started:
+                self.join()
+        finally:
+            for stage, _ in self._stages:
+                stage.stop()
+            self._started = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _stage(self, targets):
+        assert not self._started, \
+            "Can't add to the network of a Runtime once it has started."
+        stage = Stage('neat-stage-%d' % len(self._stages), self.maxsize)
+        self._stages.append((stage, list(targets)))
+        return stage
+
+
+def _new_stream(stream):
+    # Streams from neat.external pass their state factories on to the
+    # Streams derived from them.
+    derive = getattr(stream, '_derive', None)
+    if derive is not None:
+        return derive(stream.attr_names)
+    return type(stream)(stream.attr_names)
+
+
+def _region(targets):
+    """
+    Returns the ids of everything reachable from `targets` without going
+    through an Edge into another thread.
+    """
+
+    seen = set()
+    stack = list(targets)
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if isinstance(node, Edge):
+            continue
+        for listener in getattr(node, '_listeners', ()):
+            # the halves of a join forward to the join itself.
+            stack.append(getattr(listener, '_parent', listener))
+    return seen
@@ -0,0 +1,245 @@
+# a natural join for neat.external Streams, with its state split across
+# worker processes.
+#
+# each row pushed into the join is routed by a hash of its join key to one
+# of the shards, so every row with a given key goes to the same worker, and
+# the workers' Dictionaries are disjoint. the parent sends each shard its
+# part of a batch, then collects the results, so the shards probe their
+# Dictionaries and build the output rows in parallel. results are put back
+# into the order of the input rows, and each shard sees the rows for its
+# keys in the same order the single-process join would, so the output is
+# exactly the same, row for row.
+#
+# as in neat.parallel, rows travel between processes with marshal, so their
+# values must be plain built-in types. the workers are forked from the
+# parent, which keeps hashes, and so the iteration order of the join state,
+# the same as in the parent. the join state can't be kept in a
+# neat.store.SqliteStore, since the forked workers would share its
+# connection.
+#
+# if a shard fails, the others have already taken in their part of the
+# batch, so the join is broken, and anything pushed into it afterwards
+# fails too.
+
+import heapq
+import marshal
+import multiprocessing
+import time
+
+from neat.external import Dictionary, JoiningStream
+from neat.store import SqliteStore
+
+
+class ShardStats(object):
+    """
+    Load on one shard of a join: the number of input `rows` routed to it,
+    the number of `outputs` it made and the `seconds` it spent on them. The
+    join key which fanned out to the most rows at once is `hottest_key`,
+    with that number of rows in `hottest_fanout`, to help spot skewed keys
+    such as very popular nodes.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.outputs = 0
+        self.seconds = 0.0
+        self.hottest_key = None
+        self.hottest_fanout = 0
+
+    def __repr__(self):
+        return "ShardStats(rows=%d, outputs=%d, seconds=%.3f, " \
+            "hottest_key=%r, hottest_fanout=%d)" \
+            % (self.rows, self.outputs, self.seconds, self.hottest_key,
+               self.hottest_fanout)
+
+
+class ShardedJoiningStream(JoiningStream):
+    """
+    A `JoiningStream` which keeps its state in `shards` worker processes, by
+    default one per CPU, each with a Dictionary made by `dict_factory`. Its
+    output is the same as that of `JoiningStream`.
+
+    The workers are started by the first push, and stopped by `close()`.
+    Per-shard load is in `stats`, a list of `ShardStats`.
+    """
+
+    def __init__(self, left, right, shards=None, dict_factory=Dictionary):
+        if _store_backed(dict_factory):
+            raise ValueError("A sharded join can't keep its state in a "
+                             "SqliteStore, its workers would share the "
+                             "connection. Pass another dict_factory.")
+
+        # the state is all in the workers, none of it in this process.
+        JoiningStream.__init__(self, left, right, lambda: None)
+
+        self.shards = shards or multiprocessing.cpu_count()
+        self.stats = [ShardStats() for _ in range(self.shards)]
+        self._dict_factory = dict_factory
+        self._workers = None
+        self._closed = False
+        # why the join is broken, if a shard has failed.
+        self._broken = None
+
+    def push_rows(self, pos, rows):
+        if self._closed:
+            raise RuntimeError("Can't push into a sharded join after it "
+                               "has been closed.")
+        if self._broken is not None:
+            raise RuntimeError("Can't push into a sharded join after a "
+                               "shard has failed: %s" % self._broken)
+        if not rows:
+            return
+        if self._workers is None:
+            self._start()
+
+        join_getter = self._join_getters[pos]
+        key_getter = self._key_getters[pos]
+        n = self.shards
+        parts = [list() for _ in range(n)]
+        for i, row in enumerate(rows):
+            idx = join_getter(row)
+            parts[hash(idx) % n].append((i, idx, key_getter(row)))
+
+        busy = list()
+        for shard, part in enumerate(parts):
+            if part:
+                self._workers[shard][0].send_bytes(marshal.dumps((pos, part)))
+                busy.append(shard)
+
+        # every busy shard's reply is read, even after one has failed, so
+        # that none are left in the pipes.
+        replies = [(shard, marshal.loads(self._workers[shard][0].recv_bytes()))
+                   for shard in busy]
+        for shard, result in replies:
+            if result[0] is None:
+                self._broken = "shard %d failed: %s" % (shard, result[1])
+                raise RuntimeError("Join %s" % self._broken)
+
+        results = list()
+        for shard, result in replies:
+            outputs, seconds, fanout, key = result
+
+            stats = self.stats[shard]
+            stats.rows += len(parts[shard])
+            stats.outputs += sum(len(o) for _, o in outputs)
+            stats.seconds += seconds
+            if fanout > stats.hottest_fanout:
+                stats.hottest_fanout = fanout
+                stats.hottest_key = key
+            results.append(outputs)
+
+        # each shard's outputs are in input order already, and no two have
+        # the same input row, so they merge on that alone.
+        output_rows = list()
+        for _, out in heapq.merge(*results):
+            output_rows.extend(out)
+
+        if output_rows:
+            for listener in self._listeners:
+                listener.push_rows(output_rows)
+
+    @property
+    def skew(self):
+        """
+        The ratio of the most rows routed to one shard to the mean, which is
+        1.0 when the load is perfectly even.
+        """
+
+        rows = [s.rows for s in self.stats]
+        total = sum(rows)
+        if not total:
+            return 1.0
+        return max(rows) * len(rows) / float(total)
+
+    def close(self):
+        """
+        Stops the worker processes. Their state is lost, so nothing more can
+        be pushed into the join.
+        """
+
+        self._closed = True
+        if not self._workers:
+            return
+        for conn, process in self._workers:
+            conn.send_bytes(b'')
+            process.join()
+            conn.close()
+        self._workers = list()
+
+    def _start(self):
+        self._workers = list()
+        for _ in range(self.shards):
+            conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_shard_worker, args=(child_conn, self._dict_factory))
+            process.daemon = True
+            process.start()
+            child_conn.close()
+            self._workers.append((conn, process))
+
+
+def _store_backed(factory):
+    """
+    Returns True if `factory` makes Dictionaries kept in a `SqliteStore`,
+    such as its bound `dictionary` method or a partial of it.
+    """
+
+    factory = getattr(factory, 'func', factory)
+    return isinstance(getattr(factory, '__self__', None), SqliteStore)
+
+
+def _shard_worker(conn, dict_factory):
+    join = dict_factory()
+    while True:
+        data = conn.recv_bytes()
+        if not data:
+            break
+
+        start = time.time()
+        try:
+            pos, items = marshal.loads(data)
+            outputs = list()
+            hottest_fanout = 0
+            hottest_key = None
+            for i, idx, key in items:
+                not_exists, iterable = join.get_and_add(idx, pos, key)
+                if not not_exists:
+                    continue
+                if pos == 0:
+                    base = key + idx
+                    out = [base + o for o in iterable]
+                else:
+                    tail = idx + key
+                    out = [o + tail for o in iterable]
+                if out:
+                    outputs.append((i, out))
+                    if len(out) > hottest_fanout:
+                        hottest_fanout = len(out)
+                        hottest_key = idx
+            join.flush()
+            result = (outputs, time.time() - start, hottest_fanout,
+                      hottest_key)
+        except Exception as e:
+            result = (None, repr(e))
+        conn.send_bytes(marshal.dumps(result))
+    conn.close()
+
+
+def sharded_natural_join(left, right, shards=None, dict_factory=None):
+    """
+    Joins the neat.external Streams `left` and `right` as `natural_join`
+    does, with a `ShardedJoiningStream`. Returns the joined Stream, and the
+    join itself, for its stats and to close it once everything has been
+    pushed. The join state is kept by `dict_factory`, by default the same as
+    for `left`, which mustn't be kept in a `SqliteStore`.
+    """
+
+    js = ShardedJoiningStream(left, right, shards,
+                              dict_factory or left._dict_factory)
+
+    left._listeners.append(js.left)
+    right._listeners.append(js.right)
+
+    s = left._derive(js.attrs())
+    js._listeners.append(s)
+    return s, js
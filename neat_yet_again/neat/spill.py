@@ -0,0 +1,195 @@
+# spilling relational operators to local disk when their working state would
+# be larger than the memory budget.
+#
+# both inputs are partitioned by a hash of the key (the join key for joins,
+# or the whole tuple for set operations) into temporary files, and then each
+# pair of partitions is processed in memory. because equal keys always hash
+# to the same partition, the results of the partitions can simply be unioned.
+
+import os
+import shutil
+import sys
+import tempfile
+from itertools import islice
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+# number of tuples written to a partition file at a time.
+BATCH_SIZE = 4096
+
+# number of tuples sampled to estimate the size of a collection.
+SAMPLE_SIZE = 64
+
+# how many times a partition which is still too big will be re-partitioned
+# before giving up and processing it in memory anyway.
+MAX_DEPTH = 3
+
+# approximate per-entry overhead of a set or dict slot, in bytes.
+_SLOT_OVERHEAD = 3 * 8
+
+
+class SpillStats(object):
+    """
+    Counts of what an operator spilled to disk.
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.partitions = 0
+
+    def __repr__(self):
+        return "SpillStats(bytes=%d, partitions=%d)" \
+            % (self.bytes, self.partitions)
+
+
+def estimate_size(tuples):
+    """
+    Estimates the memory used by holding the collection of `tuples` in a set
+    or hash table, in bytes, from a sample of them.
+    """
+
+    n = len(tuples)
+    if n == 0:
+        return 0
+
+    total = 0
+    count = 0
+    for t in islice(tuples, SAMPLE_SIZE):
+        total += sys.getsizeof(t) + sum(sys.getsizeof(v) for v in t)
+        count += 1
+
+    return n * (total // count + _SLOT_OVERHEAD)
+
+
+def over_budget(tuples, budget):
+    return budget is not None and estimate_size(tuples) > budget
+
+
+def grace_join(join, tuples1, key1, tuples2, key2, budget, stats,
+               tmpdir=None, depth=0):
+    """
+    Joins `tuples1` and `tuples2` by partitioning both on their join keys,
+    given by the functions `key1` and `key2`, so that each partition of the
+    smaller side fits within `budget` bytes. Each pair of partitions is
+    joined by calling `join(part1, part2)`, which should return a set.
+    """
+
+    build = tuples1 if len(tuples1) <= len(tuples2) else tuples2
+    return _grace(join, tuples1, key1, tuples2, key2, build, budget, stats,
+                  tmpdir, depth)
+
+
+def grace_set_operation(op, tuples1, tuples2, budget, stats, tmpdir=None):
+    """
+    Applies the set operation `op(part1, part2)` partition by partition,
+    partitioning on the whole tuple, so that each partition fits within
+    `budget` bytes.
+    """
+
+    def whole(t):
+        return t
+
+    def apply_op(part1, part2):
+        return op(set(part1), set(part2))
+
+    both = _Sized(len(tuples1) + len(tuples2), tuples1)
+    return _grace(apply_op, tuples1, whole, tuples2, whole, both, budget,
+                  stats, tmpdir, 0)
+
+
+class _Sized(object):
+    """
+    Something to estimate the size of: `n` tuples like the ones in `sample`.
+    """
+
+    def __init__(self, n, sample):
+        self._n = n
+        self._sample = sample
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        return iter(self._sample)
+
+
+def _grace(op, tuples1, key1, tuples2, key2, build, budget, stats, tmpdir,
+           depth):
+    num_partitions = max(2, int(estimate_size(build) // max(budget, 1)) + 1)
+    workdir = tempfile.mkdtemp(prefix='neat-spill-', dir=tmpdir)
+
+    try:
+        paths1 = _partition(tuples1, key1, num_partitions, depth,
+                            os.path.join(workdir, 'l'), stats)
+        paths2 = _partition(tuples2, key2, num_partitions, depth,
+                            os.path.join(workdir, 'r'), stats)
+
+        result = set()
+        for path1, path2 in zip(paths1, paths2):
+            part1 = _read_partition(path1)
+            part2 = _read_partition(path2)
+            if not part1 and not part2:
+                continue
+
+            smaller = part1 if len(part1) <= len(part2) else part2
+            if depth < MAX_DEPTH and estimate_size(smaller) > budget and \
+               len(smaller) < len(build):
+                # still too big, so split it again with a different hash.
+                result.update(_grace(op, part1, key1, part2, key2, smaller,
+                                     budget, stats, workdir, depth + 1))
+            else:
+                result.update(op(part1, part2))
+
+            del part1, part2
+
+        return result
+
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _partition(tuples, key, num_partitions, salt, prefix, stats):
+    """
+    Writes `tuples` to `num_partitions` files named from `prefix`, choosing
+    the file by a hash of the tuple's key. Returns the list of file names.
+    """
+
+    paths = ["%s%04d" % (prefix, i) for i in range(num_partitions)]
+    files = [open(p, 'wb') for p in paths]
+    buffers = [list() for _ in paths]
+
+    try:
+        for t in tuples:
+            i = hash((salt, key(t))) % num_partitions
+            buf = buffers[i]
+            buf.append(t)
+            if len(buf) >= BATCH_SIZE:
+                pickle.dump(buf, files[i], pickle.HIGHEST_PROTOCOL)
+                buffers[i] = list()
+
+        for f, buf in zip(files, buffers):
+            if buf:
+                pickle.dump(buf, f, pickle.HIGHEST_PROTOCOL)
+            stats.bytes += f.tell()
+
+    finally:
+        for f in files:
+            f.close()
+
+    stats.partitions += num_partitions
+    return paths
+
+
+def _read_partition(path):
+    tuples = list()
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                tuples.extend(pickle.load(f))
+            except EOFError:
+                break
+    return tuples
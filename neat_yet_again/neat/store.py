@@ -0,0 +1,312 @@
+# persistent storage for the state of a network of external Streams.
+#
+# the join dictionaries and deduplicators of `neat.external` are kept in a
+# sqlite database, so that they survive a restart and aren't limited by the
+# size of memory. a bounded LRU cache of recently used keys sits in front of
+# the database, and changes are buffered and written back when the Stream
+# calls `flush()` at the end of each batch, so that a batch costs one
+# transaction rather than a write per row.
+#
+# keys and rows are stored as marshalled tuples by default, so their values
+# must be plain built-in types, such as numbers, strings, None and tuples of
+# those. dictionaries, deduplicators and indexes can be given a more compact
+# codec from neat.codec instead, when the layout of their rows or values is
+# known. join keys and rows are looked up by their encoded bytes, so a codec
+# must encode equal values to the same bytes, as those in neat.codec do;
+# otherwise a key built differently from the one written, say a long rather
+# than an int, isn't found once it has dropped out of the cache.
+#
+# tables are named in the order they're created, so a network which is built
+# the same way each time it starts picks up the same state.
+#
+# a store can be used from more than one thread, as when the Streams it
+# backs run in a neat.runtime.Runtime. the connection isn't tied to the
+# thread which opened it, and every statement holds the store's lock.
+
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from neat.codec import MarshalCodec
+from neat.keys import RangeScans
+
+
+class LRUCache(object):
+    """
+    A mapping which holds at most `capacity` items, discarding the least
+    recently used one when it's full.
+    """
+
+    def __init__(self, capacity):
+        if capacity <= 0:
+            raise ValueError("LRU cache needs a positive capacity, not %r"
+                             % (capacity,))
+        self.capacity = capacity
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        items = self._items
+        if key not in items:
+            return default
+        # re-inserting moves the key to the most recently used end.
+        value = items.pop(key)
+        items[key] = value
+        return value
+
+    def put(self, key, value):
+        items = self._items
+        if key in items:
+            del items[key]
+        elif len(items) >= self.capacity:
+            items.popitem(last=False)
+        items[key] = value
+
+
+class SqliteStore(object):
+    """
+    A sqlite database at `path` holding any number of join dictionaries,
+    deduplicators and key indexes. The bound methods `dictionary` and
+    `deduplicator` can be passed straight to `Stream` as its `dict_factory`
+    and `dedup_factory`.
+
+    Each dictionary and deduplicator caches up to `cache_size` keys in memory.
+    """
+
+    def __init__(self, path, cache_size=10000):
+        self.path = path
+        self.cache_size = cache_size
+        self.transactions = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._tables = 0
+
+    def dictionary(self, name=None, codec=None):
+        return StoredDictionary(self, self._table('join', name),
+                                codec or _MARSHAL)
+
+    def deduplicator(self, name=None, codec=None):
+        return StoredDeduplicator(self, self._table('dedup', name),
+                                  codec or _MARSHAL)
+
+    def index(self, name=None, codec=None):
+        return StoredKeyIndex(self, self._table('index', name),
+                              codec or _MARSHAL)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _table(self, kind, name):
+        if name is None:
+            name = str(self._tables)
+            self._tables += 1
+        table = '%s_%s' % (kind, name)
+        assert table.replace('_', '').isalnum(), \
+            "Store table names must be alphanumeric, not %r" % (name,)
+        return table
+
+    def _write(self, sql, params):
+        """
+        Runs `sql` for each of `params` in a single transaction.
+        """
+
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(sql, params)
+            self.transactions += 1
+
+    def _query(self, sql, params=()):
+        """
+        Runs `sql` and returns a list of all the rows it selects.
+        """
+
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+
+_MARSHAL = MarshalCodec()
+
+
+def _encode(value, codec=_MARSHAL):
+    return sqlite3.Binary(codec.encode(value))
+
+
+def _decode(data, codec=_MARSHAL):
+    return codec.decode(bytes(data))
+
+
+class StoredDictionary(object):
+    """
+    A `neat.external.Dictionary` kept in a `SqliteStore`. Each join key is
+    cached in memory along with both of its sides, and rows added since the
+    last `flush()` are kept in a buffer until then.
+
+    The join keys and the keys of both sides are all encoded with `codec`.
+    """
+
+    def __init__(self, store, table, codec=_MARSHAL):
+        self._store = store
+        self._table = table
+        self._codec = codec
+        self._cache = LRUCache(store.cache_size)
+        # join key -> list of (pos, pos_key) not yet written out.
+        self._pending = dict()
+
+        store._query(
+            'CREATE TABLE IF NOT EXISTS %s ('
+            'key BLOB, pos INTEGER, pos_key BLOB, '
+            'PRIMARY KEY (key, pos, pos_key))' % table)
+
+    def get_and_add(self, key, pos, pos_key):
+        obj = self._cache.get(key)
+        if obj is None:
+            obj = self._load(key)
+        self._cache.put(key, obj)
+        l, r = obj
+
+        pos_set = l if pos == 0 else r
+        exists = pos_key in pos_set
+        if not exists:
+            pos_set.add(pos_key)
+            self._pending.setdefault(key, list()).append((pos, pos_key))
+
+        not_exists = not exists
+        iterable = r if pos == 0 else l
+        return not_exists, iterable
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        codec = self._codec
+        params = list()
+        for key, added in self._pending.items():
+            encoded = _encode(key, codec)
+            for pos, pos_key in added:
+                params.append((encoded, pos, _encode(pos_key, codec)))
+
+        self._store._write(
+            'INSERT OR IGNORE INTO %s VALUES (?, ?, ?)' % self._table,
+            params)
+        self._pending = dict()
+
+    def _load(self, key):
+        obj = (set(), set())
+        rows = self._store._query(
+            'SELECT pos, pos_key FROM %s WHERE key = ?' % self._table,
+            (_encode(key, self._codec),))
+        for pos, pos_key in rows:
+            obj[pos].add(_decode(pos_key, self._codec))
+
+        # rows added to a key which has since dropped out of the cache might
+        # not have been written yet.
+        for pos, pos_key in self._pending.get(key, ()):
+            obj[pos].add(pos_key)
+        return obj
+
+
+class StoredDeduplicator(object):
+    """
+    A `neat.external.Deduplicator` kept in a `SqliteStore`. Recently seen
+    rows are cached, and rows emitted since the last `flush()` are kept in
+    a buffer until then.
+    """
+
+    def __init__(self, store, table, codec=_MARSHAL):
+        self._store = store
+        self._table = table
+        self._codec = codec
+        self._cache = LRUCache(store.cache_size)
+        self._pending = set()
+
+        store._query(
+            'CREATE TABLE IF NOT EXISTS %s (row BLOB PRIMARY KEY)' % table)
+
+    def should_emit(self, row):
+        if row in self._pending or self._cache.get(row) is not None:
+            return False
+
+        exists = bool(self._store._query(
+            'SELECT 1 FROM %s WHERE row = ?' % self._table,
+            (_encode(row, self._codec),)))
+
+        self._cache.put(row, True)
+        if not exists:
+            self._pending.add(row)
+        return not exists
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        self._store._write(
+            'INSERT OR IGNORE INTO %s VALUES (?)' % self._table,
+            [(_encode(row, self._codec),) for row in self._pending])
+        self._pending = set()
+
+
+class StoredKeyIndex(RangeScans):
+    """
+    A `neat.keys.KeyIndex` kept in a `SqliteStore`. The keys are the primary
+    key of the table, so a range scan is a sequential read of its B-tree.
+    Values added since the last `flush()` are buffered until then, and any
+    read flushes them first.
+    """
+
+    def __init__(self, store, table, codec=_MARSHAL):
+        self._store = store
+        self._table = table
+        self._codec = codec
+        self._pending = dict()
+
+        store._query(
+            'CREATE TABLE IF NOT EXISTS %s ('
+            'key BLOB PRIMARY KEY, value BLOB)' % table)
+
+    def __len__(self):
+        self.flush()
+        return self._store._query(
+            'SELECT COUNT(*) FROM %s' % self._table)[0][0]
+
+    def put(self, key, value):
+        self._pending[key] = value
+
+    def get(self, key, default=None):
+        self.flush()
+        rows = self._store._query(
+            'SELECT value FROM %s WHERE key = ?' % self._table,
+            (sqlite3.Binary(key),))
+        if not rows:
+            return default
+        return _decode(rows[0][0], self._codec)
+
+    def scan(self, begin, end):
+        self.flush()
+        rows = self._store._query(
+            'SELECT key, value FROM %s WHERE key >= ? AND key < ? '
+            'ORDER BY key' % self._table,
+            (sqlite3.Binary(begin), sqlite3.Binary(end)))
+        for key, value in rows:
+            yield bytes(key), _decode(value, self._codec)
+
+    def flush(self):
+        if not self._pending:
+            return
+
+        self._store._write(
+            'INSERT OR REPLACE INTO %s VALUES (?, ?)' % self._table,
+            [(sqlite3.Binary(k), _encode(v, self._codec))
+             for k, v in self._pending.items()])
+        self._pending = dict()
@@ -1,42 +1,80 @@
+from operator import itemgetter
+
+from neat.batch import RecordBatch, BatchCollector, Coalescer, \
+    push_batch_to, flush_to, call_columns
+
+
 class Collector(object):
     """
     Collects the output of a Stream and saves it in a `list` until `fetch()` is
     called, which returns the list and resets it. This is useful for testing,
     or to "tap" into Streams to see what they're doing.
+
+    If it's given the `attr_names` of the rows it collects, then `fetch()`
+    returns each row as a dict, otherwise rows are returned as tuples.
     """
 
-    def __init__(self):
+    def __init__(self, attr_names=None):
+        self._attr_names = attr_names
         self._items = list()
 
+    def push_rows(self, rows):
+        self._items.extend(rows)
+
     def push(self, items):
         self._items.extend(items)
 
     def fetch(self):
         items = self._items
         self._items = list()
+        if self._attr_names is not None:
+            names = self._attr_names
+            items = [dict(zip(names, row)) for row in items]
         return items
 
 
+class DictAdapter(object):
+    """
+    Adapts a listener with a dict-based `push(items)` method to receive rows
+    from a Stream, converting each row to a dict using `attr_names`.
+    """
+
+    def __init__(self, attr_names, listener):
+        self._attr_names = attr_names
+        self._listener = listener
+
+    def push_rows(self, rows):
+        names = self._attr_names
+        self._listener.push([dict(zip(names, row)) for row in rows])
+
+
 class HalfJoinStream(object):
     """
-    Half of a JoiningStream, which has the `push()` method needed for an
-    upstream Stream to insert data into it, which is combined with information
-    about whether it's the left or right half of a join, then pushed down to
-    the JoiningStream.
+    Half of a JoiningStream, which has the `push_rows()` method needed for
+    an upstream Stream to insert data into it, which is combined with
+    information about whether it's the left or right half of a join, then
+    pushed down to the JoiningStream.
     """
 
     def __init__(self, pos, parent):
         self._pos = pos
         self._parent = parent
 
-    def push(self, items):
-        return self._parent.push(self._pos, items)
+    def push_rows(self, rows):
+        return self._parent.push_rows(self._pos, rows)
+
+    def flush(self):
+        self._parent.flush()
 
 
 class JoiningStream(object):
     """
     A Stream interface object which implements a natural join between two
     Streams.
+
+    Output rows are laid out as the left-only attributes, then the join
+    attributes, then the right-only attributes. The positions of each in the
+    input rows are worked out once, when the join is built.
     """
 
     def __init__(self, left, right):
@@ -57,57 +95,53 @@ class JoiningStream(object):
             "between %r and %r" \
             % (left.attr_names, right.attr_names)
 
+        self._left_join = _row_getter(left._indices_for(self._join_attrs))
+        self._left_data = _row_getter(left._indices_for(self._left_attrs))
+        self._right_join = _row_getter(right._indices_for(self._join_attrs))
+        self._right_data = _row_getter(right._indices_for(self._right_attrs))
+
         self._listeners = list()
 
     def attrs(self):
         return self._left_attrs + self._join_attrs + self._right_attrs
 
-    def push(self, pos, items):
-        output_items = list()
-
-        for item in items:
-            idx = tuple([item[k] for k in self._join_attrs])
-            l, r = self._join.get(idx, (set(), set()))
+    def push_rows(self, pos, rows):
+        if not rows:
+            return
+        output_rows = list()
 
+        for row in rows:
             if pos == 0:
                 # left
-                left_data = tuple([item[k] for k in self._left_attrs])
-                l, r, out = self._push(l, self._left_attrs, left_data, idx,
-                                       r, self._right_attrs)
+                idx = self._left_join(row)
+                l, r = self._join.get(idx, (set(), set()))
+                left_data = self._left_data(row)
+                if left_data not in l:
+                    base = left_data + idx
+                    for o in r:
+                        output_rows.append(base + o)
+                    l.add(left_data)
 
             else:
                 # right
-                right_data = tuple([item[k] for k in self._right_attrs])
-                r, l, out = self._push(r, self._right_attrs, right_data, idx,
-                                       l, self._left_attrs)
+                idx = self._right_join(row)
+                l, r = self._join.get(idx, (set(), set()))
+                right_data = self._right_data(row)
+                if right_data not in r:
+                    tail = idx + right_data
+                    for o in l:
+                        output_rows.append(o + tail)
+                    r.add(right_data)
 
-            output_items.extend(out)
             self._join[idx] = (l, r)
 
-        for listener in self._listeners:
-            listener.push(output_items)
-
-    def _push(self, existing_set, existing_attrs, new_vals, join_vals,
-              other_set, other_attrs):
-        out = list()
-
-        if new_vals not in existing_set:
-            base_val = dict()
-
-            for k, v in zip(existing_attrs, new_vals):
-                base_val[k] = v
-            for k, v in zip(self._join_attrs, join_vals):
-                base_val[k] = v
-
-            for o in other_set:
-                val = base_val.copy()
-                for k, v in zip(other_attrs, o):
-                    val[k] = v
-                out.append(val)
+        if output_rows:
+            for listener in self._listeners:
+                listener.push_rows(output_rows)
 
-            existing_set.add(new_vals)
-
-        return existing_set, other_set, out
+    def flush(self):
+        for listener in self._listeners:
+            flush_to(listener)
 
 
 class Stream(object):
@@ -115,26 +149,96 @@ class Stream(object):
     Streaming relational operations. Each instance of Stream may transform the
     tuples and `push()` them down to listeners. In this way, a network of
     Streams can perform operations with limited local state.
+
+    Inside the network, rows are tuples with one value for each of the
+    Stream's `attr_names`, in order, and each operator works out which
+    positions it needs when it's built. The dict-based `push()` and
+    `collect()` convert to and from rows at the edges of the network.
+
+    Data can also be pushed a column at a time, as `RecordBatch`es, with
+    `push_batch()`. Operators which have a `batch_func` work on whole
+    columns, and the others fall back to converting the batch to rows.
     """
 
-    def __init__(self, attr_names, push_func=None):
+    def __init__(self, attr_names, push_func=None, batch_func=None):
         self.attr_names = attr_names
         self._push_func = push_func
+        self._batch_func = batch_func
         self._listeners = list()
+        self._row_from_dict = _row_getter(attr_names)
+        # description of a stateless operator, which lets neat.fusion fuse
+        # it with its neighbours. None for anything with state.
+        self._op = None
 
     def push(self, items):
+        row_from_dict = self._row_from_dict
+        self.push_rows([row_from_dict(item) for item in items])
+
+    def push_rows(self, rows):
+        # empty batches, including those emptied by an operator, don't go
+        # any further down the network.
+        if not rows:
+            return
         if self._push_func is not None:
-            items = self._push_func(self, items)
+            rows = self._push_func(self, rows)
+            if not rows:
+                return
+
+        for listener in self._listeners:
+            listener.push_rows(rows)
+
+    def push_batch(self, batch):
+        if not len(batch):
+            return
+        if self._batch_func is not None:
+            batch = self._batch_func(self, batch)
+        elif self._push_func is not None:
+            batch = RecordBatch.from_rows(
+                self.attr_names, self._push_func(self, batch.rows()))
+        else:
+            batch = batch.renamed(self.attr_names)
+        if not len(batch):
+            return
+
+        for listener in self._listeners:
+            push_batch_to(listener, batch)
+
+    def flush(self):
+        """
+        Releases anything buffered by `coalesce()` stages downstream of this
+        Stream, for example at the end of each diff.
+        """
 
-        #import sys; print>>sys.stderr,"PUSH: %r" % items
         for listener in self._listeners:
-            listener.push(items)
+            flush_to(listener)
 
     def collect(self):
+        collector = Collector(self.attr_names)
+        self._listeners.append(collector)
+        return collector
+
+    def collect_rows(self):
         collector = Collector()
         self._listeners.append(collector)
         return collector
 
+    def collect_batches(self):
+        collector = BatchCollector(self.attr_names)
+        self._listeners.append(collector)
+        return collector
+
+    def add_listener(self, listener):
+        """
+        Adds a listener which has a `push_rows(rows)` method.
+        """
+        self._listeners.append(listener)
+
+    def add_dict_listener(self, listener):
+        """
+        Adds a listener which has a dict-based `push(items)` method.
+        """
+        self._listeners.append(DictAdapter(self.attr_names, listener))
+
     def union(self, other):
         self._assert_compatible(other, "union")
         # TODO
@@ -150,76 +254,159 @@ class Stream(object):
         # TODO
         raise StandardError("Stream.difference not implemented")
 
-    def projection(self, new_attr_names):
+    def projection(self, new_attr_names, dedup=True):
+        """
+        Projects rows onto `new_attr_names`, emitting each distinct row once.
+        If the rows are already known to be distinct after projection, for
+        example because they're only being reordered, then `dedup` can be
+        turned off to avoid keeping any state.
+        """
+
+        if not dedup:
+            return self._select(new_attr_names)
+
         emitted = set()
+        indices = self._indices_for(new_attr_names)
+        getter = _row_getter(indices)
+
+        def push_func(stream, rows):
+            new_rows = list()
+            for row in rows:
+                new_row = getter(row)
+                if new_row not in emitted:
+                    emitted.add(new_row)
+                    new_rows.append(new_row)
+            return new_rows
+
+        def batch_func(stream, batch):
+            batch = batch.select(indices, new_attr_names)
+            keep = list()
+            for i, row in enumerate(batch.rows()):
+                if row not in emitted:
+                    emitted.add(row)
+                    keep.append(i)
+            if len(keep) == len(batch):
+                return batch
+            return batch.take(keep)
+
+        s = Stream(new_attr_names, push_func, batch_func)
+        self._listeners.append(s)
+        return s
 
-        def push_func(stream, items):
-            new_items = list()
-            for item in items:
-                new_item = dict([[k, item[k]] for k in new_attr_names])
-                new_item_hashable = tuple(sorted(new_item.items()))
-                if new_item_hashable not in emitted:
-                    emitted.add(new_item_hashable)
-                    new_items.append(new_item)
-            return new_items
-
-        s = Stream(new_attr_names, push_func)
+    def _select(self, new_attr_names):
+        indices = self._indices_for(new_attr_names)
+        getter = _row_getter(indices)
+
+        def push_func(stream, rows):
+            return [getter(row) for row in rows]
+
+        def batch_func(stream, batch):
+            return batch.select(indices, new_attr_names)
+
+        s = Stream(new_attr_names, push_func, batch_func)
+        s._op = ('project', indices)
         self._listeners.append(s)
         return s
 
+    def coalesce(self, max_rows=1000, max_seconds=None):
+        """
+        Buffers rows until there are at least `max_rows` of them, or the
+        oldest has waited `max_seconds`, and then pushes them on as one
+        batch. Anything left over is pushed on by `flush()`. See
+        `neat.batch.Coalescer`.
+        """
+
+        c = Coalescer(self.attr_names, max_rows, max_seconds)
+        self._listeners.append(c)
+        s = Stream(self.attr_names)
+        c._listeners.append(s)
+        return s
+
     def selection(self, pred):
         # TODO
         raise StandardError("Stream.selection not implemented")
 
     def rename(self, new_attr_names):
-        names = zip(new_attr_names, self.attr_names)
-
-        def push_func(stream, items):
-            new_items = list()
-            for item in items:
-                new_item = dict([(new, item[old]) for (new, old) in names])
-                new_items.append(new_item)
-            return new_items
+        assert len(new_attr_names) == len(self.attr_names), \
+            "New attribute names wrong length: len(%r) != len(%r)" \
+            % (new_attr_names, self.attr_names)
 
-        s = Stream(new_attr_names, push_func)
+        # renaming is positional, so the rows don't change at all.
+        s = Stream(new_attr_names)
+        s._op = ('rename',)
         self._listeners.append(s)
         return s
 
-    def unnest(self, attr, unnested_attr):
-        seen = set()
-
-        def push_func(stream, items):
-            new_items = list()
-            for item in items:
-                for val in item[attr]:
-                    new_item = item.copy()
-                    new_item.pop(attr)
-                    new_item[unnested_attr] = val
-                    hashable = tuple(sorted(new_item.items()))
-                    if hashable not in seen:
-                        seen.add(hashable)
-                        new_items.append(new_item)
-            return new_items
+    def unnest(self, attr, unnested_attr, dedup=True):
+        """
+        Replaces the collection in `attr` with a row for each of its values,
+        in `unnested_attr`, emitting each distinct row once. If the rows are
+        already known to be distinct, for example because the input rows are
+        and the values in each collection are, then `dedup` can be turned off
+        to avoid keeping any state.
+        """
 
+        seen = set() if dedup else None
         replace_idx = self.attr_names.index(attr)
+
+        def push_func(stream, rows):
+            new_rows = list()
+            for row in rows:
+                head = row[:replace_idx]
+                tail = row[replace_idx + 1:]
+                for val in row[replace_idx]:
+                    new_row = head + (val,) + tail
+                    if seen is None:
+                        new_rows.append(new_row)
+                    elif new_row not in seen:
+                        seen.add(new_row)
+                        new_rows.append(new_row)
+            return new_rows
+
         attrs = list(self.attr_names)
         attrs[replace_idx] = unnested_attr
         s = Stream(attrs, push_func)
         self._listeners.append(s)
         return s
 
-    def join_func(self, arg_names, result_name, func):
-        def push_func(stream, items):
-            new_items = list()
-            for item in items:
-                assert isinstance(item, dict), "Item %r should be dict" % item
-                new_item = item.copy()
-                args = [item[arg] for arg in arg_names]
-                new_item[result_name] = func(*args)
-                new_items.append(new_item)
-            return new_items
-
-        s = Stream(self.attr_names + [result_name], push_func)
+    def join_func(self, arg_names, result_name, func, vectorized=False):
+        """
+        Adds the attribute `result_name` to each row, computed by calling
+        `func` with the values of `arg_names`. If `vectorized` is set, `func`
+        is instead called once per batch with a whole column for each
+        argument, and must return a column of results.
+        """
+
+        indices = self._indices_for(arg_names)
+        args_getter = _row_getter(indices)
+        new_attr_names = self.attr_names + [result_name]
+
+        def batch_func(stream, batch):
+            columns = [batch.columns[i] for i in indices]
+            if vectorized:
+                values = call_columns(func, columns, len(batch))
+            else:
+                values = [func(*args) for args in zip(*columns)]
+            return batch.with_column(result_name, values).renamed(
+                new_attr_names)
+
+        if vectorized:
+            def push_func(stream, rows):
+                if not rows:
+                    return []
+                batch = RecordBatch.from_rows(self.attr_names, rows)
+                return batch_func(stream, batch).rows()
+
+        else:
+            def push_func(stream, rows):
+                new_rows = list()
+                for row in rows:
+                    new_rows.append(row + (func(*args_getter(row)),))
+                return new_rows
+
+        s = Stream(new_attr_names, push_func, batch_func)
+        if not vectorized:
+            s._op = ('join_func', indices, func)
         self._listeners.append(s)
         return s
 
@@ -243,3 +430,17 @@ class Stream(object):
         assert self.attr_names == other.attr_names, \
             "Stream attributes incompatible in %s: %r != %r" \
             % (op_name, self.attr_names, other.attr_names)
+
+
+def _row_getter(keys):
+    """
+    Returns a function which picks out the values at `keys` from a row (or
+    dict) as a tuple, even when there's only one or none of them.
+    """
+
+    if len(keys) == 0:
+        return lambda row: ()
+    elif len(keys) == 1:
+        k = keys[0]
+        return lambda row: (row[k],)
+    return itemgetter(*keys)
@@ -1,27 +1,111 @@
 from neat.relation import Relation
+from neat import tiling
+from neat.changefeed import ChangefeedWriter
+from neat.trie import TrieWriter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 def tile(lon, lat):
     return "%d/%d" % (int(lon), int(lat))
 
 
-def node_tiles_to_id(nodes):
-    nodes_with_tile = nodes.join_func(['lon', 'lat'], 'tile', tile)
+def tile_array(lons, lats):
+    """
+    Vectorized version of `tile` over whole columns of `lons` and `lats`, for
+    use with `ColumnarRelation.join_func(..., vectorized=True)`. Without
+    numpy, returns a list.
+    """
+
+    if np is None:
+        return [tile(lon, lat) for lon, lat in zip(lons, lats)]
+
+    xs = np.trunc(np.asarray(lons, dtype=np.float64)).astype(np.int64)
+    ys = np.trunc(np.asarray(lats, dtype=np.float64)).astype(np.int64)
+    return np.char.add(np.char.add(xs.astype(str), '/'), ys.astype(str))
+
+
+# each of the networks below takes the function used to work out the tile of
+# a node, which defaults to `tile`. a function from `neat.tiling.tile_func`
+# gives integer tile codes instead.
+
+def node_tiles_to_id(nodes, tile_func=tile):
+    nodes_with_tile = nodes.join_func(['lon', 'lat'], 'tile', tile_func)
     tile_to_id = nodes_with_tile.projection(['tile', 'id'])
     return tile_to_id
 
 
-def node_tiles(nodes):
-    tile_to_id = node_tiles_to_id(nodes)
+def node_tiles(nodes, tile_func=tile):
+    tile_to_id = node_tiles_to_id(nodes, tile_func)
     tiles = tile_to_id.natural_join(nodes)
     return tiles
 
-def way_tiles_to_id(nodes, ways):
-    node_tiles = node_tiles_to_id(nodes).rename(['tile', 'node_id'])
+def way_tiles_to_id(nodes, ways, tile_func=tile):
+    node_tiles = node_tiles_to_id(nodes, tile_func).\
+        rename(['tile', 'node_id'])
     way_nodes = ways.unnest('nodes', 'node_id').projection(['id', 'node_id'])
     tile_to_id = node_tiles.natural_join(way_nodes).projection(['tile', 'id'])
     return tile_to_id
 
-def way_tiles(nodes, ways):
-    tile_to_id = way_tiles_to_id(nodes, ways)
+def way_tiles(nodes, ways, tile_func=tile):
+    tile_to_id = way_tiles_to_id(nodes, ways, tile_func)
     tiles = tile_to_id.natural_join(ways)
     return tiles
+
+
+# multi-zoom versions of the networks above, which emit each element in its
+# tiles at each of a set of `zooms`, as integer tile codes. the joins are all
+# done once, at the finest zoom, and the coarser tiles are derived from the
+# finest one just before the final join with the elements, so the join state
+# isn't duplicated for each zoom.
+
+def _tiles_at_zooms(tile_to_id, zooms):
+    """
+    Expands each (tile, id) row at the finest zoom into a row for the tiles
+    containing it at each of `zooms`.
+    """
+
+    zooms = tuple(sorted(set(zooms)))
+    with_tiles = tile_to_id.join_func(
+        ['tile'], 'tiles', lambda t: tiling.at_zooms(t, zooms))
+    # the input rows are distinct and so are the tiles at each zoom, so
+    # unnesting can't make any duplicates.
+    zoom_tiles = with_tiles.unnest('tiles', 'zoom_tile', dedup=False)
+    # the final join with the elements removes any duplicates, so there's no
+    # need for another copy of its state here.
+    return zoom_tiles.projection(['zoom_tile', 'id'], dedup=False).\
+        rename(['tile', 'id'])
+
+
+def multi_zoom_node_tiles(nodes, zooms):
+    tile_func = tiling.tile_func(max(zooms))
+    tile_to_id = _tiles_at_zooms(node_tiles_to_id(nodes, tile_func), zooms)
+    return tile_to_id.natural_join(nodes)
+
+
+def multi_zoom_way_tiles(nodes, ways, zooms):
+    tile_func = tiling.tile_func(max(zooms))
+    tile_to_id = _tiles_at_zooms(
+        way_tiles_to_id(nodes, ways, tile_func), zooms)
+    return tile_to_id.natural_join(ways)
+
+
+def write_to_trie(tiles, trie):
+    """
+    Writes the output of a network of integer-tiled Streams, such as those
+    from `multi_zoom_node_tiles`, into the `BufferedRepositoryTrie` `trie`.
+    """
+
+    tiles.add_listener(TrieWriter(trie, tiles.attr_names))
+
+
+def write_to_changefeed(tiles, feed):
+    """
+    Appends each batch of output of a network of Streams, such as those from
+    `multi_zoom_node_tiles`, to the `Changefeed` `feed` as a segment.
+    """
+
+    tiles.add_listener(ChangefeedWriter(feed, tiles.attr_names))
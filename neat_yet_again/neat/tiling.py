@@ -0,0 +1,218 @@
+# hierarchical tiles as integers.
+#
+# tiles are the usual spherical mercator "slippy map" tiles. each one is
+# encoded as a single integer: a sentinel 1 bit followed by two bits per
+# zoom level, interleaving the bits of the tile's x and y coordinates from
+# the most significant down (a Morton, or quadkey, code). the sentinel bit
+# means that tiles at different zooms never have the same code, and that
+# the zoom can be read back from the position of the highest bit.
+#
+# because of the interleaving, a tile's parent is its code shifted right by
+# two bits and its children are the code shifted left by two bits plus 0-3,
+# and sorting codes of the same zoom keeps nearby tiles close together. as
+# integers, codes are also much smaller and faster to hash and compare than
+# the strings made by `neat.tiles.tile`, so they should be used as join and
+# dedup keys, with `tile_name` only used to render them for output.
+
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAX_ZOOM = 31
+
+# the latitude at which spherical mercator becomes square.
+MAX_LATITUDE = 85.0511287798
+
+# masks for spreading the bits of a 32-bit integer out to the even bits of
+# a 64-bit integer.
+_SPREAD = [
+    (16, 0x0000ffff0000ffff),
+    (8, 0x00ff00ff00ff00ff),
+    (4, 0x0f0f0f0f0f0f0f0f),
+    (2, 0x3333333333333333),
+    (1, 0x5555555555555555),
+]
+
+# and the reverse, gathering the even bits back together.
+_COMPACT = [
+    (0, 0x5555555555555555),
+    (1, 0x3333333333333333),
+    (2, 0x0f0f0f0f0f0f0f0f),
+    (4, 0x00ff00ff00ff00ff),
+    (8, 0x0000ffff0000ffff),
+    (16, 0x00000000ffffffff),
+]
+
+
+def _check_zoom(zoom):
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError("Zoom must be between 0 and %d, not %r"
+                         % (MAX_ZOOM, zoom))
+
+
+def _spread(v):
+    for shift, mask in _SPREAD:
+        v = (v | (v << shift)) & mask
+    return v
+
+
+def _compact(v):
+    for shift, mask in _COMPACT:
+        v = (v | (v >> shift)) & mask
+    return v
+
+
+def tile_xy(lon, lat, zoom):
+    """
+    Returns the `(x, y)` coordinates of the tile at `zoom` containing the
+    point at `lon`, `lat` in degrees. Points beyond the edges of the map are
+    put in the tiles at the edges.
+    """
+
+    _check_zoom(zoom)
+    n = 1 << zoom
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    lat_rad = math.radians(lat)
+    x = int(math.floor((lon + 180.0) / 360.0 * n))
+    y = int(math.floor(
+        (1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) /
+         math.pi) / 2.0 * n))
+    return max(0, min(n - 1, x)), max(0, min(n - 1, y))
+
+
+def tile_code(x, y, zoom):
+    """
+    Encodes the tile `x`, `y` at `zoom` as an integer code.
+    """
+
+    _check_zoom(zoom)
+    return (1 << (2 * zoom)) | _spread(x) | (_spread(y) << 1)
+
+
+def tile_coords(code):
+    """
+    Decodes a tile code into a tuple of `(zoom, x, y)`.
+    """
+
+    zoom = zoom_of(code)
+    bits = code ^ (1 << (2 * zoom))
+    return zoom, _compact(bits), _compact(bits >> 1)
+
+
+def zoom_of(code):
+    return (code.bit_length() - 1) // 2
+
+
+def tile_for(lon, lat, zoom):
+    """
+    Returns the code of the tile at `zoom` containing `lon`, `lat`.
+    """
+
+    x, y = tile_xy(lon, lat, zoom)
+    return tile_code(x, y, zoom)
+
+
+def parent(code, levels=1):
+    """
+    Returns the code of the tile `levels` zooms above `code`.
+    """
+
+    if levels > zoom_of(code):
+        raise ValueError("Tile at zoom %d has no parent %d levels up"
+                         % (zoom_of(code), levels))
+    return code >> (2 * levels)
+
+
+def children(code):
+    base = code << 2
+    return [base, base | 1, base | 2, base | 3]
+
+
+def ancestors(code, min_zoom=0):
+    """
+    Returns the codes of `code` and all the tiles containing it, down to
+    `min_zoom`, with the most zoomed-in first.
+    """
+
+    result = list()
+    for _ in range(zoom_of(code) - min_zoom + 1):
+        result.append(code)
+        code >>= 2
+    return result
+
+
+def at_zooms(code, zooms):
+    """
+    Returns a tuple of the codes of the tiles at each of `zooms` which
+    contain `code`. The zooms must not be greater than the zoom of `code`.
+    """
+
+    zoom = zoom_of(code)
+    for z in zooms:
+        if not 0 <= z <= zoom:
+            raise ValueError("Can't find the tile at zoom %r containing a "
+                             "tile at zoom %d" % (z, zoom))
+    return tuple(code >> (2 * (zoom - z)) for z in zooms)
+
+
+def tile_name(code):
+    """
+    Renders a tile code as a "zoom/x/y" string, for output.
+    """
+
+    return "%d/%d/%d" % tile_coords(code)
+
+
+def tile_codes(lons, lats, zoom):
+    """
+    Vectorized version of `tile_for` over whole columns of `lons` and `lats`.
+    Returns a NumPy array of codes if NumPy is available, otherwise a list.
+    """
+
+    _check_zoom(zoom)
+    if np is None:
+        return [tile_for(lon, lat, zoom) for lon, lat in zip(lons, lats)]
+
+    n = 1 << zoom
+    lons = np.asarray(lons, dtype=np.float64)
+    lats = np.clip(np.asarray(lats, dtype=np.float64),
+                   -MAX_LATITUDE, MAX_LATITUDE)
+    lat_rad = np.radians(lats)
+
+    xs = np.floor((lons + 180.0) / 360.0 * n)
+    ys = np.floor((1.0 - np.log(np.tan(lat_rad) + 1.0 / np.cos(lat_rad)) /
+                   np.pi) / 2.0 * n)
+    xs = np.clip(xs, 0, n - 1).astype(np.uint64)
+    ys = np.clip(ys, 0, n - 1).astype(np.uint64)
+
+    codes = _spread_array(xs) | (_spread_array(ys) << np.uint64(1))
+    return (codes | np.uint64(1 << (2 * zoom))).astype(np.int64)
+
+
+def _spread_array(v):
+    for shift, mask in _SPREAD:
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def tile_func(zoom):
+    """
+    Returns a function of `lon`, `lat` giving the code of the tile at
+    `zoom`, for use with `join_func`.
+    """
+
+    _check_zoom(zoom)
+    return lambda lon, lat: tile_for(lon, lat, zoom)
+
+
+def tile_codes_func(zoom):
+    """
+    Returns a vectorized version of `tile_func`, for use with
+    `join_func(..., vectorized=True)`.
+    """
+
+    _check_zoom(zoom)
+    return lambda lons, lats: tile_codes(lons, lats, zoom)
@@ -0,0 +1,397 @@
+# a buffered repository trie, for storing the (element, tile) output of NEAT.
+#
+# the trie is a fixed quadtree of tiles, down to zoom `depth`, stored in a
+# directory on the local filesystem. each node of the quadtree has a buffer
+# of up to `buffer_size` entries, kept as a number of batch files. a batch of
+# inserts which fits in the root's buffer is written there as one new file.
+# when it doesn't fit, the buffer overflows: its entries and the new ones are
+# pushed down to the children containing their tiles, in the same way, and
+# the node starts a new, empty buffer in a new directory. nothing is ever
+# deleted or overwritten, other than the small "HEAD" file in each node
+# which points to its current directory, and that is always written after
+# the children, so readers never see entries go missing.
+#
+# an entry whose tile is at the zoom of a node is kept by that node, since
+# it can't go any deeper, so the trie can hold tiles at any zoom up to its
+# depth. leaves keep everything they're given.
+#
+# to find the elements in a tile, the nodes from the root down to the tile
+# are read and their buffers filtered for the tile, so a query reads at most
+# `depth + 1` nodes.
+#
+# each batch file is a sorted run: its entries are sorted by tile and then
+# element, and split into chunks with a header giving the range of tiles in
+# each. assembling a tile only reads the chunks which might contain it, and
+# merges the runs with a heap, so the elements come out in order without
+# ever holding more than one chunk of each run in memory. a run's file is
+# only open while a chunk is read from it, so a query doesn't need a file
+# descriptor for each run.
+#
+# leaves never overflow, so a leaf which keeps being inserted into would
+# gain more and more runs. once a node has more than `MAX_RUNS` of them, they
+# are merged into a single run in a new generation, in the same way as an
+# overflow, which bounds the number of runs a query has to merge.
+#
+# tiles are integer codes from neat.tiling. elements and tiles are stored
+# with marshal, so elements must be plain built-in types, such as numbers,
+# strings, None and tuples of those.
+
+import heapq
+import marshal
+import os
+import shutil
+import struct
+from io import BytesIO
+
+from neat import tiling
+
+# number of entries in each chunk of a run.
+RUN_CHUNK = 256
+
+# number of runs a node can have before they're merged into one.
+MAX_RUNS = 32
+
+_HEADER_SIZE = struct.Struct('<I')
+
+
+class BufferedRepositoryTrie(object):
+    """
+    A buffered repository trie in the directory `path`, which is created if
+    it doesn't exist, with buffers of `buffer_size` entries and leaves at
+    zoom `depth`.
+    """
+
+    def __init__(self, path, buffer_size=1000, depth=16):
+        if buffer_size <= 0:
+            raise ValueError("Buffer size must be positive, not %r"
+                             % (buffer_size,))
+        if not 0 <= depth <= tiling.MAX_ZOOM:
+            raise ValueError("Depth must be between 0 and %d, not %r"
+                             % (tiling.MAX_ZOOM, depth))
+
+        self.path = path
+        self.buffer_size = buffer_size
+        self.depth = depth
+        # number of node buffers read and batch files written, for seeing
+        # how much work inserts and queries do.
+        self.reads = 0
+        self.writes = 0
+        # node code -> (generation, number of entries in its buffer, number
+        # of runs they're in).
+        self._heads = dict()
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+    def insert(self, pairs):
+        """
+        Inserts a batch of `(element, tile)` pairs. Raises `ValueError` if any
+        tile is deeper than the trie.
+        """
+
+        pairs = list(pairs)
+        for element, tile in pairs:
+            if tiling.zoom_of(tile) > self.depth:
+                raise ValueError("Tile %s is deeper than the trie's depth %d"
+                                 % (tiling.tile_name(tile), self.depth))
+        if pairs:
+            self._insert(tiling.tile_code(0, 0, 0), pairs)
+
+    def query(self, tile):
+        """
+        Returns the set of elements in `tile`.
+        """
+
+        return set(self.assemble(tile))
+
+    def assemble(self, tile):
+        """
+        Yields each of the elements in `tile` once, in sorted order, by
+        merging the sorted runs in the nodes from the root down to it.
+        """
+
+        zoom = tiling.zoom_of(tile)
+        if zoom > self.depth:
+            raise ValueError("Tile %s is deeper than the trie's depth %d"
+                             % (tiling.tile_name(tile), self.depth))
+
+        runs = list()
+        for node in reversed(tiling.ancestors(tile)):
+            for path in self._run_paths(node, self._head(node)[0]):
+                runs.append(_run_elements(path, tile))
+
+        last = None
+        first = True
+        for element in heapq.merge(*runs):
+            if first or element != last:
+                yield element
+            first = False
+            last = element
+
+    def _insert(self, node, pairs):
+        generation, count, runs = self._head(node)
+        zoom = tiling.zoom_of(node)
+
+        if zoom == self.depth or count + len(pairs) <= self.buffer_size:
+            self._write_batch(node, generation, count, pairs)
+            if runs + 1 > MAX_RUNS:
+                self._compact(node, generation)
+            else:
+                self._heads[node] = (generation, count + len(pairs),
+                                     runs + 1)
+            return
+
+        # overflow: entries for this node's own tile stay, and the rest go
+        # down to the child containing their tile.
+        staying = list()
+        children = dict()
+        for element, tile in self._read(node) + pairs:
+            tile_zoom = tiling.zoom_of(tile)
+            if tile_zoom == zoom:
+                staying.append((element, tile))
+            else:
+                child = tile >> (2 * (tile_zoom - zoom - 1))
+                children.setdefault(child, list()).append((element, tile))
+
+        for child, child_pairs in sorted(children.items()):
+            self._insert(child, child_pairs)
+
+        generation += 1
+        if staying:
+            self._write_batch(node, generation, 0, staying)
+        self._write_head(node, generation)
+        self._heads[node] = (generation, len(staying), 1 if staying else 0)
+
+    def _compact(self, node, generation):
+        """
+        Merges the runs of `node` into a single run in a new generation.
+        """
+
+        paths = self._run_paths(node, generation)
+        generation += 1
+        gen_dir = os.path.join(self._node_dir(node), '%d' % generation)
+        if not os.path.isdir(gen_dir):
+            os.makedirs(gen_dir)
+        name = os.path.join(gen_dir, '0.batch')
+        with open(name + '.tmp', 'wb') as f:
+            count = _merge_runs(paths, f, name + '.chunks')
+        os.rename(name + '.tmp', name)
+        self.writes += 1
+
+        self._write_head(node, generation)
+        self._heads[node] = (generation, count, 1)
+
+    def _node_dir(self, node):
+        return os.path.join(self.path, '%x' % node)
+
+    def _head(self, node):
+        """
+        Returns the current generation of `node`, the number of entries in
+        its buffer and the number of runs they're in.
+        """
+
+        head = self._heads.get(node)
+        if head is None:
+            generation = 0
+            head_path = os.path.join(self._node_dir(node), 'HEAD')
+            if os.path.exists(head_path):
+                with open(head_path) as f:
+                    generation = int(f.read())
+            count = 0
+            paths = self._run_paths(node, generation)
+            for path in paths:
+                with open(path, 'rb') as f:
+                    count += sum(c[3] for c in _read_header(f)[0])
+            head = (generation, count, len(paths))
+            self._heads[node] = head
+        return head
+
+    def _write_head(self, node, generation):
+        node_dir = self._node_dir(node)
+        if not os.path.isdir(node_dir):
+            os.makedirs(node_dir)
+        tmp = os.path.join(node_dir, 'HEAD.tmp')
+        with open(tmp, 'w') as f:
+            f.write('%d' % generation)
+        os.rename(tmp, os.path.join(node_dir, 'HEAD'))
+
+    def _write_batch(self, node, generation, count, pairs):
+        gen_dir = os.path.join(self._node_dir(node), '%d' % generation)
+        if not os.path.isdir(gen_dir):
+            os.makedirs(gen_dir)
+        # batch files are named by the number of entries before them, which
+        # is unique within a generation.
+        name = os.path.join(gen_dir, '%d.batch' % count)
+        with open(name + '.tmp', 'wb') as f:
+            _write_run(f, pairs)
+        os.rename(name + '.tmp', name)
+        self.writes += 1
+
+    def _read(self, node):
+        return self._read_generation(node, self._head(node)[0])
+
+    def _read_generation(self, node, generation):
+        pairs = list()
+        for path in self._run_paths(node, generation):
+            with open(path, 'rb') as f:
+                header, base = _read_header(f)
+                for chunk in header:
+                    pairs.extend(_read_chunk(f, base, chunk))
+        return pairs
+
+    def _run_paths(self, node, generation):
+        gen_dir = os.path.join(self._node_dir(node), '%d' % generation)
+        if not os.path.isdir(gen_dir):
+            return []
+
+        self.reads += 1
+        names = [n for n in os.listdir(gen_dir) if n.endswith('.batch')]
+        names.sort(key=lambda n: int(n.split('.')[0]))
+        return [os.path.join(gen_dir, n) for n in names]
+
+
+# sorted run files. each is a header, giving the first and last tile, size in
+# bytes and number of entries of each chunk, followed by the chunks
+# themselves, each a marshalled list of (element, tile) pairs.
+
+def _write_run(f, pairs):
+    pairs = sorted(pairs, key=lambda p: (p[1], p[0]))
+    chunks = BytesIO()
+    header = [_write_chunk(chunks, pairs[i:i + RUN_CHUNK])
+              for i in range(0, len(pairs), RUN_CHUNK)]
+
+    header = marshal.dumps(header, 2)
+    f.write(_HEADER_SIZE.pack(len(header)))
+    f.write(header)
+    f.write(chunks.getvalue())
+
+
+def _read_header(f):
+    """
+    Returns the header of a run, as a list of chunks, and the offset of the
+    first chunk. Each chunk also gets its offset added to it.
+    """
+
+    size = _HEADER_SIZE.unpack(f.read(_HEADER_SIZE.size))[0]
+    header = marshal.loads(f.read(size))
+    offset = 0
+    chunks = list()
+    for first, last, length, count in header:
+        chunks.append((first, last, length, count, offset))
+        offset += length
+    return chunks, _HEADER_SIZE.size + size
+
+
+def _read_chunk(f, base, chunk):
+    f.seek(base + chunk[4])
+    return marshal.loads(f.read(chunk[2]))
+
+
+def _run_chunks(path, chunks, base):
+    """
+    Yields the contents of each of `chunks` of the run at `path` in turn,
+    opening the file for each one rather than holding it open in between.
+    """
+
+    for chunk in chunks:
+        with open(path, 'rb') as f:
+            data = _read_chunk(f, base, chunk)
+        yield data
+
+
+def _run_elements(path, tile):
+    """
+    Yields the elements in `tile` from the run at `path`, in order, reading
+    only the chunks which might contain the tile.
+    """
+
+    with open(path, 'rb') as f:
+        header, base = _read_header(f)
+    chunks = [c for c in header if c[0] <= tile <= c[1]]
+    for data in _run_chunks(path, chunks, base):
+        for element, t in data:
+            if t == tile:
+                yield element
+
+
+def _run_entries(path):
+    """
+    Yields each `(tile, element)` in the run at `path`, in order.
+    """
+
+    with open(path, 'rb') as f:
+        header, base = _read_header(f)
+    for data in _run_chunks(path, header, base):
+        for element, tile in data:
+            yield tile, element
+
+
+def _merge_runs(paths, f, scratch):
+    """
+    Writes a run to `f` of the entries of the runs at `paths`, without any
+    duplicates, and returns the number of entries in it. The chunks are
+    written to the file `scratch` first, since the header goes before them,
+    so only one chunk of each run is in memory at once.
+    """
+
+    header = list()
+    count = 0
+    with open(scratch, 'wb') as chunks:
+        chunk = list()
+        last = None
+        for entry in heapq.merge(*[_run_entries(p) for p in paths]):
+            if entry == last:
+                continue
+            last = entry
+            chunk.append((entry[1], entry[0]))
+            if len(chunk) == RUN_CHUNK:
+                header.append(_write_chunk(chunks, chunk))
+                count += len(chunk)
+                chunk = list()
+        if chunk:
+            header.append(_write_chunk(chunks, chunk))
+            count += len(chunk)
+
+    header = marshal.dumps(header, 2)
+    f.write(_HEADER_SIZE.pack(len(header)))
+    f.write(header)
+    with open(scratch, 'rb') as chunks:
+        shutil.copyfileobj(chunks, f)
+    os.remove(scratch)
+    return count
+
+
+def _write_chunk(f, chunk):
+    """
+    Writes a sorted `chunk` of `(element, tile)` pairs to `f`, and returns
+    its header entry.
+    """
+
+    data = marshal.dumps(chunk, 2)
+    f.write(data)
+    return (chunk[0][1], chunk[-1][1], len(data), len(chunk))
+
+
+class TrieWriter(object):
+    """
+    A Stream listener which inserts each batch of rows it's pushed into
+    `trie`, as one batch of `(element, tile)` pairs. The tile is the value
+    of `tile_attr`, and the element is a tuple of the other values of the
+    row, in the order of `attr_names`.
+    """
+
+    def __init__(self, trie, attr_names, tile_attr='tile'):
+        self._sink = trie
+        tile_idx = attr_names.index(tile_attr)
+        self._tile_idx = tile_idx
+        self._element_idx = [i for i in range(len(attr_names))
+                             if i != tile_idx]
+
+    def push_rows(self, rows):
+        self._sink.insert(self._pairs(rows))
+
+    def _pairs(self, rows):
+        tile_idx = self._tile_idx
+        element_idx = self._element_idx
+        return [(tuple(row[i] for i in element_idx), row[tile_idx])
+                for row in rows]
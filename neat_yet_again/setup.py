@@ -11,6 +11,7 @@ config = {
     'author_email': 'matt.amos@mapzen.com',
     'version': '0.1',
     'tests_require': ['nose'],
+    'extras_require': {'columnar': ['numpy']},
     'packages': ['neat'],
     'scripts': [],
     'name': 'neat',
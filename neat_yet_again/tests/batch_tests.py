@@ -0,0 +1,265 @@
+from unittest import TestCase, skipIf
+from neat import external, streaming
+from neat.batch import RecordBatch, Coalescer
+from neat.fusion import compile_network
+from neat import tiles as tiles_module
+from neat.tiles import tile, tile_array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TestRecordBatch(TestCase):
+
+    def test_batch_from_rows(self):
+        b = RecordBatch.from_rows(['a', 'b'], [(1, 2), (3, 4)])
+        self.assertEqual([[1, 3], [2, 4]], b.columns)
+        self.assertEqual(2, len(b))
+        self.assertEqual([(1, 2), (3, 4)], b.rows())
+        self.assertEqual(0, len(RecordBatch.from_rows(['a'], [])))
+
+    def test_batch_select_take(self):
+        b = RecordBatch(['a', 'b', 'c'], [[1, 2, 3], [4, 5, 6], [7, 8, 9]])
+        s = b.select([2, 0], ['z', 'x'])
+        self.assertEqual([(7, 1), (8, 2), (9, 3)], s.rows())
+        self.assertEqual([(9, 3), (7, 1)], s.take([2, 0]).rows())
+        self.assertEqual([4, 5, 6], b.column('b'))
+
+    def test_batch_concat(self):
+        b = RecordBatch.concat(['a', 'b'], [
+            RecordBatch(['a', 'b'], [[1], [2]]),
+            RecordBatch(['x', 'y'], [[3, 5], [4, 6]])])
+        self.assertEqual(['a', 'b'], b.attr_names)
+        self.assertEqual([(1, 2), (3, 4), (5, 6)], b.rows())
+        self.assertEqual(0, len(RecordBatch.concat(['a'], [])))
+
+
+class Recorder(object):
+    def __init__(self):
+        self.pushes = list()
+
+    def push_rows(self, rows):
+        self.pushes.append(list(rows))
+
+
+class TestCoalescer(TestCase):
+
+    def test_coalescer_max_seconds(self):
+        now = [0.0]
+        c = Coalescer(['a'], max_rows=100, max_seconds=5,
+                      clock=lambda: now[0])
+        r = Recorder()
+        c._listeners.append(r)
+
+        c.push_rows([(1,)])
+        now[0] = 4.0
+        c.push_rows([(2,)])
+        self.assertEqual([], r.pushes)
+        now[0] = 5.0
+        c.push_rows([(3,)])
+        self.assertEqual([[(1,), (2,), (3,)]], r.pushes)
+
+        # the wait starts again from the next row buffered.
+        now[0] = 20.0
+        c.push_rows([(4,)])
+        c.push_rows([])
+        self.assertEqual(1, len(r.pushes))
+        c.flush()
+        c.flush()
+        self.assertEqual([[(1,), (2,), (3,)], [(4,)]], r.pushes)
+        self.assertEqual(2, c.releases)
+
+        self.assertRaises(ValueError, Coalescer, ['a'], 0)
+
+    def test_coalescer_keeps_order(self):
+        c = Coalescer(['a'], max_rows=100)
+        r = Recorder()
+        c._listeners.append(r)
+
+        c.push_rows([(1,)])
+        c.push_batch(RecordBatch(['a'], [[2, 3]]))
+        c.push_rows([(4,)])
+        c.push_rows([(5,)])
+        c.push_batch(RecordBatch(['a'], [[6]]))
+        c.flush()
+        self.assertEqual([[(i,) for i in range(1, 7)]], r.pushes)
+
+
+class BatchStreamTests(object):
+
+    def _rows(self, collector):
+        rows = list()
+        for batch in collector.fetch():
+            rows.extend(batch.rows())
+        return rows
+
+    def test_batch_join_func(self):
+        s = self.Stream(['id', 'lon', 'lat'])
+        out = s.join_func(['lon', 'lat'], 'tile', tile)
+        c = out.collect_batches()
+
+        s.push_batch(RecordBatch(['id', 'lon', 'lat'],
+                                 [[1, 2], [0.5, 1.5], [2.5, 3.5]]))
+        batches = c.fetch()
+        self.assertEqual(1, len(batches))
+        self.assertEqual(['id', 'lon', 'lat', 'tile'], batches[0].attr_names)
+        self.assertEqual(['0/2', '1/3'], batches[0].column('tile'))
+
+    def test_batch_projection(self):
+        s = self.Stream(['a', 'b'])
+        c = s.projection(['a']).collect_batches()
+        s.push_batch(RecordBatch(['a', 'b'], [[1, 1, 2], [1, 2, 3]]))
+        s.push_batch(RecordBatch(['a', 'b'], [[2, 3], [4, 5]]))
+        self.assertEqual([(1,), (2,), (3,)], self._rows(c))
+
+    def test_batch_select_rename(self):
+        s = self.Stream(['a', 'b'])
+        out = s.projection(['b', 'a'], dedup=False).rename(['x', 'y'])
+        c = out.collect_batches()
+        s.push_batch(RecordBatch(['a', 'b'], [[1, 2], [3, 4]]))
+
+        batches = c.fetch()
+        self.assertEqual(['x', 'y'], batches[0].attr_names)
+        self.assertEqual([(3, 1), (4, 2)], batches[0].rows())
+
+    def test_batch_to_row_listeners(self):
+        # streams without a batch function, and collectors of rows, get the
+        # batch converted to rows.
+        s = self.Stream(['a', 'b'])
+        out = s.join_func(['a', 'b'], 'c', lambda a, b: a + b).\
+            natural_join(self.Stream(['c', 'd']))
+        c = s.collect()
+        j = out.collect()
+
+        s.push_batch(RecordBatch(['a', 'b'], [[1, 2], [3, 4]]))
+        self.assertEqual([dict(a=1, b=3), dict(a=2, b=4)], c.fetch())
+        self.assertEqual([], j.fetch())
+
+    def test_batch_rows_and_batches_agree(self):
+        def build():
+            s = self.Stream(['a', 'b'])
+            out = s.join_func(['a', 'b'], 'c', lambda a, b: a * b).\
+                rename(['x', 'y', 'z']).\
+                projection(['z', 'x'])
+            return s, out
+
+        rows = [(1, 2), (2, 1), (3, 3), (1, 2)]
+
+        s, out = build()
+        c = out.collect_rows()
+        s.push_rows(rows)
+        expected = c.fetch()
+
+        s, out = build()
+        c = out.collect_batches()
+        s.push_batch(RecordBatch.from_rows(['a', 'b'], rows))
+        self.assertEqual(expected, self._rows(c))
+
+        s, out = build()
+        c = out.collect_batches()
+        compile_network(s)
+        s.push_batch(RecordBatch.from_rows(['a', 'b'], rows))
+        self.assertEqual(expected, self._rows(c))
+
+    def test_batch_coalesce(self):
+        s = self.Stream(['a', 'b'])
+        out = s.coalesce(max_rows=5).projection(['b'])
+        r = Recorder()
+        out.add_listener(r)
+        c = out.collect_batches()
+
+        s.push_rows([(1, 1), (2, 1)])
+        s.push_batch(RecordBatch(['a', 'b'], [[3, 4], [2, 2]]))
+        self.assertEqual([], r.pushes)
+        s.push_rows([(5, 3)])
+        # rows and batches are released together, in the order pushed.
+        self.assertEqual([[(1,), (2,), (3,)]], r.pushes)
+        self.assertEqual([[(1,), (2,), (3,)]],
+                         [b.rows() for b in c.fetch()])
+
+        s.push_rows([(6, 4)])
+        self.assertEqual(1, len(r.pushes))
+        s.flush()
+        self.assertEqual([(4,)], r.pushes[-1])
+
+    def test_batch_empty_not_pushed(self):
+        s = self.Stream(['a', 'b'])
+        other = self.Stream(['b', 'c'])
+        joined = s.natural_join(other)
+        r = Recorder()
+        joined.add_listener(r)
+        projected = Recorder()
+        s.projection(['a']).add_listener(projected)
+
+        s.push_rows([])
+        s.push_batch(RecordBatch.from_rows(['a', 'b'], []))
+        # nothing to join with yet, and then only duplicates.
+        s.push_rows([(1, 2)])
+        s.push_rows([(1, 3)])
+        self.assertEqual([], r.pushes)
+        self.assertEqual([[(1,)]], projected.pushes)
+        other.push_rows([(2, 5)])
+        self.assertEqual([[(1, 2, 5)]], r.pushes)
+
+    def test_batch_coalesce_join_flush(self):
+        nodes = self.Stream(['id', 'lon', 'lat'])
+        ways = self.Stream(['way', 'id'])
+        out = nodes.coalesce(100).natural_join(ways.coalesce(100)).\
+            coalesce(100)
+        c = out.collect()
+
+        for i in range(10):
+            nodes.push_rows([(i, float(i), 0.0)])
+            ways.push_rows([(100 + i, i)])
+        self.assertEqual([], c.fetch())
+
+        # one flush gets the node side as far as the join, which then has
+        # nothing to join it with until the ways are flushed too.
+        nodes.flush()
+        self.assertEqual([], c.fetch())
+        ways.flush()
+        self.assertEqual(10, len(c.fetch()))
+
+    @skipIf(np is None, "numpy not installed")
+    def test_batch_vectorized_join_func(self):
+        s = self.Stream(['id', 'lon', 'lat'])
+        out = s.join_func(['lon', 'lat'], 'tile', tile_array,
+                          vectorized=True)
+        c = out.collect_batches()
+        r = out.collect_rows()
+
+        s.push_batch(RecordBatch(['id', 'lon', 'lat'],
+                                 [np.array([1, 2]), np.array([0.5, 1.5]),
+                                  np.array([2.5, 3.5])]))
+        self.assertEqual([(1, 0.5, 2.5, '0/2'), (2, 1.5, 3.5, '1/3')],
+                         self._rows(c))
+        self.assertEqual([(1, 0.5, 2.5, '0/2'), (2, 1.5, 3.5, '1/3')],
+                         r.fetch())
+
+        # rows pushed in are still handled in one call per push.
+        s.push_rows([(3, 4.5, 5.5)])
+        self.assertEqual([(3, 4.5, 5.5, '4/5')], r.fetch())
+
+    def test_batch_tile_array_without_numpy(self):
+        real_np = tiles_module.np
+        tiles_module.np = None
+        try:
+            s = self.Stream(['id', 'lon', 'lat'])
+            r = s.join_func(['lon', 'lat'], 'tile', tile_array,
+                            vectorized=True).collect_rows()
+            s.push_batch(RecordBatch(['id', 'lon', 'lat'],
+                                     [[1, 2], [0.5, -1.5], [2.5, 3.5]]))
+            self.assertEqual([(1, 0.5, 2.5, '0/2'), (2, -1.5, 3.5, '-1/3')],
+                             r.fetch())
+        finally:
+            tiles_module.np = real_np
+
+
+class TestStreamingBatches(BatchStreamTests, TestCase):
+    Stream = streaming.Stream
+
+
+class TestExternalBatches(BatchStreamTests, TestCase):
+    Stream = external.Stream
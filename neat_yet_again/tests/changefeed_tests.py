@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from neat import tiling
+from neat.changefeed import Changefeed
+from neat.streaming import Stream
+from neat.tiles import multi_zoom_node_tiles, write_to_changefeed
+
+
+class TestChangefeed(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _fill(self, feed):
+        self.assertEqual(1, feed.append([(('n', 1, 1), 10),
+                                         (('n', 2, 1), 11)]))
+        self.assertEqual(None, feed.append([]))
+        self.assertEqual(2, feed.append([(('n', 1, 2), 10)]))
+        self.assertEqual(3, feed.append([(('n', 3, 1), 12),
+                                         (('n', 3, 1), 12)]))
+
+    def test_changefeed_since(self):
+        feed = Changefeed(self.dir)
+        self._fill(feed)
+        self.assertEqual(3, feed.latest)
+        self.assertEqual(
+            [(1, ('n', 1, 1), 10), (1, ('n', 2, 1), 11),
+             (2, ('n', 1, 2), 10), (3, ('n', 3, 1), 12)],
+            list(feed.since(0)))
+        self.assertEqual([(3, ('n', 3, 1), 12)], list(feed.since(2)))
+        self.assertEqual([], list(feed.since(3)))
+        self.assertEqual(set([10, 12]), feed.tiles_since(1))
+
+    def test_changefeed_tile_since(self):
+        feed = Changefeed(self.dir)
+        self._fill(feed)
+
+        feed.reads = 0
+        self.assertEqual([(1, ('n', 1, 1)), (2, ('n', 1, 2))],
+                         list(feed.tile_since(10, 0)))
+        # only the segments containing the tile were opened.
+        self.assertEqual(2, feed.reads)
+        self.assertEqual([(2, ('n', 1, 2))], list(feed.tile_since(10, 1)))
+        self.assertEqual([], list(feed.tile_since(99, 0)))
+
+    def test_changefeed_reopen(self):
+        self._fill(Changefeed(self.dir))
+
+        # a crash after writing a segment, in the middle of logging it.
+        feed = Changefeed(self.dir)
+        feed._log = lambda seq, tiles: None
+        feed.append([(('n', 4, 1), 11)])
+        with open(os.path.join(self.dir, 'tiles.log'), 'ab') as f:
+            f.write(b'\x10\x00')
+
+        feed = Changefeed(self.dir)
+        self.assertEqual(4, feed.latest)
+        self.assertEqual([(1, ('n', 2, 1)), (4, ('n', 4, 1))],
+                         list(feed.tile_since(11, 0)))
+        self.assertEqual(5, feed.append([(('n', 5, 1), 11)]))
+
+        feed = Changefeed(self.dir)
+        self.assertEqual([4, 5], [s for s, _ in feed.tile_since(11, 1)])
+
+    def test_changefeed_from_network(self):
+        feed = Changefeed(self.dir)
+        nodes = Stream(['id', 'version', 'lon', 'lat'])
+        tiles = multi_zoom_node_tiles(nodes, (10,)).\
+            projection(['tile', 'id', 'version'])
+        write_to_changefeed(tiles, feed)
+
+        nodes.push([dict(id=1, version=1, lon=0.01, lat=0.01)])
+        nodes.push([dict(id=1, version=2, lon=0.01, lat=0.01)])
+        nodes.push([dict(id=1, version=2, lon=0.01, lat=0.01)])
+
+        tile = tiling.tile_for(0.01, 0.01, 10)
+        self.assertEqual(2, feed.latest)
+        self.assertEqual([(1, (1, 1)), (2, (1, 2))],
+                         list(feed.tile_since(tile, 0)))
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+from functools import partial
+from unittest import TestCase
+from neat.codec import encode_node, encode_way, NodeView, WayView, \
+    NodeCodec, RowCodec, MarshalCodec
+from neat.external import Stream
+from neat.keys import encode_key
+from neat.store import SqliteStore
+
+try:
+    long
+except NameError:
+    long = int
+
+
+class TestCodec(TestCase):
+
+    def test_node_round_trip(self):
+        node = dict(lon=-122.4194155, lat=37.7749295, timestamp=1500000000,
+                    changeset=123, uid=42, deleted=False,
+                    tags={u'name': u'Caf\xe9', u'amenity': u'cafe'})
+        view = NodeView(encode_node(node))
+        self.assertAlmostEqual(node['lon'], view.lon, places=7)
+        self.assertAlmostEqual(node['lat'], view.lat, places=7)
+        self.assertEqual(1500000000, view.timestamp)
+        self.assertEqual(123, view.changeset)
+        self.assertEqual(42, view.uid)
+        self.assertFalse(view.deleted)
+        self.assertEqual(node['tags'], view.tags)
+
+    def test_node_anonymous_deleted(self):
+        view = NodeView(encode_node(dict(lon=1, lat=2, deleted=True)))
+        self.assertEqual(None, view.uid)
+        self.assertTrue(view.deleted)
+        self.assertEqual({}, view.tags)
+        self.assertEqual(1.0, view.to_dict()['lon'])
+
+    def test_node_view_of_buffer(self):
+        # views read fields straight out of a larger buffer.
+        data = bytearray(b'xx' + encode_node(dict(lon=1.5, lat=-2.5)))
+        view = NodeView(memoryview(data)[2:])
+        self.assertEqual((1.5, -2.5), (view.lon, view.lat))
+
+    def test_way_round_trip(self):
+        way = dict(nodes=[1, 2, 1 << 40, 1], uid=7, changeset=9,
+                   tags={u'highway': u'primary'})
+        view = WayView(encode_way(way))
+        self.assertEqual(way['nodes'], view.nodes)
+        self.assertEqual(7, view.uid)
+        self.assertEqual(9, view.changeset)
+        self.assertEqual(way['tags'], view.tags)
+
+    def test_row_codec(self):
+        codec = RowCodec(['int64', 'text', 'float64', 'bytes'])
+        row = (1, u'0/1', 2.5, b'\x00\xff')
+        self.assertEqual(row, codec.decode(codec.encode(row)))
+        self.assertTrue(len(codec.encode(row)) <
+                        len(MarshalCodec().encode(row)))
+
+        numbers = RowCodec(['int64', 'int64'])
+        self.assertEqual(16, len(numbers.encode((1, 2))))
+        self.assertEqual((1, 2), numbers.decode(numbers.encode((1, 2))))
+        self.assertRaises(ValueError, RowCodec, ['int32'])
+
+    def test_marshal_codec_canonical(self):
+        codec = MarshalCodec()
+        # an interned string, and an equal one built at run time.
+        interned = 'highway'
+        built = ''.join(['high', 'way'])
+        self.assertFalse(built is interned)
+        rows = [(interned, 1, (u'x', 2)), (built, long(1), ('x', long(2))),
+                (u'highway', 1, (u'x', 2))]
+        self.assertEqual(1, len(set(codec.encode(r) for r in rows)))
+        self.assertEqual(rows[0], codec.decode(codec.encode(rows[1])))
+
+        self.assertNotEqual(codec.encode((u'\xe9',)), codec.encode((1,)))
+        self.assertEqual((u'\xe9', 1 << 70),
+                         codec.decode(codec.encode((u'\xe9', 1 << 70))))
+
+    def test_codec_in_store(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            with SqliteStore(os.path.join(tmp, 'state.db')) as store:
+                index = store.index(codec=NodeCodec())
+                index.put(encode_key('n', 1, 1), dict(lon=1, lat=2))
+                index.put(encode_key('n', 1, 2), dict(lon=3, lat=4))
+                self.assertEqual(
+                    [(1, 1.0, 2.0), (2, 3.0, 4.0)],
+                    [(v, n.lon, n.lat) for v, n in index.versions('n', 1)])
+
+                factory = partial(store.deduplicator,
+                                  codec=RowCodec(['text', 'int64']))
+                s = Stream(['tile', 'id', 'version'], dedup_factory=factory)
+                c = s.projection(['tile', 'id']).collect_rows()
+                s.push_rows([(u'0/0', 1, 1), (u'0/0', 1, 2)])
+                s.push_rows([(u'0/0', 1, 3), (u'0/1', 1, 3)])
+                self.assertEqual([(u'0/0', 1), (u'0/1', 1)], c.fetch())
+        finally:
+            shutil.rmtree(tmp)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+from neat.relation import Relation
+from neat.colfile import save, load, np
+
+
+class TestColumnFile(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.relation = Relation(
+            ['id', 'version', 'lon', 'tile', 'name'],
+            [(1, 1, 0.5, '0/0', u'caf\xe9'),
+             (1, 2, 1.5, '1/1', u'caf\xe9'),
+             (2, 1, -3.25, '0/0', u'pub')])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_colfile_round_trip(self):
+        save(self.relation, self.dir)
+        with load(self.dir) as f:
+            self.assertEqual(3, f.rows)
+            self.assertEqual(self.relation.attribute_names, f.attribute_names)
+            self.assertEqual(self.relation, f.relation())
+
+    def test_colfile_column(self):
+        r = Relation(['a', 'b'], [(i, 'v%d' % (i % 3)) for i in range(10000)])
+        save(r, self.dir)
+        with load(self.dir) as f:
+            col = f.column('a')
+            self.assertEqual(10000, len(col))
+            self.assertEqual(sorted(range(10000)), sorted(col))
+
+            b = f.column('b')
+            values = list(b)
+            self.assertEqual(values[5], b[5])
+            self.assertEqual(values[-1], b[-1])
+            self.assertEqual(set(['v0', 'v1', 'v2']), set(values))
+            with self.assertRaises(IndexError):
+                b[10000]
+
+    def test_colfile_empty(self):
+        save(Relation(['a']), self.dir)
+        with load(self.dir) as f:
+            self.assertEqual(Relation(['a']), f.relation())
+
+    def test_colfile_unsupported(self):
+        r = Relation(['id', 'nodes'], [(1, (1, 2, 3))])
+        with self.assertRaises(ValueError):
+            save(r, self.dir)
+
+    @skipIf(np is None, "numpy not installed")
+    def test_colfile_array(self):
+        save(self.relation, self.dir)
+        with load(self.dir) as f:
+            lons = f.array('lon')
+            self.assertEqual(sorted([0.5, 1.5, -3.25]), sorted(lons.tolist()))
+            self.assertEqual(self.relation, f.columnar().to_relation())
@@ -0,0 +1,98 @@
+from unittest import TestCase, skipIf
+from neat.relation import Relation
+from neat.columnar import ColumnarRelation, np
+from neat.tiles import tile, tile_array
+
+
+@skipIf(np is None, "numpy not installed")
+class TestColumnar(TestCase):
+
+    def _columnar(self, attrs, tuples):
+        return ColumnarRelation.from_relation(Relation(attrs, tuples))
+
+    def test_columnar_round_trip(self):
+        r = Relation(['a', 'b'], [(1, 'x'), (2, 'y'), (3, 'x')])
+        self.assertEqual(r, ColumnarRelation.from_relation(r).to_relation())
+
+    def test_columnar_round_trip_mixed(self):
+        for tuples in ([(1, 'x'), (2, 3)], [(1,), (2.5,)], [(1, None)],
+                       [(True, 1.5), (2, 2)], [(1, (2, 3)), (4, u'y')]):
+            r = Relation(['a', 'b'][:len(tuples[0])], tuples)
+            back = ColumnarRelation.from_relation(r).to_relation()
+            self.assertEqual(r, back)
+            self.assertEqual(
+                sorted(repr(t) for t in r.tuples),
+                sorted(repr(t) for t in back.tuples))
+
+    def test_columnar_mixed_operations(self):
+        a = self._columnar(['a', 'b'], [(1, 'x'), (2, 3), ('1', 4)])
+        b = self._columnar(['a', 'b'], [(1, 'x'), ('2', 3)])
+        self.assertEqual(Relation(['a', 'b'], [(1, 'x')]),
+                         a.intersection(b).to_relation())
+        self.assertEqual(4, len(a.union(b)))
+        c = self._columnar(['a', 'c'], [('1', 'one'), (1, 'uno')])
+        self.assertEqual(Relation(['a', 'b', 'c'], [(1, 'x', 'uno'),
+                                                    ('1', 4, 'one')]),
+                         a.natural_join(c).to_relation())
+
+    def test_columnar_dedup(self):
+        c = ColumnarRelation(['a', 'b'], [[1, 1, 2, 1], [2, 2, 3, 3]])
+        self.assertEqual(3, len(c))
+        self.assertEqual(Relation(['a', 'b'], [(1, 2), (2, 3), (1, 3)]),
+                         c.to_relation())
+
+    def test_columnar_set_operations(self):
+        c1 = self._columnar(['a'], [(1,), (2,)])
+        c2 = self._columnar(['a'], [(2,), (3,)])
+        self.assertEqual(Relation(['a'], [(1,), (2,), (3,)]),
+                         c1.union(c2).to_relation())
+        self.assertEqual(Relation(['a'], [(2,)]),
+                         c1.intersection(c2).to_relation())
+        self.assertEqual(Relation(['a'], [(1,)]),
+                         c1.difference(c2).to_relation())
+        self.assertEqual(Relation(['a'], [(1,), (2,)]),
+                         c1.union(ColumnarRelation(['a'])).to_relation())
+
+    def test_columnar_projection(self):
+        c = self._columnar(['a', 'b', 'c'], [(1, 2, 3), (1, 2, 4)])
+        self.assertEqual(Relation(['b', 'a'], [(2, 1)]),
+                         c.projection(['b', 'a']).to_relation())
+
+    def test_columnar_selection(self):
+        c = self._columnar(['a'], [(1,), (2,), (3,), (4,), (5,)])
+        s = c.selection(lambda t: (t[0] % 2) == 0)
+        self.assertEqual(Relation(['a'], [(2,), (4,)]), s.to_relation())
+
+    def test_columnar_join_func(self):
+        r = Relation(['a', 'b'], [(1, 1), (1, 2), (2, 2), (1, 10)])
+        def mult(a, b):
+            return a*b
+        expected = r.join_func(['a', 'b'], 'c', mult)
+        c = ColumnarRelation.from_relation(r)
+        self.assertEqual(expected,
+                         c.join_func(['a', 'b'], 'c', mult).to_relation())
+        self.assertEqual(expected,
+                         c.join_func(['a', 'b'], 'c', mult,
+                                     vectorized=True).to_relation())
+
+    def test_columnar_natural_join(self):
+        r1 = Relation(['a', 'b'], [(1,1), (1,2), (2,1), (3,5)])
+        r2 = Relation(['b', 'c'], [(1,3), (1,4), (2,4)])
+        c1 = ColumnarRelation.from_relation(r1)
+        c2 = ColumnarRelation.from_relation(r2)
+        self.assertEqual(r1.natural_join(r2),
+                         c1.natural_join(c2).to_relation())
+        self.assertEqual(r2.natural_join(r1),
+                         c2.natural_join(c1).to_relation())
+
+    def test_columnar_tile_array(self):
+        nodes = Relation(['id', 'version', 'lon', 'lat'],
+                         [(1, 1, 0.5, 0.5),
+                          (1, 2, 1.5, -1.5),
+                          (2, 1, -0.5, 10.0)])
+        expected = nodes.join_func(['lon', 'lat'], 'tile', tile)
+        c = ColumnarRelation.from_relation(nodes)
+        self.assertEqual(
+            expected,
+            c.join_func(['lon', 'lat'], 'tile', tile_array,
+                        vectorized=True).to_relation())
@@ -0,0 +1,86 @@
+import random
+from functools import partial
+from unittest import TestCase
+from neat.external import Deduplicator, Stream
+from neat.fingerprint import FingerprintDeduplicator, BloomFilter, \
+    fingerprint
+
+try:
+    long
+except NameError:
+    long = int
+
+
+class TestFingerprint(TestCase):
+
+    def _rows(self, n, seed=0):
+        rng = random.Random(seed)
+        return [(rng.randint(0, n // 2), 'v%d' % rng.randint(0, 3))
+                for _ in range(n)]
+
+    def _check_same_as_set(self, dedup):
+        expected = Deduplicator()
+        for row in self._rows(5000):
+            self.assertEqual(expected.should_emit(row),
+                             dedup.should_emit(row))
+
+    def test_fingerprint_dedup_64(self):
+        d = FingerprintDeduplicator(capacity=16)
+        self._check_same_as_set(d)
+        self.assertTrue(d._size > 16)
+        self.assertTrue(len(d) <= d.load_factor * d._size)
+
+    def test_fingerprint_dedup_128(self):
+        self._check_same_as_set(FingerprintDeduplicator(bits=128))
+
+    def test_fingerprint_dedup_bloom(self):
+        self._check_same_as_set(
+            FingerprintDeduplicator(bloom_bits=1 << 14, load_factor=0.75))
+
+    def test_fingerprint_values(self):
+        self.assertEqual(1, len(fingerprint((1, 'a'))))
+        self.assertEqual(2, len(fingerprint((1, 'a'), 128)))
+        self.assertEqual(fingerprint((1, 'a'))[0],
+                         fingerprint((1, 'a'), 128)[0])
+        self.assertNotEqual(fingerprint((1, 'a')), fingerprint(('a', 1)))
+
+    def test_fingerprint_equal_rows(self):
+        # rows which are equal in a set have the same fingerprint, whatever
+        # the types of their values.
+        rows = [(1, u'a', None), (long(1), 'a', None), (1.0, u'a', None),
+                (True, 'a', None)]
+        self.assertEqual(1, len(set(rows)))
+        self.assertEqual(1, len(set(fingerprint(r, 128) for r in rows)))
+        self.assertNotEqual(fingerprint((1.5,)), fingerprint((1,)))
+        self.assertNotEqual(fingerprint(((1, 2),)), fingerprint((1, 2)))
+        self.assertNotEqual(fingerprint((u'ab', u'c')),
+                            fingerprint((u'a', u'bc')))
+
+        dedup = Deduplicator()
+        fp_dedup = FingerprintDeduplicator()
+        self.assertEqual([dedup.should_emit(r) for r in rows],
+                         [fp_dedup.should_emit(r) for r in rows])
+
+    def test_fingerprint_bad_args(self):
+        self.assertRaises(ValueError, FingerprintDeduplicator, bits=32)
+        self.assertRaises(ValueError, FingerprintDeduplicator,
+                          load_factor=1.5)
+        self.assertRaises(ValueError, BloomFilter, 0)
+
+    def test_bloom_filter(self):
+        b = BloomFilter(1024)
+        fps = [fingerprint((i,))[0] for i in range(50)]
+        for fp in fps:
+            b.add(fp)
+        for fp in fps:
+            self.assertTrue(fp in b)
+
+    def test_fingerprint_stream_factory(self):
+        factory = partial(FingerprintDeduplicator, bits=128)
+        s = Stream(['a', 'b'], dedup_factory=factory)
+        p = s.rename(['x', 'y']).projection(['x'])
+        c = p.collect()
+
+        s.push([dict(a=1, b=1), dict(a=1, b=2), dict(a=2, b=2)])
+        self.assertEqual([dict(x=1), dict(x=2)], c.fetch())
+        self.assertEqual(factory, p._dedup_factory)
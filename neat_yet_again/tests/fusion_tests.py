@@ -0,0 +1,92 @@
+from unittest import TestCase
+from io import BytesIO
+from neat.external import Stream
+from neat.fusion import compile_network
+from neat.reader import push_osm
+from neat.tiles import node_tiles, tile, way_tiles
+from tests.reader_tests import HISTORY
+
+
+class TestFusion(TestCase):
+
+    def _chain(self):
+        s = Stream(['a', 'b'])
+        out = s.join_func(['a', 'b'], 'c', lambda a, b: a * b).\
+            rename(['x', 'y', 'z']).\
+            join_func(['z'], 'w', lambda z: z + 1).\
+            projection(['w', 'x'], dedup=False)
+        return s, out
+
+    def test_fusion_chain(self):
+        s, out = self._chain()
+        c = out.collect()
+
+        # the chain is fused into its first operator, since the source is
+        # still pushed rows laid out as before.
+        self.assertEqual(3, compile_network(s))
+        self.assertEqual(['a', 'b'], s.attr_names)
+        self.assertEqual(1, len(s._listeners))
+        self.assertEqual(c, s._listeners[0]._listeners[0])
+        self.assertEqual(['w', 'x'], s._listeners[0].attr_names)
+
+        s.push([dict(a=2, b=3), dict(a=1, b=1)])
+        self.assertEqual([dict(w=7, x=2), dict(w=2, x=1)], c.fetch())
+
+    def test_fusion_tap_ends_chain(self):
+        s, out = self._chain()
+        c = out.collect()
+        tapped = s._listeners[0]
+        tap = tapped.collect()
+
+        # the tapped stream has two listeners, so it isn't fused into the
+        # source, and the ops after it are fused into the first of them.
+        self.assertEqual(2, compile_network(s))
+
+        s.push([dict(a=2, b=3)])
+        self.assertEqual([dict(a=2, b=3, c=6)], tap.fetch())
+        self.assertEqual([dict(w=7, x=2)], c.fetch())
+
+    def test_fusion_dedup_is_boundary(self):
+        s = Stream(['a', 'b'])
+        p = s.rename(['x', 'y']).projection(['x']).rename(['z'])
+        c = p.collect()
+
+        # only the rename after the projection is fused away, since the one
+        # after the source is alone.
+        self.assertEqual(1, compile_network(s))
+        s.push([dict(a=1, b=1), dict(a=1, b=2)])
+        s.push([dict(a=1, b=3), dict(a=2, b=3)])
+        self.assertEqual([dict(z=1), dict(z=2)], c.fetch())
+
+    def _run_tiles(self, compiled):
+        nodes = Stream(['id', 'version', 'lon', 'lat'])
+        ways = Stream(['id', 'version', 'nodes'])
+        node_out = node_tiles(nodes).\
+            projection(['tile', 'id', 'version']).collect()
+        way_out = way_tiles(nodes, ways).\
+            projection(['tile', 'id', 'version']).collect()
+        if compiled:
+            self.assertTrue(compile_network(nodes, ways) > 0)
+
+        results = list()
+        nodes.push([dict(id=1, version=1, lon=0, lat=0),
+                    dict(id=2, version=1, lon=1, lat=1)])
+        ways.push([dict(id=1, version=1, nodes=(1, 2))])
+        nodes.push([dict(id=1, version=2, lon=2, lat=2)])
+        results.append(sorted(node_out.fetch()))
+        results.append(sorted(way_out.fetch()))
+        return results
+
+    def test_fusion_tiles(self):
+        self.assertEqual(self._run_tiles(False), self._run_tiles(True))
+
+    def test_fusion_source_reader(self):
+        nodes = Stream(['id', 'version', 'lon', 'lat'])
+        c = nodes.join_func(['lon', 'lat'], 'tile', tile).\
+            projection(['tile', 'id'], dedup=False).collect_rows()
+        self.assertEqual(1, compile_network(nodes))
+        self.assertEqual(['id', 'version', 'lon', 'lat'], nodes.attr_names)
+
+        push_osm(BytesIO(HISTORY), nodes)
+        self.assertEqual([(tile(0.5, 0.5), 1), (tile(1.5, 1.5), 2),
+                          (tile(0.1, 0.1), 5)], c.fetch())
@@ -0,0 +1,97 @@
+import os
+import shutil
+import struct
+import tempfile
+from unittest import TestCase
+from neat.keys import encode_key, decode_key, id_range, KeyIndex, KEY_SIZE
+from neat.store import SqliteStore
+
+
+class TestKeys(TestCase):
+
+    def test_key_layout(self):
+        # same as mk_buffer in neat4.cpp.
+        k = encode_key('n', 0x0102030405060708, 9)
+        self.assertEqual(13, KEY_SIZE)
+        self.assertEqual(b'n' + struct.pack('>Q', 0x0102030405060708) +
+                         struct.pack('>I', 9), k)
+        self.assertEqual(('n', 0x0102030405060708, 9), decode_key(k))
+
+    def test_key_order(self):
+        elements = [('n', 1, 1), ('n', 1, 2), ('n', 2, 0), ('n', 256, 1),
+                    ('n', 1 << 40, 3), ('r', 1, 1), ('w', 0, 0)]
+        keys = [encode_key(*e) for e in elements]
+        self.assertEqual(sorted(keys), keys)
+
+    def test_key_bad_args(self):
+        self.assertRaises(ValueError, encode_key, 'x', 1)
+        self.assertRaises(ValueError, encode_key, 'n', -1)
+        self.assertRaises(ValueError, encode_key, 'n', 1 << 64)
+        self.assertRaises(ValueError, encode_key, 'n', 1, 1 << 32)
+
+    def test_id_range_to_end(self):
+        begin, end = id_range('n', 5, 1 << 64)
+        self.assertTrue(begin < encode_key('n', (1 << 64) - 1, 7) < end)
+        self.assertTrue(end <= encode_key('r', 0))
+
+
+class IndexTests(object):
+
+    def _fill(self, index):
+        for element_id in (1, 2, 3, 10):
+            for version in (1, 2):
+                index.put(encode_key('n', element_id, version),
+                          '%d/%d' % (element_id, version))
+        index.put(encode_key('w', 2, 1), 'way')
+
+    def test_index_versions(self):
+        index = self.index()
+        self._fill(index)
+        self.assertEqual([(1, '2/1'), (2, '2/2')], index.versions('n', 2))
+        self.assertEqual([(1, 'way')], index.versions('w', 2))
+        self.assertEqual([], index.versions('n', 4))
+        self.assertEqual('3/2', index.get(encode_key('n', 3, 2)))
+        self.assertEqual(9, len(index))
+
+    def test_index_elements(self):
+        index = self.index()
+        self._fill(index)
+        self.assertEqual(
+            [(2, 1, '2/1'), (2, 2, '2/2'), (3, 1, '3/1'), (3, 2, '3/2')],
+            list(index.elements('n', 2, 10)))
+        self.assertEqual(8, len(list(index.elements('n', 0, 1 << 64))))
+
+    def test_index_replace(self):
+        index = self.index()
+        k = encode_key('n', 1, 1)
+        index.put(k, 'a')
+        index.put(k, 'b')
+        self.assertEqual([(1, 'b')], index.versions('n', 1))
+        self.assertEqual(1, len(index))
+
+
+class TestKeyIndex(IndexTests, TestCase):
+
+    def index(self):
+        return KeyIndex()
+
+
+class TestStoredKeyIndex(IndexTests, TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = SqliteStore(os.path.join(self.dir, 'index.db'))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def index(self):
+        return self.store.index()
+
+    def test_index_one_transaction(self):
+        index = self.index()
+        self._fill(index)
+        index.versions('n', 1)
+        index.versions('n', 2)
+        self.assertEqual(1, self.store.transactions)
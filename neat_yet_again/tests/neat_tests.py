@@ -137,3 +137,91 @@ class TestRelation(TestCase):
             Relation(['a', 'b', 'c'], [(1, 1, 1), (1, 2, 2), (2, 2, 4),
                                        (1, 10, 10)]),
             r2)
+
+    def test_relation_natural_join_methods(self):
+        r1 = Relation(['a', 'b'], [(1,1), (1,2), (2,1), (3,5)])
+        r2 = Relation(['b', 'c'], [(1,3), (1,4), (2,4)])
+        expected = Relation(['a','b','c'],
+                            [(1,1,3), (1,1,4), (2,1,3), (2,1,4), (1,2,4)])
+        for method in ('hash', 'merge', 'nested'):
+            self.assertEqual(expected, r1.natural_join(r2, method=method))
+
+    def test_relation_natural_join_build_side(self):
+        # the right side is smaller, so the hash join builds on it, but the
+        # output attribute order should still follow the left side.
+        r1 = Relation(['a', 'b'], [(1,1), (2,1), (3,2), (4,3)])
+        r2 = Relation(['b', 'c'], [(1,5)])
+        self.assertEqual(Relation(['a','b','c'], [(1,1,5), (2,1,5)]),
+                         r1.natural_join(r2))
+        self.assertEqual(Relation(['b','c','a'], [(1,5,1), (1,5,2)]),
+                         r2.natural_join(r1))
+
+    def test_relation_natural_join_multiple_attrs(self):
+        r1 = Relation(['a', 'b', 'c'], [(1,1,1), (1,2,1), (2,2,2)])
+        r2 = Relation(['c', 'b', 'd'], [(1,1,7), (2,2,8), (1,2,9)])
+        expected = Relation(['a','b','c','d'],
+                            [(1,1,1,7), (1,2,1,9), (2,2,2,8)])
+        for method in ('hash', 'merge', 'nested'):
+            self.assertEqual(expected, r1.natural_join(r2, method=method))
+
+    def test_relation_natural_join_unknown_method(self):
+        r1 = Relation(['a'], [(1,)])
+        with self.assertRaises(ValueError):
+            r1.natural_join(r1, method='magic')
+
+    def test_relation_lookup(self):
+        r1 = Relation(['a', 'b'], [(1,1), (1,2), (2,2)])
+        self.assertEqual(sorted([(1,1), (1,2)]), sorted(r1.lookup(['a'], [1])))
+        self.assertEqual([], r1.lookup(['a'], [3]))
+        self.assertEqual([(2,2)], r1.lookup(['b', 'a'], (2, 2)))
+
+    def test_relation_selection_eq(self):
+        r1 = Relation(['a', 'b'], [(1,1), (1,2), (2,2)])
+        self.assertEqual(Relation(['a', 'b'], [(1,2), (2,2)]),
+                         r1.selection_eq(['b'], [2]))
+
+    def test_relation_index_reused(self):
+        r1 = Relation(['a', 'b'], [(1,1), (1,2), (2,2)])
+        r2 = Relation(['b', 'c'], [(1,3), (2,4), (2,5), (3,6)])
+        r1.natural_join(r2)
+        index = r1._indexes[('b',)]
+        r1.natural_join(Relation(['b', 'd'], [(2,7), (3,8), (4,9), (5,0)]))
+        self.assertTrue(r1._indexes[('b',)] is index)
+
+        # renaming shares the tuples, and so the indexes.
+        renamed = r1.rename(['x', 'y'])
+        self.assertTrue(renamed._indexes[('y',)] is index)
+        self.assertEqual([(1,1)], renamed.lookup(['y'], [1]))
+
+    def test_relation_from_columns(self):
+        r = Relation.from_columns(['a', 'b'], [[1, 2, 1], ['x', 'y', 'x']])
+        self.assertEqual(Relation(['a', 'b'], [(1, 'x'), (2, 'y')]), r)
+        self.assertEqual(Relation(['a', 'b']),
+                         Relation.from_columns(['a', 'b'], [[], []]))
+
+    def test_relation_from_sorted_iter(self):
+        r1 = Relation.from_sorted_iter(
+            ['a', 'b'], iter([(1, 1), (1, 2), (1, 2), (2, 1)]))
+        self.assertEqual(Relation(['a', 'b'], [(1, 1), (1, 2), (2, 1)]), r1)
+
+        r2 = Relation.from_sorted_iter(['c', 'b'], [(3, 1), (1, 2), (2, 2)],
+                                       key_attributes=['b'])
+        self.assertEqual([(3, 1), (1, 2), (2, 2)], r2._sorted[('b',)])
+        self.assertEqual(
+            Relation(['a', 'b', 'c'], [(1, 1, 3), (2, 1, 3), (1, 2, 1),
+                                       (1, 2, 2)]),
+            r1.natural_join(r2, method='merge'))
+        self.assertEqual(r1.natural_join(r2, method='hash'),
+                         r1.natural_join(r2, method='merge'))
+
+    def test_relation_validate(self):
+        import neat.relation
+        old = neat.relation.VALIDATE
+        neat.relation.VALIDATE = True
+        try:
+            with self.assertRaises(AssertionError):
+                Relation.from_columns(['a', 'b'], [[1, 2], [3]])
+            with self.assertRaises(AssertionError):
+                Relation.from_sorted_iter(['a'], [(2,), (1,)])
+        finally:
+            neat.relation.VALIDATE = old
@@ -0,0 +1,51 @@
+from unittest import TestCase
+from neat.relation import Relation
+from neat.parallel import ParallelExecutor, encode_batch, decode_batch
+
+
+class TestParallel(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.executor = ParallelExecutor(processes=2, partitions=5)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.close()
+
+    def setUp(self):
+        self.r1 = Relation(['a', 'b'], [(i, i % 7) for i in range(200)])
+        self.r2 = Relation(['b', 'c'], [(i % 9, 'c%d' % i)
+                                        for i in range(100)])
+        self.r3 = Relation(['a', 'b'], [(i, i % 7) for i in range(100, 300)])
+
+    def test_parallel_batch_round_trip(self):
+        tuples = [(1, 'a', 1.5), (2, u'b', None), (3, 'c', (1, 2))]
+        self.assertEqual(tuples, decode_batch(encode_batch(tuples, 3)))
+        self.assertEqual([], decode_batch(encode_batch([], 3)))
+
+    def test_parallel_natural_join(self):
+        self.assertEqual(self.r1.natural_join(self.r2),
+                         self.executor.natural_join(self.r1, self.r2))
+        self.assertEqual(self.r2.natural_join(self.r1),
+                         self.executor.natural_join(self.r2, self.r1))
+
+    def test_parallel_projection(self):
+        self.assertEqual(self.r1.projection(['b']),
+                         self.executor.projection(self.r1, ['b']))
+        self.assertEqual(self.r2.projection(['c', 'b']),
+                         self.executor.projection(self.r2, ['c', 'b']))
+
+    def test_parallel_set_operations(self):
+        self.assertEqual(self.r1.union(self.r3),
+                         self.executor.union(self.r1, self.r3))
+        self.assertEqual(self.r1.intersection(self.r3),
+                         self.executor.intersection(self.r1, self.r3))
+        self.assertEqual(self.r1.difference(self.r3),
+                         self.executor.difference(self.r1, self.r3))
+
+    def test_parallel_empty(self):
+        empty = Relation(['a', 'b'])
+        self.assertEqual(empty, self.executor.union(empty, empty))
+        self.assertEqual(Relation(['a', 'b', 'c']),
+                         self.executor.natural_join(empty, self.r2))
@@ -0,0 +1,259 @@
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+from unittest import TestCase
+from neat.pbf import read_pbf, push_pbf, read_pbf_relations
+from neat.reader import parse_timestamp
+from neat.relation import Relation
+from neat.streaming import Stream
+from neat.tiles import node_tiles, way_tiles, tile
+
+
+# just enough of a PBF writer to build files for the tests, and for
+# benchmarks/pbf.py.
+
+def _varint(n):
+    out = bytearray()
+    while True:
+        b = n & 0x7f
+        n >>= 7
+        if n:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def _zz(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _int(field, n):
+    return _varint(field << 3) + _varint(n & 0xffffffffffffffff)
+
+
+def _msg(field, data):
+    return _varint(field << 3 | 2) + _varint(len(data)) + data
+
+
+def _packed(field, values):
+    return _msg(field, b''.join(_varint(v & 0xffffffffffffffff)
+                                for v in values))
+
+
+def _deltas(values):
+    prev = 0
+    result = list()
+    for v in values:
+        result.append(_zz(v - prev))
+        prev = v
+    return result
+
+
+def _blob(blob_type, data, compress=True):
+    if compress:
+        blob = _int(2, len(data)) + _msg(3, zlib.compress(data))
+    else:
+        blob = _msg(1, data)
+    header = _msg(1, blob_type.encode('utf-8')) + _int(3, len(blob))
+    return struct.pack('>I', len(header)) + header + blob
+
+
+class _Strings(object):
+    def __init__(self):
+        self.strings = [b'']
+        self.index = dict()
+
+    def __call__(self, s):
+        s = s.encode('utf-8')
+        if s not in self.index:
+            self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return self.index[s]
+
+    def encode(self):
+        return _msg(1, b''.join(_msg(1, s) for s in self.strings))
+
+
+def _fixed(coord):
+    return int(round(coord * 1e7))
+
+
+def _dense(nodes, strings):
+    keys_vals = list()
+    for n in nodes:
+        for k, v in sorted(n.get('tags', {}).items()):
+            keys_vals.extend((strings(k), strings(v)))
+        keys_vals.append(0)
+    info = (_packed(1, [n['version'] for n in nodes]) +
+            _packed(2, _deltas([n.get('timestamp', 0) for n in nodes])) +
+            _packed(3, _deltas([n.get('changeset', 0) for n in nodes])) +
+            _packed(4, _deltas([n.get('uid', 0) for n in nodes])) +
+            _packed(5, _deltas([strings(n.get('user', ''))
+                                for n in nodes])) +
+            _packed(6, [int(n.get('visible', True)) for n in nodes]))
+    return _msg(2, _packed(1, _deltas([n['id'] for n in nodes])) +
+                _msg(5, info) +
+                _packed(8, _deltas([_fixed(n['lat']) for n in nodes])) +
+                _packed(9, _deltas([_fixed(n['lon']) for n in nodes])) +
+                _packed(10, keys_vals))
+
+
+def _info(e, strings):
+    return _msg(4, _int(1, e['version']) + _int(2, e.get('timestamp', 0)) +
+                _int(3, e.get('changeset', 0)) + _int(4, e.get('uid', 0)) +
+                _int(5, strings(e.get('user', ''))) +
+                _int(6, int(e.get('visible', True))))
+
+
+def _tags(e, strings):
+    tags = sorted(e.get('tags', {}).items())
+    return (_packed(2, [strings(k) for k, v in tags]) +
+            _packed(3, [strings(v) for k, v in tags]))
+
+
+def _node(n, strings):
+    return _msg(1, _int(1, _zz(n['id'])) + _tags(n, strings) +
+                _info(n, strings) + _int(8, _zz(_fixed(n['lat']))) +
+                _int(9, _zz(_fixed(n['lon']))))
+
+
+def _way(w, strings):
+    return _msg(3, _int(1, w['id']) + _tags(w, strings) +
+                _info(w, strings) + _packed(8, _deltas(w['nodes'])))
+
+
+def encode_pbf(nodes, ways, block_size=8000, dense=True, compress=True,
+               features=('OsmSchema-V0.6', 'DenseNodes')):
+    """
+    Encodes lists of `nodes` and `ways`, as dicts, as a PBF file with up to
+    `block_size` elements per block. Timestamps are in seconds, and
+    coordinates are rounded to the usual 7 decimal places.
+    """
+
+    header = b''.join(_msg(4, f.encode('utf-8')) for f in features)
+    out = [_blob('OSMHeader', header, compress)]
+    for kind, elements in (('node', nodes), ('way', ways)):
+        for i in range(0, len(elements), block_size):
+            block = elements[i:i + block_size]
+            strings = _Strings()
+            if kind == 'way':
+                group = b''.join(_way(w, strings) for w in block)
+            elif dense:
+                group = _dense(block, strings)
+            else:
+                group = b''.join(_node(n, strings) for n in block)
+            data = strings.encode() + _msg(2, group) + _int(18, 1000)
+            out.append(_blob('OSMData', data, compress))
+    return b''.join(out)
+
+
+NODES = [
+    dict(id=1, version=1, lon=0.5, lat=0.5, changeset=10, uid=5, user='a',
+         timestamp=parse_timestamp('2012-03-04T05:06:07Z'),
+         tags={'amenity': 'cafe'}),
+    dict(id=1, version=2, lon=-0.25, lat=-10.1234567, changeset=11,
+         uid=6, user=u'\xe9', visible=False),
+    dict(id=2, version=1, lon=1.5, lat=1.5, changeset=10),
+    dict(id=5, version=1, lon=179.9999999, lat=0.1, changeset=12),
+]
+
+WAYS = [
+    dict(id=3, version=1, changeset=10, nodes=[1, 2],
+         tags={'highway': 'path', 'name': 'x'}),
+    dict(id=4, version=1, changeset=10, nodes=[5, 2, 1], visible=False),
+]
+
+
+class TestPbf(TestCase):
+
+    def _read(self, data, **kwargs):
+        return [(kind, batch.rows())
+                for kind, batch in read_pbf(io.BytesIO(data), **kwargs)]
+
+    def test_read_dense(self):
+        # the deleted version of node 1 has no location, whether or not the
+        # file has one for it.
+        for dense in (True, False):
+            data = encode_pbf(NODES, WAYS, dense=dense)
+            self.assertEqual(
+                [('node', [(1, 1, 0.5, 0.5), (1, 2, None, None),
+                           (2, 1, 1.5, 1.5), (5, 1, 179.9999999, 0.1)]),
+                 ('way', [(3, 1, (1, 2)), (4, 1, (5, 2, 1))])],
+                self._read(data, processes=1))
+
+    def test_read_attributes(self):
+        attrs = ['id', 'tags', 'deleted', 'uid', 'user', 'timestamp',
+                 'changeset']
+        for dense in (True, False):
+            data = encode_pbf(NODES, WAYS, dense=dense)
+            batches = self._read(data, processes=1, node_attrs=attrs,
+                                 way_attrs=attrs)
+            self.assertEqual(
+                (1, (('amenity', 'cafe'),), False, 5, 'a',
+                 parse_timestamp('2012-03-04T05:06:07Z'), 10),
+                batches[0][1][0])
+            self.assertEqual((1, (), True, 6, u'\xe9'), batches[0][1][1][:5])
+            self.assertEqual(
+                [(3, (('highway', 'path'), ('name', 'x')), False),
+                 (4, (), True)],
+                [r[:3] for r in batches[1][1]])
+
+        self.assertRaises(ValueError, list,
+                          read_pbf(io.BytesIO(data), node_attrs=['colour']))
+
+    def test_read_blocks_in_order(self):
+        nodes = [dict(id=i, version=1, lon=i / 100.0, lat=0.0)
+                 for i in range(1, 101)]
+        ways = [dict(id=i, version=1, nodes=[i, i + 1]) for i in range(30)]
+        data = encode_pbf(nodes, ways, block_size=16, compress=False)
+
+        for processes in (1, 3):
+            batches = list(read_pbf(io.BytesIO(data), batch_size=10,
+                                    processes=processes))
+            self.assertEqual([('node', 10), ('node', 6)] * 6 +
+                             [('node', 4), ('way', 10), ('way', 6),
+                              ('way', 10), ('way', 4)],
+                             [(k, len(b)) for k, b in batches])
+            ids = [i for k, b in batches if k == 'node'
+                   for i in b.column('id')]
+            self.assertEqual(list(range(1, 101)), ids)
+
+    def test_unsupported(self):
+        data = encode_pbf(NODES, [], features=('OsmSchema-V0.6', 'Sort'))
+        self.assertRaises(ValueError, self._read, data, processes=1)
+        self.assertRaises(ValueError, self._read, b'\x00\x00\x00',
+                          processes=1)
+
+    def test_push_pbf(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'history.osm.pbf')
+            with open(path, 'wb') as f:
+                f.write(encode_pbf(NODES[1:], WAYS[:1]))
+
+            # the deleted version of node 1 is read, but not pushed.
+            nodes = Stream(['id', 'version', 'lon', 'lat'])
+            ways = Stream(['id', 'version', 'nodes'])
+            w = way_tiles(nodes, ways).projection(['tile', 'id']).collect()
+            stats = push_pbf(path, nodes, ways, processes=2)
+            self.assertEqual((3, 1), (stats.nodes, stats.ways))
+            self.assertEqual([(tile(1.5, 1.5), 3)],
+                             [(r['tile'], r['id']) for r in w.fetch()])
+
+            node_rel, way_rel = read_pbf_relations(
+                path, way_attrs=['id', 'nodes'], processes=1)
+            self.assertEqual(
+                Relation(['id', 'version', 'lon', 'lat'],
+                         [(1, 2, None, None), (2, 1, 1.5, 1.5),
+                          (5, 1, 179.9999999, 0.1)]),
+                node_rel)
+            self.assertEqual(Relation(['id', 'nodes'], [(3, (1, 2))]),
+                             way_rel)
+            tiles = node_tiles(node_rel.selection(lambda t: t[2] is not None))
+            self.assertEqual(2, len(tiles.tuples))
+        finally:
+            shutil.rmtree(tmp)
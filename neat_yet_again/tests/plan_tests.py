@@ -0,0 +1,117 @@
+from unittest import TestCase
+from neat.relation import Relation
+from neat.plan import LazyRelation, Projection, Selection, Scan, JoinFunc
+from neat.tiles import tile, node_tiles
+
+
+class TestPlan(TestCase):
+
+    def setUp(self):
+        self.nodes = Relation(['id', 'version', 'lon', 'lat'],
+                              [(1, 1, 0, 0),
+                               (1, 2, 1, 1),
+                               (2, 1, 0, 0),
+                               (3, 1, 5, 5)])
+
+    def _find(self, plan, cls):
+        found = list()
+        if isinstance(plan, cls):
+            found.append(plan)
+        for c in plan.children:
+            found.extend(self._find(c, cls))
+        return found
+
+    def test_plan_is_lazy(self):
+        calls = list()
+        def f(a):
+            calls.append(a)
+            return a
+
+        lazy = self.nodes.lazy().join_func(['id'], 'x', f)
+        self.assertEqual([], calls)
+        self.assertEqual(self.nodes.join_func(['id'], 'x', f),
+                         lazy.evaluate())
+
+    def test_plan_node_tiles(self):
+        eager = node_tiles(self.nodes).\
+            projection(['tile', 'id', 'version', 'lon', 'lat'])
+        lazy = node_tiles(self.nodes.lazy()).\
+            projection(['tile', 'id', 'version', 'lon', 'lat'])
+        self.assertEqual(eager, lazy.evaluate())
+        self.assertEqual(eager, lazy.evaluate(optimized=False))
+
+    def test_plan_set_operations(self):
+        r1 = Relation(['a'], [(1,), (2,)])
+        r2 = Relation(['a'], [(2,), (3,)])
+        l1 = r1.lazy()
+        self.assertEqual(r1.union(r2), l1.union(r2).evaluate())
+        self.assertEqual(r1.intersection(r2), l1.intersection(r2).evaluate())
+        self.assertEqual(r1.difference(r2),
+                         l1.difference(r2.lazy()).evaluate())
+
+    def test_plan_selection_pushdown(self):
+        tiles = Relation(['tile', 'id'], [('0/0', 1), ('1/1', 1),
+                                          ('0/0', 2), ('5/5', 3)])
+        lazy = tiles.lazy().natural_join(self.nodes).\
+            selection(lambda t: t[2] > 1, attrs=['version'])
+        eager = tiles.natural_join(self.nodes).\
+            selection(lambda t: t[2] > 1)
+        self.assertEqual(eager, lazy.evaluate())
+
+        # the selection should end up directly over the nodes scan.
+        plan = lazy.optimize()
+        selections = self._find(plan, Selection)
+        self.assertEqual(1, len(selections))
+        self.assertEqual(len(self._find(selections[0], Scan)), 1)
+        scan = self._find(selections[0], Scan)[0]
+        self.assertTrue(scan.relation is self.nodes)
+
+    def test_plan_unknown_selection_stays(self):
+        lazy = self.nodes.lazy().projection(['id', 'version']).\
+            selection(lambda t: t[1] == 1)
+        self.assertEqual(Relation(['id', 'version'], [(1, 1), (2, 1), (3, 1)]),
+                         lazy.evaluate())
+
+    def test_plan_projection_pruning(self):
+        lazy = self.nodes.lazy().\
+            join_func(['lon', 'lat'], 'tile', tile).\
+            projection(['id', 'version'])
+        plan = lazy.optimize()
+        # the tile is never used, so it shouldn't be computed.
+        self.assertEqual([], self._find(plan, JoinFunc))
+        self.assertEqual(self.nodes.projection(['id', 'version']),
+                         lazy.evaluate())
+
+    def test_plan_redundant_dedup(self):
+        lazy = self.nodes.lazy().projection(['id', 'version', 'lon']).\
+            rename(['a', 'b', 'c']).projection(['a'])
+        plan = lazy.optimize()
+        dedups = [p for p in self._find(plan, Projection) if p.dedup]
+        self.assertEqual([], dedups)
+        self.assertEqual(Relation(['a'], [(1,), (2,), (3,)]), lazy.evaluate())
+
+    def test_plan_join_order(self):
+        big = Relation(['a', 'b'], [(i, i % 10) for i in range(100)])
+        mid = Relation(['b', 'c'], [(i % 10, i) for i in range(50)])
+        small = Relation(['c', 'd'], [(1, 'x'), (2, 'y')])
+
+        lazy = big.lazy().natural_join(mid).natural_join(small)
+        eager = big.natural_join(mid).natural_join(small)
+        self.assertEqual(eager, lazy.evaluate())
+        self.assertEqual(eager.attribute_names,
+                         lazy.optimize().attribute_names)
+
+        # the small relation should be joined first, innermost.
+        explained = lazy.explain()
+        lines = explained.split("\n")
+        self.assertTrue(lines[0].startswith("Projection"))
+        self.assertTrue("rows=" in lines[0])
+        scans = [l.strip() for l in lines if "Scan" in l]
+        self.assertTrue(scans[0].startswith("Scan ['c', 'd']"))
+
+    def test_plan_explain(self):
+        lazy = node_tiles(self.nodes.lazy())
+        explained = lazy.explain()
+        self.assertTrue("NaturalJoin on ['id']" in explained)
+        self.assertTrue("JoinFunc tile = tile(lon, lat)" in explained)
+        self.assertTrue("Scan ['id', 'version', 'lon', 'lat']" in explained)
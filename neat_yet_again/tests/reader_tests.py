@@ -0,0 +1,132 @@
+import gzip
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest import TestCase
+from neat.external import Stream
+from neat.reader import read_osm, push_osm, parse_timestamp, NODE_ATTRS
+from neat.tiles import node_tiles, way_tiles, tile
+
+HISTORY = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osm version="0.6" generator="test">
+ <bounds minlat="0" minlon="0" maxlat="2" maxlon="2"/>
+ <node id="1" version="1" timestamp="2012-03-04T05:06:07Z" uid="5"
+       user="a" changeset="10" lat="0.5" lon="0.5">
+  <tag k="amenity" v="cafe"/>
+ </node>
+ <node id="1" version="2" timestamp="2012-03-05T00:00:00Z" changeset="11"
+       visible="false"/>
+ <node id="2" version="1" changeset="10" lat="1.5" lon="1.5"/>
+ <way id="3" version="1" changeset="10">
+  <nd ref="1"/>
+  <nd ref="2"/>
+  <tag k="highway" v="path"/>
+ </way>
+ <relation id="4" version="1" changeset="10">
+  <member type="way" ref="3" role=""/>
+  <tag k="type" v="route"/>
+ </relation>
+ <node id="5" version="1" changeset="12" lat="0.1" lon="0.1"/>
+</osm>
+"""
+
+CHANGE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<osmChange version="0.6" generator="test">
+ <create>
+  <node id="6" version="1" changeset="20" lat="0.2" lon="0.2"/>
+ </create>
+ <modify>
+  <way id="3" version="2" changeset="20">
+   <nd ref="1"/>
+   <nd ref="6"/>
+  </way>
+ </modify>
+ <delete>
+  <node id="2" version="2" changeset="20"/>
+ </delete>
+</osmChange>
+"""
+
+
+class TestReader(TestCase):
+
+    def test_read_history(self):
+        batches = list(read_osm(BytesIO(HISTORY)))
+        self.assertEqual(
+            [('node', [(1, 1, 0.5, 0.5), (1, 2, None, None),
+                       (2, 1, 1.5, 1.5)]),
+             ('way', [(3, 1, (1, 2))]),
+             ('node', [(5, 1, 0.1, 0.1)])],
+            batches)
+
+    def test_read_attributes(self):
+        batches = list(read_osm(
+            BytesIO(HISTORY), node_attrs=['id', 'tags', 'deleted', 'uid',
+                                          'timestamp'],
+            way_attrs=['id', 'tags']))
+        nodes = batches[0][1]
+        self.assertEqual(
+            (1, (('amenity', 'cafe'),), False, 5,
+             parse_timestamp('2012-03-04T05:06:07Z')), nodes[0])
+        self.assertEqual((1, (), True, None), nodes[1][:4])
+        self.assertEqual([(3, (('highway', 'path'),))], batches[1][1])
+        self.assertRaises(ValueError, list,
+                          read_osm(BytesIO(HISTORY), node_attrs=['colour']))
+
+    def test_read_batches(self):
+        batches = list(read_osm(BytesIO(HISTORY), batch_size=2))
+        self.assertEqual([('node', 2), ('node', 1), ('way', 1), ('node', 1)],
+                         [(k, len(rows)) for k, rows in batches])
+
+    def test_read_change(self):
+        batches = list(read_osm(BytesIO(CHANGE),
+                                node_attrs=['id', 'version', 'deleted'],
+                                way_attrs=['id', 'nodes', 'deleted']))
+        self.assertEqual(
+            [('node', [(6, 1, False)]), ('way', [(3, (1, 6), False)]),
+             ('node', [(2, 2, True)])],
+            batches)
+
+    def test_timestamp(self):
+        self.assertEqual(0, parse_timestamp('1970-01-01T00:00:00Z'))
+        self.assertEqual(1331092800, parse_timestamp('2012-03-07T04:00:00Z'))
+
+    def test_push_osm_flushes(self):
+        nodes = Stream(NODE_ATTRS)
+        c = nodes.coalesce(1000).collect()
+        push_osm(BytesIO(HISTORY), nodes, batch_size=1)
+        # all but the deleted version of node 1, which has no location.
+        self.assertEqual(3, len(c.fetch()))
+
+    def test_push_osm_gzip(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'history.osm.gz')
+            with gzip.open(path, 'wb') as f:
+                f.write(HISTORY)
+
+            nodes = Stream(['id', 'version', 'lon', 'lat'])
+            ways = Stream(['id', 'version', 'nodes'])
+            n = node_tiles(nodes).projection(['tile', 'id', 'version'])
+            w = way_tiles(nodes, ways).projection(['tile', 'id', 'version'])
+            n, w = n.collect(), w.collect()
+
+            stats = push_osm(path, nodes, ways)
+            self.assertEqual((4, 1, 5), (stats.nodes, stats.ways,
+                                         stats.elements))
+            self.assertTrue(stats.rate >= 0)
+
+            # the deleted version of node 1 has no location, so it isn't
+            # pushed, and the way is only in the tiles of the others.
+            self.assertEqual(
+                sorted([(tile(0.5, 0.5), 3, 1), (tile(1.5, 1.5), 3, 1)]),
+                sorted((r['tile'], r['id'], r['version'])
+                       for r in w.fetch()))
+            self.assertEqual(
+                sorted([(tile(0.5, 0.5), 1, 1), (tile(1.5, 1.5), 2, 1),
+                        (tile(0.1, 0.1), 5, 1)]),
+                sorted((r['tile'], r['id'], r['version'])
+                       for r in n.fetch()))
+        finally:
+            shutil.rmtree(tmp)
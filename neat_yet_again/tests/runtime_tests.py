@@ -0,0 +1,163 @@
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO
+from unittest import TestCase
+from neat import external, streaming
+from neat.reader import push_osm
+from neat.runtime import Runtime
+from neat.store import SqliteStore
+from neat.tiles import way_tiles
+from tests.reader_tests import CHANGE
+
+
+class Recorder(object):
+    def __init__(self, wait=None):
+        self.rows = list()
+        self.wait = wait
+
+    def push_rows(self, rows):
+        if self.wait is not None:
+            self.wait.wait()
+        self.rows.extend(rows)
+
+
+class RuntimeTests(object):
+
+    def _pushes(self, seed=0):
+        rng = random.Random(seed)
+        pushes = list()
+        for i in range(200):
+            if rng.random() < 0.7:
+                pushes.append(('node', [(rng.randrange(50), 1,
+                                         rng.uniform(-5, 5),
+                                         rng.uniform(-5, 5))]))
+            else:
+                pushes.append(('way', [(rng.randrange(20), 1,
+                                        tuple(rng.sample(range(50), 3)))]))
+        return pushes
+
+    def _run(self, pushes, runtime=None):
+        nodes = self.Stream(['id', 'version', 'lon', 'lat'])
+        ways = self.Stream(['id', 'version', 'nodes'])
+        inputs = dict(node=nodes, way=ways)
+
+        tiles = way_tiles(nodes, ways)
+        if runtime is not None:
+            tiles = runtime.decouple(tiles)
+        out = tiles.projection(['tile', 'id', 'version'])
+        if runtime is not None:
+            out = runtime.decouple(out)
+        recorder = Recorder()
+        out.add_listener(recorder)
+
+        if runtime is not None:
+            inputs = dict(zip(['node', 'way'],
+                              runtime.inlet(nodes, ways)))
+            with runtime:
+                for kind, rows in pushes:
+                    inputs[kind].push_rows(rows)
+        else:
+            for kind, rows in pushes:
+                inputs[kind].push_rows(rows)
+        return recorder.rows
+
+    def test_runtime_deterministic(self):
+        pushes = self._pushes()
+        expected = self._run(pushes)
+        self.assertTrue(expected)
+        for maxsize in (1, 4):
+            self.assertEqual(expected, self._run(pushes, Runtime(maxsize)))
+
+    def test_runtime_backpressure(self):
+        stream = self.Stream(['a'])
+        release = threading.Event()
+        recorder = Recorder(release)
+        runtime = Runtime(maxsize=2)
+        sink = runtime.decouple(stream)
+        sink.add_listener(recorder)
+        inlet, = runtime.inlet(stream)
+        runtime.start()
+
+        pushed = list()
+
+        def produce():
+            for i in range(20):
+                inlet.push_rows([(i,)])
+                pushed.append(i)
+
+        producer = threading.Thread(target=produce)
+        producer.daemon = True
+        producer.start()
+        time.sleep(0.2)
+        # the sink has one call in hand and two queued, the network one in
+        # hand and two queued, and the producer is waiting to queue another.
+        self.assertEqual(6, len(pushed))
+
+        release.set()
+        producer.join()
+        runtime.close()
+        self.assertEqual([(i,) for i in range(20)], recorder.rows)
+
+    def test_runtime_errors(self):
+        stream = self.Stream(['a'])
+        out = stream.join_func(['a'], 'b', lambda a: 1 // a)
+        runtime = Runtime()
+        out = runtime.decouple(out).collect_rows()
+        inlet, = runtime.inlet(stream)
+        runtime.start()
+        inlet.push_rows([(1,), (0,)])
+        self.assertRaises(ZeroDivisionError, runtime.join)
+        # once a thread has failed, pushing to it fails too.
+        self.assertRaises(ZeroDivisionError, inlet.push_rows, [(2,)])
+        self.assertRaises(ZeroDivisionError, runtime.close)
+        self.assertEqual([], out.fetch())
+
+        # a join with its inputs in different threads.
+        left = self.Stream(['a', 'b'])
+        right = self.Stream(['b', 'c'])
+        runtime = Runtime()
+        runtime.decouple(left).natural_join(runtime.decouple(right))
+        self.assertRaises(ValueError, runtime.start)
+        runtime.close()
+
+    def test_runtime_reader(self):
+        nodes = self.Stream(['id', 'deleted'])
+        ways = self.Stream(['id', 'nodes'])
+        runtime = Runtime()
+        collected = runtime.decouple(nodes.coalesce(100)).collect_rows()
+        inlets = runtime.inlet(nodes, ways)
+        with runtime:
+            push_osm(BytesIO(CHANGE), *inlets)
+        # push_osm flushed the coalescer, through the runtime.
+        self.assertEqual([(6, False), (2, True)], collected.fetch())
+
+
+class TestStreamingRuntime(RuntimeTests, TestCase):
+    Stream = streaming.Stream
+
+
+class TestExternalRuntime(RuntimeTests, TestCase):
+    Stream = external.Stream
+
+    def test_runtime_store(self):
+        # the join and deduplication state is in sqlite, and used from the
+        # runtime's threads rather than the one which opened the store.
+        pushes = self._pushes()
+        expected = self._run(pushes)
+        tmp = tempfile.mkdtemp()
+        try:
+            with SqliteStore(os.path.join(tmp, 'state.db')) as store:
+                def stream(attr_names):
+                    return external.Stream(
+                        attr_names, dedup_factory=store.deduplicator,
+                        dict_factory=store.dictionary)
+                self.Stream = stream
+                self.assertEqual(expected, self._run(pushes, Runtime(2)))
+                self.assertTrue(store.transactions > 0)
+        finally:
+            del self.Stream
+            shutil.rmtree(tmp)
@@ -0,0 +1,126 @@
+import os
+import random
+import shutil
+import tempfile
+from functools import partial
+from unittest import TestCase
+from neat.external import Dictionary, Stream
+from neat.sharded import sharded_natural_join
+from neat.store import SqliteStore
+
+
+class FailingDictionary(Dictionary):
+    def get_and_add(self, key, pos, pos_key):
+        if key == (13,):
+            raise KeyError(key)
+        return Dictionary.get_and_add(self, key, pos, pos_key)
+
+
+class TestShardedJoin(TestCase):
+
+    def _pushes(self, seed=0):
+        rng = random.Random(seed)
+        pushes = list()
+        for _ in range(60):
+            n = rng.randrange(0, 8)
+            if rng.random() < 0.5:
+                pushes.append((0, [(rng.randrange(30), rng.randrange(10))
+                                   for _ in range(n)]))
+            else:
+                pushes.append((1, [(rng.randrange(10), u'v%d'
+                                    % rng.randrange(5)) for _ in range(n)]))
+        return pushes
+
+    def _run(self, pushes, shards=None):
+        left = Stream(['a', 'b'])
+        right = Stream(['b', 'c'])
+        if shards is None:
+            out, js = left.natural_join(right), None
+        else:
+            out, js = sharded_natural_join(left, right, shards)
+        c = out.collect_rows()
+
+        batches = list()
+        try:
+            for pos, rows in pushes:
+                (left, right)[pos].push_rows(rows)
+                batches.append(c.fetch())
+        finally:
+            if js is not None:
+                js.close()
+        return out.attr_names, batches, js
+
+    def test_sharded_join_same_output(self):
+        pushes = self._pushes()
+        expected = self._run(pushes)[:2]
+        self.assertTrue(any(expected[1]))
+        for shards in (1, 3):
+            self.assertEqual(expected, self._run(pushes, shards)[:2])
+
+    def test_sharded_join_stats(self):
+        # node 7 is in every way, and the second push repeats (7, 'w7').
+        pushes = [(1, [(7, u'w%d' % i) for i in range(50)]),
+                  (1, [(i, u'w%d' % i) for i in range(20)]),
+                  (0, [(100, 7), (101, 3)]),
+                  (0, [(100, 7)])]
+        js = self._run(pushes, shards=2)[2]
+
+        self.assertEqual(73, sum(s.rows for s in js.stats))
+        self.assertEqual(51, sum(s.outputs for s in js.stats))
+        hot = max(js.stats, key=lambda s: s.hottest_fanout)
+        self.assertEqual(((7,), 50), (hot.hottest_key, hot.hottest_fanout))
+        self.assertTrue(js.skew > 1.0)
+
+    def test_sharded_join_failure(self):
+        left = Stream(['a', 'b'])
+        right = Stream(['b', 'c'])
+        out, js = sharded_natural_join(left, right, 3,
+                                       dict_factory=FailingDictionary)
+        c = out.collect_rows()
+        try:
+            left.push_rows([(1, 1), (2, 2)])
+            right.push_rows([(1, 10)])
+            self.assertEqual([(1, 1, 10)], c.fetch())
+
+            # every shard is busy with this push, and one of them fails.
+            self.assertRaises(RuntimeError, right.push_rows,
+                              [(b, 10) for b in range(20)])
+            self.assertEqual([], c.fetch())
+            # the other shards' replies were all read, but the join is
+            # broken now.
+            try:
+                left.push_rows([(3, 3)])
+                self.fail("Pushing into a broken join should fail.")
+            except RuntimeError as e:
+                self.assertTrue('shard' in str(e) and 'KeyError' in str(e))
+        finally:
+            js.close()
+        self.assertRaises(RuntimeError, left.push_rows, [(4, 4)])
+
+    def test_sharded_join_closed(self):
+        left = Stream(['a', 'b'])
+        right = Stream(['b', 'c'])
+        out, js = sharded_natural_join(left, right, 2)
+        js.close()
+        try:
+            left.push_rows([(1, 1)])
+            self.fail("Pushing into a closed join should fail.")
+        except RuntimeError as e:
+            self.assertTrue('closed' in str(e))
+
+    def test_sharded_join_rejects_store(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            with SqliteStore(os.path.join(tmp, 'state.db')) as store:
+                left = Stream(['a', 'b'], dict_factory=store.dictionary)
+                right = Stream(['b', 'c'])
+                self.assertRaises(ValueError, sharded_natural_join,
+                                  left, right, 2)
+                self.assertRaises(ValueError, sharded_natural_join,
+                                  left, right, 2,
+                                  partial(store.dictionary, codec=None))
+                out, js = sharded_natural_join(left, right, 2,
+                                               dict_factory=Dictionary)
+                js.close()
+        finally:
+            shutil.rmtree(tmp)
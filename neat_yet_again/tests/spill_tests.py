@@ -0,0 +1,73 @@
+from unittest import TestCase
+import neat.relation
+from neat.relation import Relation
+from neat.spill import estimate_size
+
+
+class TestSpill(TestCase):
+
+    def setUp(self):
+        self._old_budget = neat.relation.MEMORY_BUDGET
+        self.r1 = Relation(['a', 'b'], [(i, i % 7) for i in range(500)])
+        self.r2 = Relation(['b', 'c'], [(i % 7, 'c%d' % i)
+                                        for i in range(300)])
+        self.r3 = Relation(['a', 'b'], [(i, i % 7) for i in range(250, 750)])
+
+    def tearDown(self):
+        neat.relation.MEMORY_BUDGET = self._old_budget
+
+    def _both(self, func):
+        neat.relation.MEMORY_BUDGET = None
+        expected = func()
+        neat.relation.MEMORY_BUDGET = 1024
+        result = func()
+        return expected, result
+
+    def test_spill_estimate_size(self):
+        self.assertEqual(0, estimate_size([]))
+        self.assertTrue(estimate_size(self.r1.tuples) >
+                        estimate_size(self.r2.tuples) > 0)
+
+    def _fresh(self, r):
+        # a copy of the relation without any cached indexes.
+        return Relation(r.attribute_names, r.tuples)
+
+    def test_spill_natural_join(self):
+        expected, result = self._both(
+            lambda: self._fresh(self.r1).natural_join(self._fresh(self.r2)))
+        self.assertEqual(expected, result)
+        self.assertEqual(0, expected.spilled_bytes)
+        self.assertTrue(result.spilled_bytes > 0)
+
+        expected, result = self._both(
+            lambda: self._fresh(self.r2).natural_join(self._fresh(self.r1)))
+        self.assertEqual(expected, result)
+        self.assertTrue(result.spilled_bytes > 0)
+
+    def test_spill_cached_index(self):
+        # once the build side has an index, the join doesn't need any more
+        # memory for it, so there's nothing to spill.
+        self.r2.natural_join(self.r1)
+        neat.relation.MEMORY_BUDGET = 1024
+        self.assertEqual(0, self.r2.natural_join(self.r1).spilled_bytes)
+
+    def test_spill_set_operations(self):
+        for op in ('union', 'intersection', 'difference'):
+            expected, result = self._both(
+                lambda: getattr(self.r1, op)(self.r3))
+            self.assertEqual(expected, result)
+            self.assertTrue(result.spilled_bytes > 0)
+
+    def test_spill_under_budget(self):
+        neat.relation.MEMORY_BUDGET = 1 << 30
+        result = self.r1.union(self.r3)
+        self.assertEqual(0, result.spilled_bytes)
+
+    def test_spill_skewed_key(self):
+        # every tuple has the same join key, so re-partitioning can't help
+        # and it should give up and join in memory.
+        r1 = Relation(['a', 'b'], [(i, 0) for i in range(200)])
+        r2 = Relation(['b', 'c'], [(0, i) for i in range(200)])
+        expected, result = self._both(
+            lambda: self._fresh(r1).natural_join(self._fresh(r2)))
+        self.assertEqual(expected, result)
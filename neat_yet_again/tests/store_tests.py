@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from functools import partial
+from neat.codec import RowCodec
+from neat.external import Stream
+from neat.store import SqliteStore, LRUCache
+
+try:
+    long
+except NameError:
+    long = int
+
+
+class TestStore(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'state.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _network(self, store):
+        nodes = Stream(['id', 'tile'], dedup_factory=store.deduplicator,
+                       dict_factory=store.dictionary)
+        ways = Stream(['way', 'id'], dedup_factory=store.deduplicator,
+                      dict_factory=store.dictionary)
+        out = nodes.natural_join(ways).projection(['way', 'tile'])
+        return nodes, ways, out.collect()
+
+    def test_lru_cache(self):
+        c = LRUCache(2)
+        c.put('a', 1)
+        c.put('b', 2)
+        self.assertEqual(1, c.get('a'))
+        c.put('c', 3)
+        self.assertTrue('a' in c)
+        self.assertFalse('b' in c)
+        self.assertEqual(2, len(c))
+        self.assertRaises(ValueError, LRUCache, 0)
+
+    def test_store_join(self):
+        with SqliteStore(self.path) as store:
+            nodes, ways, c = self._network(store)
+            nodes.push([dict(id=1, tile='0/0'), dict(id=2, tile='0/1')])
+            ways.push([dict(way=10, id=1), dict(way=10, id=2),
+                       dict(way=11, id=2)])
+            self.assertEqual(
+                [(10, '0/0'), (10, '0/1'), (11, '0/1')],
+                sorted((r['way'], r['tile']) for r in c.fetch()))
+
+    def test_store_one_transaction_per_batch(self):
+        with SqliteStore(self.path) as store:
+            nodes, ways, c = self._network(store)
+            nodes.push([dict(id=i, tile='0/0') for i in range(100)])
+            # the join only, since nothing came out to deduplicate.
+            self.assertEqual(1, store.transactions)
+
+            ways.push([dict(way=10, id=i) for i in range(100)])
+            # the join, then the projection.
+            self.assertEqual(3, store.transactions)
+            self.assertEqual([dict(way=10, tile='0/0')], c.fetch())
+
+    def test_store_persists(self):
+        with SqliteStore(self.path) as store:
+            nodes, ways, c = self._network(store)
+            nodes.push([dict(id=1, tile='0/0')])
+            ways.push([dict(way=10, id=1)])
+            self.assertEqual([dict(way=10, tile='0/0')], c.fetch())
+
+        # after a restart, the join still knows about node 1, and the
+        # projection has already emitted (10, '0/0').
+        with SqliteStore(self.path) as store:
+            nodes, ways, c = self._network(store)
+            ways.push([dict(way=11, id=1), dict(way=10, id=1)])
+            nodes.push([dict(id=1, tile='0/0')])
+            self.assertEqual([dict(way=11, tile='0/0')], c.fetch())
+
+    def test_store_small_cache(self):
+        # keys fall out of the cache before they're flushed, and must be
+        # read back along with their unwritten changes.
+        with SqliteStore(self.path, cache_size=1) as store:
+            nodes, ways, c = self._network(store)
+            nodes.push([dict(id=1, tile='0/0'), dict(id=2, tile='0/1'),
+                        dict(id=1, tile='0/0')])
+            ways.push([dict(way=10, id=1), dict(way=10, id=2),
+                       dict(way=10, id=1)])
+            self.assertEqual(
+                [(10, '0/0'), (10, '0/1')],
+                sorted((r['way'], r['tile']) for r in c.fetch()))
+
+    def test_store_dictionary_codec(self):
+        # every join key, and the key of each side, is a single integer.
+        def network(store):
+            factory = partial(store.dictionary, codec=RowCodec(['int64']))
+            left = Stream(['a', 'b'], dict_factory=factory)
+            right = Stream(['b', 'c'], dict_factory=factory)
+            return left, right, left.natural_join(right).collect_rows()
+
+        with SqliteStore(self.path) as store:
+            left, right, c = network(store)
+            left.push_rows([(1, 10), (2, 20)])
+            right.push_rows([(10, 100)])
+            self.assertEqual([(1, 10, 100)], c.fetch())
+            lengths = store._conn.execute(
+                'SELECT DISTINCT length(key), length(pos_key) FROM join_0')
+            self.assertEqual([(8, 8)], lengths.fetchall())
+
+        with SqliteStore(self.path) as store:
+            left, right, c = network(store)
+            right.push_rows([(20, 200)])
+            self.assertEqual([(2, 20, 200)], c.fetch())
+
+    def test_store_equal_keys(self):
+        # keys equal to those written, but built differently, are found
+        # after a restart, and once they've dropped out of the cache.
+        def network(store):
+            tags = Stream(['id', 'key'], dedup_factory=store.deduplicator,
+                          dict_factory=store.dictionary)
+            values = Stream(['key', 'value'],
+                            dedup_factory=store.deduplicator,
+                            dict_factory=store.dictionary)
+            out = tags.natural_join(values).projection(['id', 'value'])
+            return tags, values, out.collect_rows()
+
+        with SqliteStore(self.path) as store:
+            tags, values, c = network(store)
+            tags.push_rows([(1, 'highway')])
+            values.push_rows([('highway', u'path')])
+            self.assertEqual([(1, u'path')], c.fetch())
+
+        with SqliteStore(self.path, cache_size=1) as store:
+            tags, values, c = network(store)
+            values.push_rows([(''.join(['high', 'way']), u'track')])
+            tags.push_rows([(long(2), u'highway'), (3, 'other')])
+            # (1, u'path') was emitted before the restart.
+            values.push_rows([(u'high' + u'way', ''.join(['pa', 'th']))])
+            self.assertEqual(
+                [(1, u'track'), (2, u'path'), (2, u'track')],
+                sorted(c.fetch()))
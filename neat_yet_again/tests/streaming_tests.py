@@ -97,3 +97,36 @@ class TestStreaming(TestCase):
                 dict(id=2,stuff=3)
             ]),
             sorted(c.fetch()))
+
+    def test_streaming_rows(self):
+        s1 = Stream(['a', 'b'])
+        s2 = Stream(['b', 'c'])
+        j = s1.natural_join(s2).projection(['a', 'c'])
+        c = j.collect_rows()
+
+        s1.push_rows([(1, 1), (2, 1)])
+        s2.push_rows([(1, 3)])
+        self.assertEqual(sorted([(1, 3), (2, 3)]), sorted(c.fetch()))
+
+    def test_streaming_rename(self):
+        s = Stream(['a', 'b'])
+        r = s.rename(['x', 'y'])
+        c = r.collect()
+
+        s.push([dict(a=1, b=2)])
+        self.assertEqual([dict(x=1, y=2)], c.fetch())
+
+    def test_streaming_dict_listener(self):
+        class Sink(object):
+            def __init__(self):
+                self.items = list()
+
+            def push(self, items):
+                self.items.extend(items)
+
+        s = Stream(['a'])
+        sink = Sink()
+        s.join_func(['a'], 'b', lambda a: a + 1).add_dict_listener(sink)
+
+        s.push([dict(a=1), dict(a=2)])
+        self.assertEqual([dict(a=1, b=2), dict(a=2, b=3)], sink.items)
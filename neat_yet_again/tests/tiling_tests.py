@@ -0,0 +1,161 @@
+from unittest import TestCase, skipIf
+from neat import tiling
+from neat.external import Deduplicator, Stream as ExternalStream
+from neat.streaming import Stream
+from neat.tiles import node_tiles, way_tiles, multi_zoom_node_tiles, \
+    multi_zoom_way_tiles
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class TestTiling(TestCase):
+
+    def test_tile_xy(self):
+        self.assertEqual((0, 0), tiling.tile_xy(0, 0, 0))
+        self.assertEqual((1, 1), tiling.tile_xy(0.1, -0.1, 1))
+        self.assertEqual((0, 0), tiling.tile_xy(-0.1, 0.1, 1))
+        # a well-known tile, containing San Francisco.
+        self.assertEqual((655, 1583), tiling.tile_xy(-122.4194, 37.7749, 12))
+        # clamped at the edges of the map.
+        self.assertEqual((3, 0), tiling.tile_xy(180, 90, 2))
+        self.assertEqual((0, 3), tiling.tile_xy(-180, -90, 2))
+
+    def test_tile_code_round_trip(self):
+        for zoom, x, y in [(0, 0, 0), (1, 1, 0), (12, 655, 1583),
+                           (31, (1 << 31) - 1, 12345)]:
+            code = tiling.tile_code(x, y, zoom)
+            self.assertEqual((zoom, x, y), tiling.tile_coords(code))
+            self.assertEqual(zoom, tiling.zoom_of(code))
+        self.assertEqual('12/655/1583',
+                         tiling.tile_name(tiling.tile_code(655, 1583, 12)))
+        self.assertRaises(ValueError, tiling.tile_code, 0, 0, 32)
+
+    def test_at_zooms(self):
+        code = tiling.tile_code(655, 1583, 12)
+        self.assertEqual((tiling.parent(code, 12), tiling.parent(code, 2),
+                          code), tiling.at_zooms(code, (0, 10, 12)))
+        self.assertRaises(ValueError, tiling.at_zooms, code, (13,))
+
+    def test_tile_hierarchy(self):
+        code = tiling.tile_code(655, 1583, 12)
+        self.assertEqual(tiling.tile_code(327, 791, 11),
+                         tiling.parent(code))
+        self.assertEqual(tiling.tile_code(2, 6, 4),
+                         tiling.parent(code, 8))
+        self.assertRaises(ValueError, tiling.parent, code, 13)
+
+        self.assertEqual(
+            sorted([tiling.tile_code(x, y, 13)
+                    for x in (1310, 1311) for y in (3166, 3167)]),
+            tiling.children(code))
+        for c in tiling.children(code):
+            self.assertEqual(code, tiling.parent(c))
+
+        ancestors = tiling.ancestors(code, 10)
+        self.assertEqual([12, 11, 10],
+                         [tiling.zoom_of(a) for a in ancestors])
+        self.assertEqual(tiling.parent(code, 2), ancestors[-1])
+
+    @skipIf(np is None, "numpy not installed")
+    def test_tile_codes_vectorized(self):
+        lons = [-122.4194, 0.1, -180, 179.9, 13.4]
+        lats = [37.7749, -0.1, -90, 85.1, 52.5]
+        codes = tiling.tile_codes(np.array(lons), np.array(lats), 16)
+        self.assertEqual(
+            [tiling.tile_for(lon, lat, 16) for lon, lat in zip(lons, lats)],
+            codes.tolist())
+
+    def test_tile_func_in_network(self):
+        func = tiling.tile_func(1)
+        nodes = Stream(['id', 'version', 'lon', 'lat'])
+        tiles = node_tiles(nodes, func).\
+            projection(['tile', 'id', 'version']).collect()
+        nodes.push([dict(id=1, version=1, lon=-1, lat=1)])
+        nodes.push([dict(id=1, version=2, lon=1, lat=1)])
+
+        self.assertEqual(
+            [('1/0/0', 1), ('1/0/0', 2), ('1/1/0', 1), ('1/1/0', 2)],
+            sorted((tiling.tile_name(r['tile']), r['version'])
+                   for r in tiles.fetch()))
+
+
+class MultiZoomTests(object):
+
+    zooms = (4, 8, 12)
+
+    def _push(self, nodes, ways):
+        nodes.push([dict(id=1, version=1, lon=0.01, lat=0.01),
+                    dict(id=2, version=1, lon=0.02, lat=0.02)])
+        ways.push([dict(id=10, version=1, nodes=(1, 2))])
+        nodes.push([dict(id=2, version=2, lon=1.5, lat=1.5)])
+
+    def _fetch(self, collector):
+        return sorted((r['tile'], r['id'], r['version'])
+                      for r in collector.fetch())
+
+    def _single_zoom(self, zoom):
+        nodes = self.Stream(['id', 'version', 'lon', 'lat'])
+        ways = self.Stream(['id', 'version', 'nodes'])
+        func = tiling.tile_func(zoom)
+        n = node_tiles(nodes, func).\
+            projection(['tile', 'id', 'version']).collect()
+        w = way_tiles(nodes, ways, func).\
+            projection(['tile', 'id', 'version']).collect()
+        self._push(nodes, ways)
+        return self._fetch(n), self._fetch(w)
+
+    def test_multi_zoom_matches_single_zooms(self):
+        nodes = self.Stream(['id', 'version', 'lon', 'lat'])
+        ways = self.Stream(['id', 'version', 'nodes'])
+        n = multi_zoom_node_tiles(nodes, self.zooms).\
+            projection(['tile', 'id', 'version']).collect()
+        w = multi_zoom_way_tiles(nodes, ways, self.zooms).\
+            projection(['tile', 'id', 'version']).collect()
+        self._push(nodes, ways)
+
+        expected_nodes = list()
+        expected_ways = list()
+        for zoom in self.zooms:
+            node_rows, way_rows = self._single_zoom(zoom)
+            expected_nodes.extend(node_rows)
+            expected_ways.extend(way_rows)
+
+        self.assertEqual(sorted(expected_nodes), self._fetch(n))
+        self.assertEqual(sorted(expected_ways), self._fetch(w))
+        self.assertTrue(len(set(tiling.zoom_of(t) for t, _, _ in
+                                expected_ways)) == 3)
+
+
+class TestStreamingMultiZoom(MultiZoomTests, TestCase):
+    Stream = Stream
+
+
+class TestExternalMultiZoom(MultiZoomTests, TestCase):
+    Stream = ExternalStream
+
+    def test_multi_zoom_dedup_state(self):
+        # expanding to more zooms doesn't add any deduplication state.
+        def count(build):
+            made = list()
+
+            def factory():
+                made.append(Deduplicator())
+                return made[-1]
+
+            nodes = ExternalStream(['id', 'version', 'lon', 'lat'],
+                                   dedup_factory=factory)
+            ways = ExternalStream(['id', 'version', 'nodes'],
+                                  dedup_factory=factory)
+            build(nodes, ways)
+            self._push(nodes, ways)
+            return len(made), sum(len(d._obj) for d in made)
+
+        func = tiling.tile_func(max(self.zooms))
+        self.assertEqual(
+            count(lambda n, w: (node_tiles(n, func),
+                                way_tiles(n, w, func))),
+            count(lambda n, w: (multi_zoom_node_tiles(n, self.zooms),
+                                multi_zoom_way_tiles(n, w, self.zooms))))
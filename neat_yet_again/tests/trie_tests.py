@@ -0,0 +1,205 @@
+import os
+import random
+import shutil
+import tempfile
+from unittest import TestCase, skipIf
+from neat import tiling
+from neat.streaming import Stream
+from neat.tiles import multi_zoom_node_tiles, write_to_trie
+from neat import trie as trie_module
+from neat.trie import BufferedRepositoryTrie
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+class TestTrie(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _pairs(self, n, depth, seed=0):
+        rng = random.Random(seed)
+        n_tiles = 1 << depth
+        return [(('n', i, 1),
+                 tiling.tile_code(rng.randrange(n_tiles),
+                                  rng.randrange(n_tiles), depth))
+                for i in range(n)]
+
+    def _expected(self, pairs):
+        expected = dict()
+        for element, tile in pairs:
+            expected.setdefault(tile, set()).add(element)
+        return expected
+
+    def test_trie_insert_query(self):
+        trie = BufferedRepositoryTrie(self.dir, buffer_size=8, depth=3)
+        pairs = self._pairs(200, 3)
+        for i in range(0, len(pairs), 7):
+            trie.insert(pairs[i:i + 7])
+
+        for tile, elements in self._expected(pairs).items():
+            self.assertEqual(elements, trie.query(tile))
+        # nothing was inserted at zoom 1.
+        self.assertEqual(set(), trie.query(tiling.tile_code(0, 1, 1)))
+
+    def test_trie_query_reads(self):
+        trie = BufferedRepositoryTrie(self.dir, buffer_size=8, depth=3)
+        pairs = self._pairs(200, 3)
+        for i in range(0, len(pairs), 7):
+            trie.insert(pairs[i:i + 7])
+
+        trie.reads = 0
+        trie.query(pairs[0][1])
+        self.assertTrue(trie.reads <= 4)
+
+    def test_trie_assemble_sorted(self):
+        trie = BufferedRepositoryTrie(self.dir, buffer_size=50, depth=2)
+        tile = tiling.tile_code(1, 2, 2)
+        other = tiling.tile_code(2, 1, 2)
+        rng = random.Random(1)
+        ids = list(range(300))
+        rng.shuffle(ids)
+        # the same tile's elements end up spread over runs in several nodes,
+        # including a duplicate.
+        for i in range(0, len(ids), 20):
+            trie.insert([(('n', j, 1), tile) for j in ids[i:i + 20]] +
+                        [(('n', j, 1), other) for j in ids[i:i + 5]])
+        trie.insert([(('n', 7, 1), tile)])
+
+        assembled = list(trie.assemble(tile))
+        self.assertEqual([('n', j, 1) for j in range(300)], assembled)
+
+    def test_trie_assemble_skips_chunks(self):
+        chunk = trie_module.RUN_CHUNK
+        trie_module.RUN_CHUNK = 4
+        try:
+            trie = BufferedRepositoryTrie(self.dir, buffer_size=100,
+                                          depth=1)
+            tiles = [tiling.tile_code(x, y, 1) for x in (0, 1)
+                     for y in (0, 1)]
+            trie.insert([(i, t) for t in tiles for i in range(8)])
+
+            read = list()
+            real_read_chunk = trie_module._read_chunk
+
+            def read_chunk(f, base, chunk):
+                read.append(chunk)
+                return real_read_chunk(f, base, chunk)
+
+            trie_module._read_chunk = read_chunk
+            try:
+                self.assertEqual(list(range(8)),
+                                 list(trie.assemble(tiles[2])))
+            finally:
+                trie_module._read_chunk = real_read_chunk
+            self.assertEqual(2, len(read))
+        finally:
+            trie_module.RUN_CHUNK = chunk
+
+    @skipIf(resource is None, "needs the resource module")
+    def test_trie_assemble_many_runs(self):
+        # a leaf with more runs than there are file descriptors to go round.
+        max_runs = trie_module.MAX_RUNS
+        trie_module.MAX_RUNS = 1000
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        try:
+            trie = BufferedRepositoryTrie(self.dir, depth=0)
+            root = tiling.tile_code(0, 0, 0)
+            for i in range(300):
+                trie.insert([(300 - i, root)])
+
+            resource.setrlimit(resource.RLIMIT_NOFILE, (64, hard))
+            self.assertEqual(list(range(1, 301)), list(trie.assemble(root)))
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+            trie_module.MAX_RUNS = max_runs
+
+    def test_trie_compacts_runs(self):
+        max_runs = trie_module.MAX_RUNS
+        chunk = trie_module.RUN_CHUNK
+        trie_module.MAX_RUNS = 4
+        trie_module.RUN_CHUNK = 3
+        try:
+            trie = BufferedRepositoryTrie(self.dir, buffer_size=1, depth=1)
+            tiles = [tiling.tile_code(0, 0, 1), tiling.tile_code(1, 0, 1)]
+            expected = dict((t, set()) for t in tiles)
+            for i in range(30):
+                tile = tiles[i % 3 == 0]
+                # every element is inserted twice.
+                trie.insert([(i // 2, tile)])
+                expected[tile].add(i // 2)
+
+            leaf = tiling.tile_code(0, 0, 1)
+            generation, count, runs = trie._head(leaf)
+            self.assertTrue(generation > 0)
+            self.assertTrue(runs <= 4)
+            self.assertEqual(runs, len(os.listdir(os.path.join(
+                self.dir, '%x' % leaf, '%d' % generation))))
+
+            trie = BufferedRepositoryTrie(self.dir, buffer_size=1, depth=1)
+            self.assertEqual((generation, count, runs), trie._head(leaf))
+            for tile in tiles:
+                self.assertEqual(sorted(expected[tile]),
+                                 list(trie.assemble(tile)))
+        finally:
+            trie_module.MAX_RUNS = max_runs
+            trie_module.RUN_CHUNK = chunk
+
+    def test_trie_reopen(self):
+        pairs = self._pairs(100, 3)
+        trie = BufferedRepositoryTrie(self.dir, buffer_size=4, depth=3)
+        trie.insert(pairs[:50])
+
+        trie = BufferedRepositoryTrie(self.dir, buffer_size=4, depth=3)
+        trie.insert(pairs[50:])
+        for tile, elements in self._expected(pairs).items():
+            self.assertEqual(elements, trie.query(tile))
+
+    def test_trie_never_deletes(self):
+        trie = BufferedRepositoryTrie(self.dir, buffer_size=2, depth=2)
+        root = tiling.tile_code(0, 0, 0)
+        trie.insert([(1, tiling.tile_code(0, 0, 2))])
+        first = os.listdir(os.path.join(self.dir, '%x' % root, '0'))
+
+        trie.insert([(2, tiling.tile_code(0, 0, 2)),
+                     (3, tiling.tile_code(1, 1, 2))])
+        self.assertEqual(
+            first, os.listdir(os.path.join(self.dir, '%x' % root, '0')))
+        with open(os.path.join(self.dir, '%x' % root, 'HEAD')) as f:
+            self.assertEqual('1', f.read())
+        self.assertEqual(set([1, 2]), trie.query(tiling.tile_code(0, 0, 2)))
+
+    def test_trie_mixed_zooms(self):
+        trie = BufferedRepositoryTrie(self.dir, buffer_size=1, depth=4)
+        coarse = tiling.tile_code(1, 1, 1)
+        fine = tiling.tile_code(5, 6, 4)
+        trie.insert([(1, coarse), (2, fine), (3, coarse)])
+        trie.insert([(4, fine)])
+        self.assertEqual(set([1, 3]), trie.query(coarse))
+        self.assertEqual(set([2, 4]), trie.query(fine))
+
+        self.assertRaises(ValueError, trie.insert,
+                          [(5, tiling.tile_code(0, 0, 5))])
+        self.assertRaises(ValueError, BufferedRepositoryTrie, self.dir, 0)
+
+    def test_trie_from_network(self):
+        trie = BufferedRepositoryTrie(self.dir, buffer_size=2, depth=10)
+        nodes = Stream(['id', 'version', 'lon', 'lat'])
+        tiles = multi_zoom_node_tiles(nodes, (5, 10)).\
+            projection(['tile', 'id', 'version'])
+        write_to_trie(tiles, trie)
+
+        nodes.push([dict(id=1, version=1, lon=0.01, lat=0.01),
+                    dict(id=2, version=1, lon=0.02, lat=0.02)])
+        nodes.push([dict(id=1, version=2, lon=10, lat=10)])
+
+        tile = tiling.tile_for(0.01, 0.01, 5)
+        self.assertEqual(set([(1, 1), (2, 1), (1, 2)]), trie.query(tile))
+        tile = tiling.tile_for(10, 10, 10)
+        self.assertEqual(set([(1, 1), (1, 2)]), trie.query(tile))